@@ -0,0 +1,299 @@
+"""
+Batch question answering (POST /chat/batch and CLI).
+
+    python batch_qa.py questions.txt -o answers.ndjson
+    python batch_qa.py questions.txt --url http://localhost:8000
+
+Questions are deduplicated, routed and looked up in the caches together. The
+rest are expanded several per LLM call, embedded in one batched pass and
+searched together, and answered with bounded concurrency. Results come back
+as NDJSON lines in completion order, tagged with the input index.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+import rag
+from components import registry
+from cache import normalize_text
+from concurrency import Overloaded
+from context_packing import NO_CONTEXT, pack_context
+from intent_router import classify_intent, direct_response, MEDICAL
+from llm_client import llm_breaker
+from metrics import stage, count_request
+from model import answer_prompt, DEGRADED_PREFIX, NO_DATA_RESPONSE, response_cache, llm_governor, chunk_text
+
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+# Số lượt gọi LLM đồng thời của một lô (nhỏ hơn LLM_MAX_CONCURRENCY để chừa chỗ cho chat trực tiếp)
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+# Số câu hỏi trong một lần gọi query expansion
+BATCH_EXPANSION_SIZE = int(os.getenv("BATCH_EXPANSION_SIZE", "10"))
+# Số câu hỏi truy xuất cùng nhau; nhóm trước được sinh câu trả lời trong khi nhóm sau đang truy xuất
+BATCH_RETRIEVAL_SIZE = int(os.getenv("BATCH_RETRIEVAL_SIZE", "64"))
+# Thời gian tối đa một lượt gọi LLM của lô chờ slot khi hệ thống quá tải (sau đó: lỗi / chế độ suy giảm)
+BATCH_OVERLOAD_TIMEOUT = float(os.getenv("BATCH_OVERLOAD_TIMEOUT", "120"))
+
+def dedupe_questions(questions):
+    """
+    Returns:
+        tuple: (unique questions, for each the list of input indexes asking it)
+    """
+    unique, positions, seen = [], [], {}
+    for i, question in enumerate(questions):
+        key = normalize_text(question)
+        if key not in seen:
+            seen[key] = len(unique)
+            unique.append(question.strip())
+            positions.append([])
+        positions[seen[key]].append(i)
+    return unique, positions
+
+async def gated_llm_call(semaphore, call):
+    """
+    Run `call()` under the batch's concurrency limit and an LLM governor slot.
+    Raises Overloaded when no slot was granted within BATCH_OVERLOAD_TIMEOUT.
+    """
+    async with semaphore:
+        deadline = time.monotonic() + BATCH_OVERLOAD_TIMEOUT
+        while True:
+            try:
+                async with llm_governor.slot():
+                    return await call()
+            except Overloaded as overloaded:
+                if time.monotonic() + overloaded.retry_after > deadline:
+                    raise
+                # Lô không cần trả lời ngay: nhường slot cho chat trực tiếp rồi thử lại
+                await asyncio.sleep(overloaded.retry_after)
+
+async def expand_batch(questions, semaphore):
+    """
+    Rewrites for every question, BATCH_EXPANSION_SIZE questions per LLM call.
+
+    Returns:
+        tuple: (rewrites per question, whether each question got its rewrites)
+    """
+    if rag.QUERY_EXPANSION_COUNT <= 0:
+        return [[] for _ in questions], [True] * len(questions)
+    if llm_breaker.is_open():
+        return [[] for _ in questions], [False] * len(questions)
+    llm = await asyncio.to_thread(registry.get, "batch_expansion_llm")
+    chain = rag.prompt_batch_expansion | llm | StrOutputParser()
+
+    async def expand(group):
+        try:
+            text = await gated_llm_call(semaphore, lambda: chain.ainvoke(rag.batch_expansion_input(group)))
+            return rag.parse_batch_expansion(text, group)
+        except Exception as e:
+            print(f"Batch query expansion error: {e}")
+            return [[] for _ in group]
+
+    groups = [questions[i:i + BATCH_EXPANSION_SIZE] for i in range(0, len(questions), BATCH_EXPANSION_SIZE)]
+    with stage("batch_expansion"):
+        results = await asyncio.gather(*(expand(group) for group in groups))
+    rewrites = [queries for group in results for queries in group]
+    return rewrites, [bool(queries) for queries in rewrites]
+
+async def retrieve_group(questions, embeddings, semaphore):
+    """Packed context for each question: retrieval cache, BM25 shortcut, else batched RAG Fusion"""
+    def shortcuts():
+        contexts = []
+        for question, embedding in zip(questions, embeddings):
+            context = rag.retrieval_cache.get(question, embedding) if rag.CACHE_ENABLED else None
+            if context is None:
+                results = rag.lexical_only_results(question)
+                if results is not None:
+                    context = pack_context(results, token_budget=rag.CONTEXT_TOKEN_BUDGET)
+            contexts.append(context)
+        return contexts
+
+    contexts = await asyncio.to_thread(shortcuts)
+    rest = [i for i, context in enumerate(contexts) if context is None]
+    if not rest:
+        return contexts
+    rewrites, complete = await expand_batch([questions[i] for i in rest], semaphore)
+    # Câu hỏi đã được encode cho cache: chỉ encode các câu viết lại
+    fresh = await asyncio.to_thread(
+        rag.retrieve_contexts, [questions[i] for i in rest], rewrites, [embeddings[i] for i in rest]
+    )
+    for i, context, ok in zip(rest, fresh, complete):
+        contexts[i] = context
+        # Thiếu query expansion (chế độ suy giảm) thì không cache
+        if rag.CACHE_ENABLED and ok:
+            rag.retrieval_cache.set(questions[i], context, embeddings[i])
+    return contexts
+
+async def generate_answer(question, context, embedding, semaphore):
+    """(answer, status) for one retrieved question, with the retrieved documents as fallback"""
+    if context == NO_CONTEXT:
+        return NO_DATA_RESPONSE, "no_data"
+    messages = [
+        SystemMessage(content=answer_prompt),
+        HumanMessage(content=f"Tài liệu tham khảo:\n{context}\n\nCâu hỏi: {question}")
+    ]
+    llm = await asyncio.to_thread(registry.get, "llm")
+    try:
+        with stage("batch_generation"):
+            response = await gated_llm_call(semaphore, lambda: llm.ainvoke(messages))
+    except Exception as e:
+        print(f"Batch generation error ({e}), answering with retrieved documents")
+        return DEGRADED_PREFIX + context, "degraded"
+    answer = chunk_text(response.content)
+    if rag.CACHE_ENABLED and answer:
+        response_cache.set(question, answer, embedding)
+    return answer, "success"
+
+async def answer_batch(questions):
+    """
+    Answer a list of questions.
+
+    Yields:
+        dict: {"index", "question", "answer", "status"} per input question in
+        completion order (status: success | cached | direct | no_data | degraded | error),
+        then a final {"summary": {...}}
+    """
+    start = time.perf_counter()
+    unique, positions = dedupe_questions(questions)
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    results = asyncio.Queue()
+    statuses = Counter()
+    tasks = []
+    # Câu đã có kết quả hoặc đang được sinh câu trả lời
+    started = set()
+    done = object()
+
+    def finish(u, answer, status):
+        started.add(u)
+        for i in positions[u]:
+            statuses[status] += 1
+            count_request("batch", status)
+            results.put_nowait({"index": i, "question": questions[i], "answer": answer, "status": status})
+
+    async def answer_one(u, context, embedding):
+        try:
+            answer, status = await generate_answer(unique[u], context, embedding, semaphore)
+        except Exception as e:
+            answer, status = f"Có lỗi xảy ra: {str(e)}", "error"
+        finish(u, answer, status)
+
+    def classify_all():
+        lexical_index = registry.get("lexical_index")
+        return [classify_intent(question, lexical_index) for question in unique]
+
+    async def produce():
+        try:
+            intents = await asyncio.to_thread(classify_all)
+            medical = []
+            for u, (question, intent) in enumerate(zip(unique, intents)):
+                if intent == MEDICAL:
+                    medical.append(u)
+                else:
+                    finish(u, direct_response(question, intent), "direct")
+            if not medical:
+                return
+
+            # Một lần encode cho tất cả câu hỏi, dùng cho cả hai cache
+            embedder = await asyncio.to_thread(registry.get, "embedding_model")
+            with stage("embedding"):
+                embeddings = await asyncio.to_thread(embedder.embed_documents, [unique[u] for u in medical])
+            pending = []
+            for u, embedding in zip(medical, embeddings):
+                cached = response_cache.get(unique[u], embedding) if rag.CACHE_ENABLED else None
+                if cached is not None:
+                    finish(u, cached, "cached")
+                else:
+                    pending.append((u, embedding))
+
+            for g in range(0, len(pending), BATCH_RETRIEVAL_SIZE):
+                group = pending[g:g + BATCH_RETRIEVAL_SIZE]
+                try:
+                    contexts = await retrieve_group(
+                        [unique[u] for u, _ in group], [embedding for _, embedding in group], semaphore
+                    )
+                except Exception as e:
+                    print(f"Batch retrieval error: {e}")
+                    for u, _ in group:
+                        finish(u, f"Lỗi khi truy xuất tài liệu: {str(e)}", "error")
+                    continue
+                for (u, embedding), context in zip(group, contexts):
+                    started.add(u)
+                    tasks.append(asyncio.create_task(answer_one(u, context, embedding)))
+        except Exception as e:
+            print(f"Batch error: {e}")
+            # Mỗi chỉ số đầu vào luôn có một dòng kết quả
+            for u in range(len(unique)):
+                if u not in started:
+                    finish(u, f"Có lỗi xảy ra: {str(e)}", "error")
+        finally:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            results.put_nowait(done)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await results.get()
+            if item is done:
+                break
+            yield item
+        await producer
+        yield {"summary": {
+            "questions": len(questions),
+            "unique": len(unique),
+            "statuses": dict(statuses),
+            "elapsed": round(time.perf_counter() - start, 3),
+        }}
+    finally:
+        # Client ngắt kết nối: dừng các lượt sinh còn lại
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+
+def read_questions(path):
+    """One question per non-empty line ('-' for stdin); the result index is the position in this list"""
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        return [line.strip() for line in f if line.strip()]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+async def run_local(questions, out):
+    async for result in answer_batch(questions):
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+
+async def run_remote(questions, url, out, timeout):
+    import httpx
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        async with client.stream("POST", f"{url.rstrip('/')}/chat/batch", json={"questions": questions}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.strip():
+                    out.write(line + "\n")
+                    out.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions as NDJSON")
+    parser.add_argument("questions", help="text file, one question per line ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="NDJSON output file ('-' for stdout)")
+    parser.add_argument("--url", default=None, help="send to a running server's /chat/batch instead of answering in-process")
+    parser.add_argument("--timeout", type=float, default=3600.0)
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        if args.url:
+            asyncio.run(run_remote(questions, args.url, out, args.timeout))
+        else:
+            asyncio.run(run_local(questions, out))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
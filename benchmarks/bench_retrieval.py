@@ -0,0 +1,80 @@
+"""
+Retrieval micro-benchmarks, fully offline.
+
+    python benchmarks/bench_retrieval.py --backends chroma numpy-float32 numpy-int8 --iterations 3
+
+Measures the embedder, BM25, health_retriever, fused_retriever, hybrid_retriever,
+reciprocal_rank_fusion and the parallel RAG Fusion retrieval (with the fake LLM
+for query expansion) on every vector backend, and writes a JSON result file.
+"""
+import os
+import argparse
+
+# Cache phải tắt để đo đường truy xuất thật; LLM giả lập cho query expansion
+os.environ["CACHE_ENABLED"] = "false"
+os.environ["LLM_PROVIDER"] = "fake"
+
+from common import (
+    create_embedder, load_corpus, sample_questions, build_backends, install_components,
+    time_calls, write_results
+)
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval micro-benchmarks")
+    parser.add_argument("--backends", nargs="+", default=["chroma", "numpy-float32", "numpy-float16", "numpy-int8"])
+    parser.add_argument("--embedder", choices=["hash", "real"], default="hash")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="fake embedder seconds per call")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="fake query-expansion latency (s)")
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--no-hybrid", action="store_true", help="disable the BM25 index")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    import rag
+    from llm_client import FakeChatModel
+    from lexical_index import LexicalIndex
+
+    embedder = create_embedder(args.embedder, latency=args.embed_latency)
+    detail_items, summary_items = load_corpus()
+    questions = sample_questions(detail_items, args.questions)
+    # Các nhóm 4 câu như đầu ra của query expansion
+    query_groups = [questions[i:i + 4] for i in range(0, len(questions), 4)]
+
+    lexical_index = None if args.no_hybrid else LexicalIndex.from_chunks_and_summaries(detail_items, summary_items)
+    install_components({
+        "embedding_model": embedder,
+        "lexical_index": lexical_index,
+        "chat_model": FakeChatModel(latency=args.llm_latency, token_delay=0.0, seed=0),
+    })
+    print(f"Corpus: {len(detail_items)} chunks, {len(summary_items)} summaries; {len(questions)} questions")
+
+    results = {}
+    results["embed_query"] = time_calls(embedder.embed_query, questions, args.iterations)
+    if lexical_index is not None:
+        results["lexical_search"] = time_calls(
+            lambda q: lexical_index.search_documents(q, k=10), questions, args.iterations
+        )
+
+    backends = build_backends(embedder, detail_items, summary_items, args.backends)
+    for backend, components in backends.items():
+        install_components(components)
+        results[f"health_retriever/{backend}"] = time_calls(rag.health_retriever, questions, args.iterations)
+        results[f"fused_retriever/{backend}"] = time_calls(rag.fused_retriever, query_groups, args.iterations)
+        results[f"hybrid_retriever/{backend}"] = time_calls(rag.hybrid_retriever, query_groups, args.iterations)
+        ranked_lists = [rag.hybrid_retriever(group) for group in query_groups]
+        results[f"reciprocal_rank_fusion/{backend}"] = time_calls(
+            rag.reciprocal_rank_fusion, ranked_lists, args.iterations
+        )
+        results[f"retrieve_fused/{backend}"] = time_calls(rag.retrieve_fused, questions, args.iterations)
+
+    print(f"{'benchmark':45} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9}")
+    for name, summary in results.items():
+        print(f"{name:45} {summary['p50'] * 1000:9.2f} {summary['p95'] * 1000:9.2f} "
+              f"{summary['p99'] * 1000:9.2f} {summary['throughput']:9.1f}")
+
+    config = dict(vars(args), n_chunks=len(detail_items), n_summaries=len(summary_items))
+    print(f"Results written to {write_results('retrieval', config, results, args.output)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import platform
+import subprocess
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from lexical_index import syllables
+
+DATA_DIR = os.path.join(ROOT_DIR, "data")
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic offline embedder: hashed bag of syllables and syllable bigrams,
+    L2-normalized. Texts sharing words get similar vectors, so retrieval results
+    stay meaningful. `latency` seconds per call plus `latency_per_text` per text
+    simulate the cost of a real encoder.
+    """
+
+    def __init__(self, dim=384, latency=0.0, latency_per_text=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        sylls = syllables(text)
+        for term in sylls + [f"{a}_{b}" for a, b in zip(sylls, sylls[1:])]:
+            digest = hashlib.md5(term.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if self.latency or self.latency_per_text:
+            time.sleep(self.latency + self.latency_per_text * len(texts))
+        return [self._vector(text).tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def create_embedder(kind, latency=0.0, latency_per_text=0.0):
+    """'hash' (HashEmbeddings) or 'real' (the configured local encoder)"""
+    if kind == "real":
+        from embedding_backends import load_embedding_model
+        return load_embedding_model()
+    return HashEmbeddings(latency=latency, latency_per_text=latency_per_text)
+
+def load_corpus(max_summary_chars=500):
+    """
+    Detail chunks and one summary per article ({"id", "text", "metadata"}).
+    The crawled data has no stored summaries: the article's opening text stands
+    in, like the fake summarizer used by data/indexing.py.
+    """
+    with open(os.path.join(DATA_DIR, "detailed_chunks.json"), "r", encoding="utf-8") as f:
+        chunks = json.load(f)
+    with open(os.path.join(DATA_DIR, "full_contents.json"), "r", encoding="utf-8") as f:
+        docs = json.load(f)
+    detail_items = [
+        {"id": f"{item['metadata']['doc_id']}-{i}", "text": item["text"], "metadata": item["metadata"]}
+        for i, item in enumerate(chunks)
+    ]
+    summary_items = [
+        {"id": doc["metadata"]["doc_id"], "text": doc["text"][:max_summary_chars], "metadata": doc["metadata"]}
+        for doc in docs
+    ]
+    return detail_items, summary_items
+
+def sample_questions(detail_items, n=50):
+    """Deterministic question set: section headings of the corpus"""
+    headings = sorted({item["metadata"].get("section_h2", "") for item in detail_items} - {""})
+    return headings[:n]
+
+def build_backends(embedder, detail_items, summary_items, backends):
+    """
+    Build the requested vector backends over the same embeddings.
+
+    Returns:
+        dict: backend name -> {"vector_index", "chroma_summary", "chroma_detail"} registry components
+    """
+    from vector_index import NumpyVectorIndex
+
+    summary_embeddings = embedder.embed_documents([item["text"] for item in summary_items])
+    detail_embeddings = embedder.embed_documents([item["text"] for item in detail_items])
+    built = {}
+    for backend in backends:
+        if backend == "chroma":
+            import chromadb
+            from langchain_chroma import Chroma
+            client = chromadb.EphemeralClient()
+            stores = {}
+            for name, items, embeddings in (
+                ("summaries", summary_items, summary_embeddings),
+                ("detail_chunks", detail_items, detail_embeddings),
+            ):
+                # Tên collection riêng cho mỗi lần build (client in-memory dùng chung trong process)
+                store = Chroma(
+                    collection_name=f"bench_{name}_{os.getpid()}_{time.monotonic_ns()}",
+                    embedding_function=embedder,
+                    client=client
+                )
+                for start in range(0, len(items), 1000):
+                    batch = items[start:start + 1000]
+                    store._collection.add(
+                        ids=[item["id"] for item in batch],
+                        embeddings=embeddings[start:start + 1000],
+                        documents=[item["text"] for item in batch],
+                        metadatas=[item["metadata"] for item in batch]
+                    )
+                stores[name] = store
+            built[backend] = {
+                "vector_index": None,
+                "chroma_summary": stores["summaries"],
+                "chroma_detail": stores["detail_chunks"],
+            }
+        elif backend.startswith("numpy-"):
+            dtype = backend.split("-", 1)[1]
+            built[backend] = {
+                "vector_index": NumpyVectorIndex.build(
+                    summary_embeddings, summary_items, detail_embeddings, detail_items, dtype=dtype
+                ),
+                "chroma_summary": None,
+                "chroma_detail": None,
+            }
+        else:
+            raise ValueError(f"Unknown backend '{backend}'")
+    return built
+
+def install_components(components):
+    """Override registry components (name -> instance) for the benchmark run"""
+    from components import registry
+    for name, instance in components.items():
+        registry.override(name, instance)
+
+def latency_summary(latencies, wall_time=None):
+    """n, mean, p50/p95/p99, min/max (seconds) and throughput (ops/s)"""
+    values = np.asarray(latencies, dtype=np.float64)
+    if not len(values):
+        return {"n": 0}
+    summary = {
+        "n": int(len(values)),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "min": float(values.min()),
+        "max": float(values.max()),
+    }
+    total = wall_time if wall_time is not None else float(values.sum())
+    summary["throughput"] = len(values) / total if total > 0 else None
+    return summary
+
+def time_calls(fn, inputs, iterations=1, warmup=3):
+    """Call `fn` on every input `iterations` times (after `warmup` calls) and summarize latencies"""
+    for item in inputs[:warmup]:
+        fn(item)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for item in inputs:
+            t0 = time.perf_counter()
+            fn(item)
+            latencies.append(time.perf_counter() - t0)
+    return latency_summary(latencies, time.perf_counter() - start)
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_results(kind, config, results, output=None):
+    """
+    Save a machine-readable result file and return its path.
+    Default path: benchmarks/results/<kind>-<commit>-<timestamp>.json
+    """
+    commit = git_commit()
+    record = {
+        "kind": kind,
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "results": results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{kind}-{commit or 'nogit'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    return output
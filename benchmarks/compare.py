@@ -0,0 +1,65 @@
+"""
+Compare two benchmark result files (before / after a change).
+
+    python benchmarks/compare.py benchmarks/results/retrieval-abc123-....json benchmarks/results/retrieval-def456-....json --threshold 10
+
+Prints the p50/p95/p99 change of every benchmark present in both files and exits
+with status 1 if any percentile got slower by more than --threshold percent.
+"""
+import sys
+import json
+import argparse
+
+PERCENTILES = ("p50", "p95", "p99")
+
+def latency_series(results):
+    """Flatten a result file into {name: latency summary} (retrieval and load results)"""
+    series = {}
+    for name, value in results.items():
+        if isinstance(value, dict) and "p50" in value:
+            series[name] = value
+    return series
+
+def main():
+    parser = argparse.ArgumentParser(description="Diff two benchmark result files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="fail if any percentile regresses by more than this many percent")
+    args = parser.parse_args()
+
+    with open(args.before, "r", encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, "r", encoding="utf-8") as f:
+        after = json.load(f)
+    if before.get("kind") != after.get("kind"):
+        print(f"Warning: comparing '{before.get('kind')}' with '{after.get('kind')}' results")
+    print(f"before: {before.get('commit')} {before.get('timestamp')}")
+    print(f"after:  {after.get('commit')} {after.get('timestamp')}")
+
+    old, new = latency_series(before["results"]), latency_series(after["results"])
+    regressions = []
+    print(f"{'benchmark':45} " + " ".join(f"{p + ' ms':>22}" for p in PERCENTILES))
+    for name in sorted(old.keys() & new.keys()):
+        cells = []
+        for p in PERCENTILES:
+            a, b = old[name][p], new[name][p]
+            change = (b - a) / a * 100 if a else 0.0
+            cells.append(f"{a * 1000:8.2f} -> {b * 1000:8.2f} {change:+5.0f}%")
+            if args.threshold is not None and change > args.threshold:
+                regressions.append((name, p, change))
+        print(f"{name:45} " + " ".join(f"{cell:>22}" for cell in cells))
+
+    for name in sorted(old.keys() ^ new.keys()):
+        print(f"{name:45} only in {'before' if name in old else 'after'}")
+    if "throughput" in before["results"] and "throughput" in after["results"]:
+        print(f"throughput: {before['results']['throughput']:.1f} -> {after['results']['throughput']:.1f} req/s")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold}%:")
+        for name, p, change in regressions:
+            print(f"  {name} {p} {change:+.1f}%")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Retrieval quality vs latency: sweep the retrieval knobs and report recall@k and
+MRR next to the measured latency of each configuration.
+
+    python benchmarks/eval_retrieval.py --summary-k 1 3 5 --detail-k 5 10 20 --expansions 0 3 --rrf-k 10 60
+
+The labeled query set is built from detailed_chunks.json: one question per
+section, phrased from its deepest heading, whose relevant chunks are the chunks
+of that section. The headings are held out: chunks are indexed without their
+"<heading>: " prefix (--keep-headings to index them as crawled), so a query
+never matches its section verbatim.
+Swept knobs are the rag.py settings SUMMARY_K, DETAIL_K, QUERY_EXPANSION_COUNT,
+RRF_K, HIERARCHICAL_SEARCH (hierarchical vs flat detail search) and
+LEXICAL_ONLY_MARGIN (the BM25-only shortcut, off as in production unless
+--lexical-only is given a value <= 1; the share of queries it answered is reported). Configurations
+that no other configuration beats on both recall and p50 latency form the Pareto
+frontier, marked with '*'.
+
+With the default fake LLM the rewrites are canned paraphrases, so expansion only
+shows its latency cost; use --llm gemini to measure the recall it actually buys.
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import itertools
+from collections import defaultdict
+
+os.environ["CACHE_ENABLED"] = "false"
+
+from common import (
+    DATA_DIR, create_embedder, load_corpus, build_backends, install_components, latency_summary, write_results
+)
+sys.path.append(DATA_DIR)
+from chunking import split_heading
+
+RECALL_AT = (1, 3, 5, 10)
+# "1. ", "2.3) " ... ở đầu tiêu đề mục
+NUMBERING = re.compile(r"^\s*(\d+[\.\)]\s*)+")
+# Câu hỏi được diễn đạt từ tiêu đề mục, không lặp nguyên văn tiêu đề như trong chunk
+QUESTION_TEMPLATES = [
+    "Cho tôi biết về {topic}",
+    "{topic} như thế nào?",
+    "Tôi muốn tìm hiểu {topic}",
+    "Thông tin về {topic} là gì?",
+    "Giải thích giúp tôi {topic}",
+]
+# LEXICAL_ONLY_MARGIN > 1 (mặc định của rag.py): không bao giờ trả lời chỉ bằng BM25
+LEXICAL_ONLY_OFF = 1.1
+
+def section_heading(metadata):
+    """Deepest heading below the article title, numbering stripped"""
+    for level in (4, 3, 2):
+        heading = NUMBERING.sub("", metadata.get(f"section_h{level}", "")).strip()
+        if heading:
+            return heading
+    return None
+
+def build_labeled_queries(detail_items, max_queries=None, seed=0):
+    """
+    One labeled query per section.
+
+    Returns:
+        list[dict]: {"query", "doc_id", "relevant"} where `relevant` is the set of
+        chunk IDs of the section. The query is a question template around the
+        heading (lowercased); headings used by several articles ("Nguyên nhân",
+        "Triệu chứng"...) get the article title appended so the query is answerable.
+    """
+    sections = defaultdict(list)
+    for item in detail_items:
+        metadata = item["metadata"]
+        heading = section_heading(metadata)
+        if heading:
+            sections[(metadata["doc_id"], metadata.get("section_h1", ""), heading)].append(item["id"])
+
+    heading_docs = defaultdict(set)
+    for doc_id, _, heading in sections:
+        heading_docs[heading.lower()].add(doc_id)
+
+    rng = random.Random(seed)
+    queries = []
+    for (doc_id, title, heading), ids in sorted(sections.items()):
+        topic = heading.lower() if len(heading_docs[heading.lower()]) == 1 else f"{heading.lower()} của {title}"
+        query = rng.choice(QUESTION_TEMPLATES).format(topic=topic)
+        queries.append({"query": query, "doc_id": doc_id, "relevant": set(ids)})
+    if max_queries and len(queries) > max_queries:
+        queries = random.Random(seed).sample(queries, max_queries)
+    return queries
+
+def hold_out_headings(detail_items):
+    """Chunks without their "<heading>: " prefix, so the labeled queries are not found verbatim"""
+    return [
+        dict(item, text=split_heading(item)[1] or item["text"]) for item in detail_items
+    ]
+
+def score_ranking(docs, labeled):
+    """recall@k, reciprocal rank and doc-level hit@5 of one ranked document list"""
+    from context_packing import document_key
+
+    keys = [document_key(doc) for doc in docs]
+    relevant = labeled["relevant"]
+    scores = {
+        f"recall@{k}": len(relevant.intersection(keys[:k])) / len(relevant) for k in RECALL_AT
+    }
+    first = next((rank for rank, key in enumerate(keys, 1) if key in relevant), None)
+    scores["mrr"] = 1.0 / first if first else 0.0
+    scores["doc_hit@5"] = float(any(doc.metadata.get("doc_id") == labeled["doc_id"] for doc in docs[:5]))
+    return scores
+
+def retrieve(question):
+    """
+    Ranked documents exactly as retrieve_context would pack them (lexical shortcut, then RAG Fusion).
+
+    Returns:
+        tuple: (documents, whether the BM25-only shortcut answered)
+    """
+    import rag
+    results = rag.lexical_only_results(question)
+    if results is not None:
+        return [doc for doc, _ in results], True
+    results, _ = rag.retrieve_fused(question)
+    return [doc for doc, _ in results], False
+
+def sweep_configs(args):
+    """All knob combinations; summary_k is irrelevant for flat search"""
+    configs = []
+    for search in args.search:
+        summary_ks = args.summary_k if search == "hierarchical" else [None]
+        for summary_k, detail_k, expansions, rrf_k, lexical_only in itertools.product(
+            summary_ks, args.detail_k, args.expansions, args.rrf_k, args.lexical_only
+        ):
+            name = (f"hier-s{summary_k}" if search == "hierarchical" else "flat") + \
+                f"-d{detail_k}-q{expansions}-rrf{rrf_k}" + (f"-lex{lexical_only:g}" if lexical_only <= 1 else "")
+            configs.append((name, {
+                "search": search, "summary_k": summary_k, "detail_k": detail_k,
+                "expansions": expansions, "rrf_k": rrf_k, "lexical_only": lexical_only,
+            }))
+    return configs
+
+def apply_config(config):
+    import rag
+    rag.HIERARCHICAL_SEARCH = config["search"] == "hierarchical"
+    rag.SUMMARY_K = config["summary_k"] or rag.SUMMARY_K
+    rag.DETAIL_K = config["detail_k"]
+    rag.QUERY_EXPANSION_COUNT = config["expansions"]
+    rag.RRF_K = config["rrf_k"]
+    rag.LEXICAL_ONLY_MARGIN = config["lexical_only"]
+
+def evaluate(queries, warmup=3):
+    for labeled in queries[:warmup]:
+        retrieve(labeled["query"])
+    totals = defaultdict(float)
+    latencies = []
+    start = time.perf_counter()
+    for labeled in queries:
+        t0 = time.perf_counter()
+        docs, shortcut = retrieve(labeled["query"])
+        latencies.append(time.perf_counter() - t0)
+        totals["lexical_only"] += shortcut
+        for name, value in score_ranking(docs, labeled).items():
+            totals[name] += value
+    summary = latency_summary(latencies, time.perf_counter() - start)
+    summary.update({name: value / len(queries) for name, value in totals.items()})
+    return summary
+
+def pareto_frontier(results, objective):
+    """Names of the configurations not dominated on (objective higher, p50 lower)"""
+    frontier = []
+    for name, r in results.items():
+        dominated = any(
+            o[objective] >= r[objective] and o["p50"] <= r["p50"]
+            and (o[objective] > r[objective] or o["p50"] < r["p50"])
+            for other, o in results.items() if other != name
+        )
+        if not dominated:
+            frontier.append(name)
+    return sorted(frontier, key=lambda name: results[name]["p50"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval recall/MRR vs latency sweep")
+    parser.add_argument("--summary-k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--detail-k", type=int, nargs="+", default=[5, 10, 20])
+    parser.add_argument("--expansions", type=int, nargs="+", default=[0, 3])
+    parser.add_argument("--rrf-k", type=int, nargs="+", default=[60])
+    parser.add_argument("--lexical-only", type=float, nargs="+", default=[LEXICAL_ONLY_OFF],
+                        help="LEXICAL_ONLY_MARGIN values (> 1 disables the BM25-only shortcut)")
+    parser.add_argument("--keep-headings", action="store_true",
+                        help="index chunks with their heading prefix (queries then appear verbatim)")
+    parser.add_argument("--search", nargs="+", choices=["hierarchical", "flat"], default=["hierarchical", "flat"])
+    parser.add_argument("--backend", default="numpy-float32", help="chroma | numpy-<dtype>")
+    parser.add_argument("--embedder", choices=["hash", "real"], default="hash")
+    parser.add_argument("--llm", choices=["fake", "gemini"], default="fake", help="LLM used for query expansion")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="fake query-expansion latency (s)")
+    parser.add_argument("--no-hybrid", action="store_true", help="disable the BM25 index")
+    parser.add_argument("--queries", type=int, default=200, help="max labeled queries (sampled)")
+    parser.add_argument("--objective", default="recall@10", help="quality metric of the Pareto frontier")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    os.environ["LLM_PROVIDER"] = args.llm
+    from lexical_index import LexicalIndex
+
+    embedder = create_embedder(args.embedder)
+    detail_items, summary_items = load_corpus()
+    if not args.keep_headings:
+        detail_items = hold_out_headings(detail_items)
+    queries = build_labeled_queries(detail_items, args.queries, args.seed)
+    components = dict(
+        build_backends(embedder, detail_items, summary_items, [args.backend])[args.backend],
+        embedding_model=embedder,
+        lexical_index=None if args.no_hybrid else LexicalIndex.from_chunks_and_summaries(detail_items, summary_items),
+    )
+    if args.llm == "fake":
+        from llm_client import FakeChatModel
+        components["chat_model"] = FakeChatModel(latency=args.llm_latency, token_delay=0.0, seed=args.seed)
+    install_components(components)
+    configs = sweep_configs(args)
+    print(f"{len(queries)} labeled queries, {len(configs)} configurations on {args.backend}")
+
+    results = {}
+    for name, config in configs:
+        apply_config(config)
+        results[name] = dict(config, **evaluate(queries))
+    frontier = pareto_frontier(results, args.objective)
+
+    columns = [f"recall@{k}" for k in RECALL_AT] + ["mrr", "doc_hit@5", "lexical_only"]
+    print(f"  {'config':36} " + " ".join(f"{c:>9}" for c in columns) + f" {'p50 ms':>9} {'p95 ms':>9}")
+    for name, r in sorted(results.items(), key=lambda item: item[1]["p50"]):
+        marker = "*" if name in frontier else " "
+        print(f"{marker} {name:36} " + " ".join(f"{r[c]:9.3f}" for c in columns) +
+              f" {r['p50'] * 1000:9.2f} {r['p95'] * 1000:9.2f}")
+    print(f"Pareto frontier ({args.objective} vs p50): {', '.join(frontier)}")
+
+    results["pareto_frontier"] = frontier
+    config = dict(vars(args), n_queries=len(queries))
+    print(f"Results written to {write_results('eval', config, results, args.output)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+End-to-end load generator for /chat/stream (SSE).
+
+    python benchmarks/load_test.py --clients 32 --requests 500 --llm-latency 0.5 --token-rate 40
+
+Without --url the app is started in-process on a free port with the fake LLM,
+the hash embedder and an in-memory vector index, so the run needs no API key,
+model download or Chroma files. With --url an already running server is driven
+(start it with LLM_PROVIDER=fake for a reproducible upstream).
+
+Reports throughput, p50/p95/p99 time-to-first-token and total latency, and
+end-frame statuses, and writes a JSON result file.
+"""
+import os
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import threading
+from collections import Counter
+
+from common import (
+    create_embedder, load_corpus, sample_questions, build_backends, install_components,
+    latency_summary, write_results
+)
+
+GREETINGS = ["Xin chào", "Chào bạn", "Cảm ơn bạn nhé", "Bạn là ai?"]
+# Thông báo lỗi được stream như nội dung (server cũ vẫn kết thúc bằng status "success")
+ERROR_PREFIX = "Có lỗi xảy ra"
+
+def configure_environment(args):
+    """Settings read by the app modules at import time"""
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+    os.environ["FAKE_LLM_TAIL_RATE"] = str(args.llm_tail_rate)
+    os.environ["FAKE_LLM_TAIL_LATENCY"] = str(args.llm_tail_latency)
+    os.environ["FAKE_LLM_FAILURE_RATE"] = str(args.llm_failure_rate)
+    os.environ["FAKE_LLM_TOKEN_DELAY"] = str(1.0 / args.token_rate if args.token_rate > 0 else 0.0)
+    os.environ["FAKE_LLM_SEED"] = str(args.seed)
+    os.environ["CACHE_ENABLED"] = "true" if args.cache else "false"
+    os.environ["WARMUP_ENABLED"] = "false"
+    os.environ["CHAT_MODE"] = args.mode
+    if args.llm_concurrency:
+        os.environ["LLM_MAX_CONCURRENCY"] = str(args.llm_concurrency)
+
+def start_app(args, detail_items, summary_items):
+    """Start main.app with offline components on a free local port, return the base URL"""
+    import uvicorn
+    from lexical_index import LexicalIndex
+
+    embedder = create_embedder(args.embedder, latency=args.embed_latency)
+    backend = build_backends(embedder, detail_items, summary_items, [args.backend])[args.backend]
+    install_components(dict(
+        backend,
+        embedding_model=embedder,
+        lexical_index=LexicalIndex.from_chunks_and_summaries(detail_items, summary_items)
+    ))
+
+    import main
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+async def run_request(client, url, question, client_id, mode):
+    """One SSE request: (ttft, total, end status); an error message streamed as the answer counts as "error" """
+    start = time.perf_counter()
+    ttft = None
+    status = "incomplete"
+    answer = []
+    payload = {"question": question}
+    if mode:
+        payload["mode"] = mode
+    async with client.stream("POST", f"{url}/chat/stream", json=payload,
+                             headers={"X-Client-ID": client_id}) as response:
+        if response.status_code != 200:
+            return None, time.perf_counter() - start, f"http_{response.status_code}"
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[6:])
+            if event["type"] in ("chunk", "word"):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                answer.append(event.get("content", ""))
+            elif event["type"] == "end":
+                status = event.get("status", "unknown")
+    if status == "success" and "".join(answer).lstrip().startswith(ERROR_PREFIX):
+        status = "error"
+    return ttft, time.perf_counter() - start, status
+
+async def drive(url, workload, clients, mode, timeout):
+    import httpx
+
+    queue = asyncio.Queue()
+    for item in workload:
+        queue.put_nowait(item)
+    ttfts, totals, statuses = [], [], Counter()
+
+    async def worker(n):
+        # Mỗi client ảo có ID riêng (giới hạn per-client của server)
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            while not queue.empty():
+                question = queue.get_nowait()
+                try:
+                    ttft, total, status = await run_request(client, url, question, f"bench-{n}", mode)
+                except Exception as e:
+                    statuses[f"error:{type(e).__name__}"] += 1
+                    continue
+                statuses[status] += 1
+                totals.append(total)
+                if ttft is not None:
+                    ttfts.append(ttft)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(clients)))
+    wall_time = time.perf_counter() - start
+    return ttfts, totals, statuses, wall_time
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent /chat/stream load test")
+    parser.add_argument("--url", default=None, help="running server; default: start the app in-process")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--mode", choices=["pipeline", "agent"], default="pipeline")
+    parser.add_argument("--greeting-ratio", type=float, default=0.1)
+    parser.add_argument("--unique-questions", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--llm-tail-rate", type=float, default=0.0)
+    parser.add_argument("--llm-tail-latency", type=float, default=3.0)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--token-rate", type=float, default=50.0, help="fake LLM words per second")
+    parser.add_argument("--llm-concurrency", type=int, default=0, help="override LLM_MAX_CONCURRENCY")
+    parser.add_argument("--embedder", choices=["hash", "real"], default="hash")
+    parser.add_argument("--embed-latency", type=float, default=0.0)
+    parser.add_argument("--backend", default="numpy-float32")
+    parser.add_argument("--cache", action="store_true", help="keep the semantic caches on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    detail_items, summary_items = load_corpus()
+    questions = sample_questions(detail_items, args.unique_questions)
+    rng = random.Random(args.seed)
+    workload = [
+        rng.choice(GREETINGS) if rng.random() < args.greeting_ratio else questions[i % len(questions)]
+        for i in range(args.requests)
+    ]
+
+    url = args.url
+    if url is None:
+        configure_environment(args)
+        url = start_app(args, detail_items, summary_items)
+    print(f"Driving {url} with {args.clients} clients, {args.requests} requests")
+
+    ttfts, totals, statuses, wall_time = asyncio.run(
+        drive(url, workload, args.clients, args.mode, args.timeout)
+    )
+    results = {
+        "requests": len(workload),
+        "wall_time": wall_time,
+        "throughput": len(totals) / wall_time if wall_time else None,
+        "ttft": latency_summary(ttfts),
+        "total": latency_summary(totals),
+        "statuses": dict(statuses),
+    }
+    try:
+        import httpx
+        health = httpx.get(f"{url}/health", timeout=10).json()
+        results["server"] = {key: health.get(key) for key in ("concurrency", "llm", "cache")}
+    except Exception as e:
+        print(f"Could not read /health: {e}")
+
+    print(f"Throughput: {results['throughput']:.1f} req/s over {wall_time:.1f}s, statuses {dict(statuses)}")
+    for name in ("ttft", "total"):
+        summary = results[name]
+        if summary.get("n"):
+            print(f"{name:6} p50 {summary['p50'] * 1000:8.1f} ms  p95 {summary['p95'] * 1000:8.1f} ms  "
+                  f"p99 {summary['p99'] * 1000:8.1f} ms")
+    print(f"Results written to {write_results('load', vars(args), results, args.output)}")
+
+if __name__ == "__main__":
+    main()
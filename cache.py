@@ -0,0 +1,112 @@
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+def normalize_text(text: str) -> str:
+    """Normalize a question for exact-match lookup (case, unicode form, punctuation, spaces)"""
+    text = unicodedata.normalize("NFC", text).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+class SemanticCache:
+    """
+    Two-level cache for question -> value.
+
+    Level 1 is an exact match on the normalized question. Level 2 is a
+    nearest-neighbour lookup on the (normalized) question embedding, a hit when
+    cosine similarity >= `threshold`. Entries are evicted LRU once `max_size` is
+    reached and expire after `ttl` seconds.
+    """
+
+    def __init__(self, embed_fn=None, max_size=512, ttl=3600, threshold=0.95):
+        self.embed_fn = embed_fn
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()  # key -> (value, embedding, created_at)
+        self._lock = threading.Lock()
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+
+    def _expired(self, created_at):
+        return self.ttl is not None and self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def _purge_expired(self):
+        for key in [k for k, (_, _, created_at) in self._entries.items() if self._expired(created_at)]:
+            del self._entries[key]
+
+    def _embed(self, question):
+        if self.embed_fn is None:
+            return None
+        return np.asarray(self.embed_fn(question), dtype=np.float32)
+
+    def get(self, question: str, embedding=None):
+        """Return the cached value for `question` or None (`embedding`: precomputed, e.g. batch-encoded)"""
+        key = normalize_text(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[2]):
+                self._entries.move_to_end(key)
+                self.hits_exact += 1
+                return entry[0]
+            self._purge_expired()
+            if self.embed_fn is None or not self._entries:
+                self.misses += 1
+                return None
+
+        # Embed ngoài lock để không chặn các request khác
+        embedding = self._embed(question) if embedding is None else np.asarray(embedding, dtype=np.float32)
+
+        with self._lock:
+            keys = [k for k, (_, emb, _) in self._entries.items() if emb is not None]
+            if keys:
+                matrix = np.stack([self._entries[k][1] for k in keys])
+                scores = matrix @ embedding
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.hits_semantic += 1
+                    return self._entries[keys[best]][0]
+            self.misses += 1
+            return None
+
+    def set(self, question: str, value, embedding=None):
+        """Store `value` for `question`"""
+        key = normalize_text(question)
+        if self.embed_fn is None:
+            # Cache chỉ khớp chính xác: bỏ qua embedding được truyền vào (vd. từ batch)
+            embedding = None
+        elif embedding is None:
+            embedding = self._embed(question)
+        else:
+            embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._entries[key] = (value, embedding, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits_exact + self.hits_semantic + self.misses
+            return {
+                "size": len(self._entries),
+                "hits_exact": self.hits_exact,
+                "hits_semantic": self.hits_semantic,
+                "misses": self.misses,
+                "hit_rate": round((self.hits_exact + self.hits_semantic) / lookups, 4) if lookups else 0.0,
+            }
+
+def replay_chunks(text: str, chunk_size: int = 20):
+    """Split a cached answer into small pieces so it can be replayed as a stream"""
+    for i in range(0, len(text), chunk_size):
+        yield text[i:i + chunk_size]
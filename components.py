@@ -0,0 +1,126 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+
+# "gemini" | "fake" (FakeChatModel, cấu hình bằng FAKE_LLM_*, để chạy offline)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+LLM_ENABLED = LLM_PROVIDER == "fake" or bool(GOOGLE_API_KEY)
+
+class ComponentRegistry:
+    """
+    Process-wide lazy singletons (LLM, embedding model, vector stores, agent...).
+
+    Components are registered by name with a factory and built on first `get`,
+    once per process, so importing the app is cheap and every module shares the
+    same instances. `ready` is set once the warm-up step has run.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.load_times = {}
+        self.ready = False
+        self.warmup_error = None
+
+    def register(self, name):
+        """Decorator registering `factory` as the builder of component `name`"""
+        def decorator(factory):
+            self._factories[name] = factory
+            return factory
+        return decorator
+
+    def get(self, name):
+        """Return component `name`, building it on first use (thread-safe)"""
+        if name in self._instances:
+            return self._instances[name]
+        # Một lock cho mỗi component: factory có thể gọi get() cho component khác
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._instances:
+                start = time.perf_counter()
+                self._instances[name] = self._factories[name]()
+                self.load_times[name] = round(time.perf_counter() - start, 3)
+                print(f"Loaded component '{name}' in {self.load_times[name]}s")
+        return self._instances[name]
+
+    def override(self, name, instance):
+        """Use `instance` for component `name` instead of building it (benchmarks, offline runs)"""
+        self._instances[name] = instance
+        self.load_times[name] = 0.0
+
+    def is_loaded(self, name):
+        return name in self._instances
+
+    def status(self):
+        """Readiness report: warm-up state and which components are loaded"""
+        return {
+            "ready": self.ready,
+            "warmup_error": self.warmup_error,
+            "components": {
+                name: "loaded" if name in self._instances else "not_loaded"
+                for name in self._factories
+            },
+            "load_times": dict(self.load_times),
+        }
+
+registry = ComponentRegistry()
+
+@registry.register("chat_model")
+def create_chat_model():
+    if LLM_PROVIDER == "fake":
+        from llm_client import fake_chat_model_from_env
+        return fake_chat_model_from_env()
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from llm_client import LLM_TIMEOUT
+    if not GOOGLE_API_KEY:
+        raise ValueError("GOOGLE_API_KEY not found. Please set it in your .env file.")
+    os.environ["GOOGLE_API_KEY"] = GOOGLE_API_KEY
+    # Retry và timeout do ResilientLLM quản lý, tắt retry nội bộ của client
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash-exp",
+        timeout=LLM_TIMEOUT,
+        max_retries=0
+    )
+
+@registry.register("llm")
+def create_llm():
+    # Timeout, hedging, retry và circuit breaker quanh chat model
+    from llm_client import ResilientLLM, llm_breaker
+    return ResilientLLM(registry.get("chat_model"), breaker=llm_breaker)
+
+@registry.register("embedding_model")
+def create_embedding_model():
+    # Sidecar dùng chung giữa các worker (micro-batching), nếu được cấu hình
+    from embedding_service import EMBEDDING_SERVICE_SOCKET, RemoteEmbeddings
+    if EMBEDDING_SERVICE_SOCKET:
+        return RemoteEmbeddings(EMBEDDING_SERVICE_SOCKET)
+    # EMBEDDING_BACKEND=torch|onnx
+    from embedding_backends import load_embedding_model
+    return load_embedding_model()
+
+@registry.register("chroma_summary")
+def create_chroma_summary():
+    from langchain_chroma import Chroma
+    return Chroma(
+        collection_name="summaries",
+        embedding_function=registry.get("embedding_model"),
+        persist_directory="data/chroma_storage/summaries"
+    )
+
+@registry.register("chroma_detail")
+def create_chroma_detail():
+    from langchain_chroma import Chroma
+    return Chroma(
+        collection_name="detail_chunks",
+        embedding_function=registry.get("embedding_model"),
+        persist_directory="data/chroma_storage/details"
+    )
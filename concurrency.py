@@ -0,0 +1,185 @@
+import asyncio
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+
+class Overloaded(Exception):
+    """Raised when a request is not admitted to the LLM (reason: per_client | queue_full | queue_timeout)"""
+
+    def __init__(self, reason, retry_after=1.0):
+        super().__init__(f"LLM capacity exceeded ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Caps in-flight LLM work globally and per client, with a bounded FIFO wait queue.
+
+    A request waiting longer than `queue_timeout` is rejected rather than
+    served late, so an overload shows up as fast Overloaded errors instead of
+    upstream 429s and an ever-growing tail latency.
+    """
+
+    def __init__(self, max_in_flight=8, max_per_client=2, max_queue=32, queue_timeout=5.0):
+        self.max_in_flight = max_in_flight
+        self.max_per_client = max_per_client
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters = deque()
+        self._per_client = Counter()
+        self.admitted = 0
+        self.rejected = Counter()
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        raise Overloaded(reason, retry_after=self.queue_timeout)
+
+    def _release(self):
+        # Chuyển thẳng slot cho request đầu hàng đợi còn đang chờ
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def _acquire(self):
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return 0.0
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # Slot có thể được chuyển tới đúng lúc hết hạn: trả lại thay vì làm mất nó
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self._reject("queue_timeout")
+        except asyncio.CancelledError:
+            # Client ngắt kết nối khi đang chờ: trả lại slot nếu vừa được nhận
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        return time.perf_counter() - start
+
+    @asynccontextmanager
+    async def slot(self, client_id=None):
+        """Hold one LLM slot for the body of the `async with` block"""
+        if client_id is not None and self._per_client[client_id] >= self.max_per_client:
+            self._reject("per_client")
+        self._per_client[client_id] += 1
+        try:
+            waited = await self._acquire()
+            self.admitted += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            try:
+                yield
+            finally:
+                self._release()
+        finally:
+            self._per_client[client_id] -= 1
+            if self._per_client[client_id] <= 0:
+                del self._per_client[client_id]
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": sum(1 for w in self._waiters if not w.done()),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "queue_wait_avg": round(self._wait_total / self.admitted, 4) if self.admitted else 0.0,
+            "queue_wait_max": round(self._wait_max, 4),
+        }
+
+class _Flight:
+    def __init__(self):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Condition()
+        self.task = None
+
+class SingleFlight:
+    """
+    Share one upstream token stream between identical in-flight requests.
+
+    The first request for a key starts the generation in a background task;
+    requests arriving while it runs replay the tokens produced so far and then
+    follow the live stream. The task outlives a disconnecting leader, so
+    followers (and the response cache) still get the full answer.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def _run(self, key, flight, factory):
+        try:
+            async for token in factory():
+                async with flight.changed:
+                    flight.tokens.append(token)
+                    flight.changed.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            async with flight.changed:
+                flight.done = True
+                flight.changed.notify_all()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _join(self, key, factory):
+        """(flight for `key`, whether this caller leads it), starting a new flight if none is running"""
+        flight = self._flights.get(key)
+        if flight is not None and not flight.done:
+            self.coalesced += 1
+            return flight, False
+        flight = _Flight()
+        self._flights[key] = flight
+        self.leaders += 1
+        flight.task = asyncio.create_task(self._run(key, flight, factory))
+        return flight, True
+
+    async def stream(self, key, factory):
+        """
+        Yield the tokens of `factory()` (an async generator function), shared by `key`.
+
+        An Overloaded rejection belongs to the leader (its per-client cap, its
+        place in the queue): a follower that has not received any token yet
+        starts or joins a new flight instead of inheriting it.
+        """
+        while True:
+            flight, leader = self._join(key, factory)
+            position = 0
+            while True:
+                async with flight.changed:
+                    while position >= len(flight.tokens) and not flight.done:
+                        await flight.changed.wait()
+                    tokens = flight.tokens[position:]
+                    done = flight.done
+                position += len(tokens)
+                for token in tokens:
+                    yield token
+                if done:
+                    break
+            if flight.error is None:
+                return
+            if leader or position > 0 or not isinstance(flight.error, Overloaded):
+                raise flight.error
+
+    def stats(self):
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "coalesced": self.coalesced}
@@ -0,0 +1,96 @@
+import re
+import hashlib
+
+# Ước lượng token khi không có tokenizer của Gemini: ~3 ký tự tiếng Việt / token
+CHARS_PER_TOKEN = 3
+
+# Ngữ cảnh trả về khi không có chunk nào được chọn
+NO_CONTEXT = "Không tìm thấy tài liệu liên quan."
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used for the context budget"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def document_key(doc):
+    """Stable identity of a retrieved chunk: vector store ID, else doc_id + content hash"""
+    if getattr(doc, "id", None):
+        return doc.id
+    digest = hashlib.md5(doc.page_content.encode("utf-8")).hexdigest()
+    return f"{doc.metadata.get('doc_id', '')}:{digest}"
+
+def _shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def _breadcrumb(metadata):
+    return " > ".join(
+        metadata[key] for key in ("section_h2", "section_h3", "section_h4") if metadata.get(key)
+    )
+
+def _strip_heading(text, metadata):
+    # Chunk text bắt đầu bằng "<heading cuối>: " đã có trong breadcrumb
+    for key in ("section_h4", "section_h3", "section_h2"):
+        heading = metadata.get(key)
+        if heading:
+            prefix = heading + ": "
+            return text[len(prefix):] if text.startswith(prefix) else text
+    return text
+
+def pack_context(fused_results, token_budget=2000, duplicate_threshold=0.8):
+    """
+    Pack fused (Document, score) results into a compact, citation-ready context.
+
+    Chunks are taken in score order, near-duplicates (word-shingle Jaccard >=
+    `duplicate_threshold`) are dropped and chunks are added while they fit in
+    `token_budget`. Selected chunks are grouped per source article with their
+    section headings.
+
+    Returns:
+        str: numbered source blocks, one per article
+    """
+    selected = []
+    selected_shingles = []
+    used_tokens = 0
+    for doc, _score in fused_results:
+        shingles = _shingles(doc.page_content)
+        if any(_jaccard(shingles, other) >= duplicate_threshold for other in selected_shingles):
+            continue
+        body = _strip_heading(doc.page_content, doc.metadata)
+        breadcrumb = _breadcrumb(doc.metadata)
+        entry = f"- {breadcrumb}: {body}" if breadcrumb else f"- {body}"
+        tokens = estimate_tokens(entry)
+        if used_tokens + tokens > token_budget:
+            # Chunk không vừa ngân sách còn lại, thử chunk tiếp theo (ngắn hơn)
+            continue
+        used_tokens += tokens
+        selected.append((doc, entry))
+        selected_shingles.append(shingles)
+
+    if not selected:
+        return NO_CONTEXT
+
+    # Nhóm theo bài viết, giữ thứ tự theo chunk có điểm cao nhất của mỗi bài
+    groups = {}
+    for doc, entry in selected:
+        source = doc.metadata.get("doc_id") or doc.metadata.get("url", "")
+        if source not in groups:
+            groups[source] = {"metadata": doc.metadata, "entries": [], "urls": []}
+        groups[source]["entries"].append(entry)
+        # Chunk đã khử trùng lặp: trích dẫn mọi bài chứa đoạn này (source_urls)
+        for url in [doc.metadata.get("url", "")] + doc.metadata.get("source_urls", "").split("\n"):
+            if url and url not in groups[source]["urls"]:
+                groups[source]["urls"].append(url)
+
+    blocks = []
+    for i, group in enumerate(groups.values(), 1):
+        metadata = group["metadata"]
+        header = f"[{i}] {metadata.get('section_h1', 'N/A')}\nNguồn: {', '.join(group['urls']) or 'N/A'}"
+        blocks.append(header + "\n" + "\n".join(group["entries"]))
+    return "\n\n".join(blocks)
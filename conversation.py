@@ -0,0 +1,291 @@
+import os
+import copy
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from components import registry
+from context_packing import estimate_tokens, CHARS_PER_TOKEN
+from llm_client import ResilientLLM, llm_breaker
+from metrics import stage
+
+# Bộ nhớ hội thoại theo phiên: "memory" (LRU trong process) | "sqlite" (dùng chung giữa các worker) | "none"
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "data/sessions.db")
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))
+# Ngân sách token cho các lượt hội thoại gần nhất đưa vào prompt; lượt cũ hơn được tóm tắt
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1200"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "300"))
+SESSION_SUMMARY_TIMEOUT = float(os.getenv("SESSION_SUMMARY_TIMEOUT", "10"))
+# Giới hạn cứng số lượt lưu trữ, kể cả khi tóm tắt chậm hoặc lỗi
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "20"))
+
+def new_state():
+    """
+    Conversation state of one session (JSON-serializable):
+    summary of older turns, recent turns and the last retrieved context.
+    """
+    return {"summary": "", "turns": [], "retrieval": None}
+
+class MemorySessionStore:
+    """In-process LRU of session states with a TTL"""
+
+    def __init__(self, max_sessions=10000, ttl=86400):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # session_id -> (state, updated_at)
+        self._lock = threading.Lock()
+
+    def _expired(self, updated_at):
+        return self.ttl is not None and self.ttl > 0 and time.time() - updated_at > self.ttl
+
+    def get(self, session_id):
+        """Copy of the session state, or None"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if self._expired(entry[1]):
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return copy.deepcopy(entry[0])
+
+    def update(self, session_id, fn):
+        """Apply `fn(state)` (in place) to the session state atomically, creating it if needed"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            state = entry[0] if entry is not None and not self._expired(entry[1]) else new_state()
+            fn(state)
+            self._sessions[session_id] = (state, time.time())
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return copy.deepcopy(state)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "sessions": len(self._sessions), "max_sessions": self.max_sessions}
+
+class SqliteSessionStore:
+    """
+    Session states in a SQLite table, shared by every worker process on the host.
+    Expired and least recently updated sessions are pruned periodically.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, max_sessions=10000, ttl=86400):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _load(self, session_id):
+        row = self._conn.execute(
+            "SELECT state, updated_at FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None or (self.ttl and time.time() - row[1] > self.ttl):
+            return None
+        return json.loads(row[0])
+
+    def get(self, session_id):
+        with self._lock:
+            return self._load(session_id)
+
+    def update(self, session_id, fn):
+        with self._lock:
+            # BEGIN IMMEDIATE: đọc-sửa-ghi nguyên tử giữa các process
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                state = self._load(session_id) or new_state()
+                fn(state)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions (id, state, updated_at) VALUES (?, ?, ?)",
+                    (session_id, json.dumps(state, ensure_ascii=False), time.time())
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune()
+            return state
+
+    def _prune(self):
+        if self.ttl:
+            self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM sessions WHERE id NOT IN (SELECT id FROM sessions ORDER BY updated_at DESC LIMIT ?)",
+            (self.max_sessions,)
+        )
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {"backend": "sqlite", "sessions": count, "max_sessions": self.max_sessions}
+
+@registry.register("session_store")
+def create_session_store():
+    if SESSION_STORE == "sqlite":
+        return SqliteSessionStore(SESSION_DB_PATH, SESSION_MAX, SESSION_TTL)
+    if SESSION_STORE == "memory":
+        return MemorySessionStore(SESSION_MAX, SESSION_TTL)
+    return None
+
+def load_session(session_id):
+    """State of `session_id` (None without a session or store)"""
+    if not session_id:
+        return None
+    store = registry.get("session_store")
+    if store is None:
+        return None
+    with stage("session_load"):
+        return store.get(session_id)
+
+def has_history(state):
+    return bool(state and (state["turns"] or state["summary"]))
+
+def _turn_tokens(turn):
+    return estimate_tokens(turn["question"]) + estimate_tokens(turn["answer"])
+
+def split_history(turns, token_budget=HISTORY_TOKEN_BUDGET):
+    """
+    Split turns into (older, recent): `recent` is the longest suffix that fits
+    in `token_budget` tokens, `older` is what must be summarized.
+    """
+    used = 0
+    start = len(turns)
+    for i in range(len(turns) - 1, -1, -1):
+        used += _turn_tokens(turns[i])
+        if used > token_budget:
+            break
+        start = i
+    return turns[:start], turns[start:]
+
+def system_message(prompt, state):
+    """System prompt with the session's running summary appended"""
+    if state and state.get("summary"):
+        prompt = f"{prompt}\n\nTóm tắt cuộc hội thoại trước đó:\n{state['summary']}"
+    return SystemMessage(content=prompt)
+
+def history_messages(state):
+    """Recent turns of a session as chat messages, within HISTORY_TOKEN_BUDGET"""
+    if not state:
+        return []
+    messages = []
+    _, recent = split_history(state.get("turns", []))
+    for turn in recent:
+        messages.append(HumanMessage(content=turn["question"]))
+        messages.append(AIMessage(content=turn["answer"]))
+    return messages
+
+# Tóm tắt tăng dần: tóm tắt cũ + các lượt vừa bị đẩy ra khỏi cửa sổ
+summary_prompt = (
+"Dưới đây là bản tóm tắt cuộc hội thoại giữa người dùng và trợ lý y tế, cùng các lượt hội thoại mới hơn.\n"
+"Hãy viết lại một bản tóm tắt ngắn gọn (tối đa 5 câu, bằng tiếng Việt) giữ lại các vấn đề sức khỏe, "
+"triệu chứng, bệnh và thông tin quan trọng người dùng đã đề cập.\n\n"
+"Tóm tắt hiện tại:\n{summary}\n\n"
+"Các lượt hội thoại mới:\n{turns}"
+)
+
+@registry.register("summary_llm")
+def create_summary_llm():
+    # Chạy nền sau khi trả lời xong: không hedge, không retry (lỗi -> tóm tắt trích xuất)
+    return ResilientLLM(
+        registry.get("chat_model"),
+        timeout=SESSION_SUMMARY_TIMEOUT,
+        max_retries=0,
+        hedge=False,
+        breaker=llm_breaker
+    )
+
+def _clip(text, token_budget):
+    max_chars = token_budget * CHARS_PER_TOKEN
+    return text if len(text) <= max_chars else text[:max_chars].rsplit(" ", 1)[0] + "..."
+
+def extractive_summary(summary, turns):
+    """Fallback without the LLM: the user's previous questions"""
+    questions = "; ".join(turn["question"] for turn in turns)
+    text = f"{summary} Người dùng đã hỏi: {questions}." if summary else f"Người dùng đã hỏi: {questions}."
+    # Giữ phần mới nhất khi vượt ngân sách
+    max_chars = SUMMARY_TOKEN_BUDGET * CHARS_PER_TOKEN
+    return text if len(text) <= max_chars else "..." + text[-max_chars:]
+
+def summarize_turns(summary, turns):
+    """New summary folding `turns` into `summary`"""
+    if llm_breaker.is_open():
+        return extractive_summary(summary, turns)
+    transcript = "\n".join(f"Người dùng: {turn['question']}\nTrợ lý: {turn['answer']}" for turn in turns)
+    try:
+        with stage("session_summary"):
+            text = (registry.get("summary_llm") | StrOutputParser()).invoke(
+                summary_prompt.format(summary=summary or "(chưa có)", turns=transcript)
+            )
+        return _clip(text.strip(), SUMMARY_TOKEN_BUDGET)
+    except Exception as e:
+        print(f"Session summary error: {e}")
+        return extractive_summary(summary, turns)
+
+# Tóm tắt chạy nền, không giữ stream của người dùng
+_summary_pool = ThreadPoolExecutor(max_workers=2)
+
+def record_turn(session_id, question, answer, retrieval=None):
+    """
+    Append a finished turn (and the context it was answered from, if any) to the
+    session. Turns that no longer fit in the history budget are summarized in the background.
+    """
+    if not session_id or not answer:
+        return
+    store = registry.get("session_store")
+    if store is None:
+        return
+
+    def append(state):
+        state["turns"].append({"question": question, "answer": answer})
+        # Giới hạn cứng: các lượt quá cũ chưa kịp tóm tắt bị bỏ
+        del state["turns"][:-SESSION_MAX_TURNS]
+        if retrieval is not None:
+            state["retrieval"] = retrieval
+
+    with stage("session_save"):
+        state = store.update(session_id, append)
+    if split_history(state["turns"])[0]:
+        _summary_pool.submit(compact_session, session_id, state)
+
+def compact_session(session_id, state):
+    """Fold the turns outside the history window into the running summary"""
+    older, _ = split_history(state["turns"])
+    if not older:
+        return
+    summary = summarize_turns(state["summary"], older)
+
+    def apply(state):
+        # Lượt mới có thể đã được thêm trong lúc tóm tắt: chỉ bỏ đúng các lượt đã tóm tắt
+        if state["turns"][:len(older)] == older:
+            del state["turns"][:len(older)]
+            state["summary"] = summary
+
+    try:
+        registry.get("session_store").update(session_id, apply)
+    except Exception as e:
+        print(f"Session compaction error: {e}")
+
+def session_stats():
+    if not registry.is_loaded("session_store") or registry.get("session_store") is None:
+        return {"backend": SESSION_STORE, "sessions": 0}
+    return registry.get("session_store").stats()
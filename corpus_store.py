@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+# Kho dữ liệu dùng chung: crawler ghi, indexer đọc tăng dần, retriever lấy text chunk theo ID
+CORPUS_DB_PATH = os.getenv(
+    "CORPUS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "corpus.db")
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY, url TEXT NOT NULL, text BLOB NOT NULL,
+    content_hash TEXT NOT NULL, updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sections (
+    doc_id TEXT NOT NULL, position INTEGER NOT NULL, text BLOB NOT NULL, metadata TEXT NOT NULL,
+    PRIMARY KEY (doc_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_id TEXT PRIMARY KEY, doc_id TEXT NOT NULL, text BLOB NOT NULL, metadata TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id);
+"""
+
+# Số tham số tối đa cho một truy vấn IN (...)
+_IN_BATCH = 500
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _pack(text):
+    return zlib.compress(text.encode("utf-8"), 6)
+
+def _unpack(blob):
+    return zlib.decompress(blob).decode("utf-8")
+
+class CorpusStore:
+    """
+    Crawled articles, their heading sections and the indexed chunks in one SQLite file.
+
+    Texts are zlib-compressed and every table is keyed by doc_id / chunk_id, so
+    readers fetch rows by key or stream them with a cursor instead of loading
+    the whole corpus. Each thread gets its own connection (WAL: readers never
+    block the writer).
+    """
+
+    def __init__(self, path=CORPUS_DB_PATH, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        if not readonly:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.readonly:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            else:
+                conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _select_in(self, query, keys):
+        """Rows of `query` (with one {} placeholder for the IN list) for `keys`, in batches"""
+        keys = list(keys)
+        for start in range(0, len(keys), _IN_BATCH):
+            batch = keys[start:start + _IN_BATCH]
+            yield from self._conn().execute(query.format(",".join("?" * len(batch))), batch)
+
+    # --- crawler ---
+
+    def put_document(self, doc, sections):
+        """Store (or replace) one crawled article and its heading sections in a single transaction"""
+        doc_id = doc["metadata"]["doc_id"]
+        with self._write_lock, self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                (doc_id, doc["metadata"]["url"], _pack(doc["text"]), content_hash(doc["text"]), time.time())
+            )
+            conn.execute("DELETE FROM sections WHERE doc_id = ?", (doc_id,))
+            conn.executemany(
+                "INSERT INTO sections VALUES (?, ?, ?, ?)",
+                [
+                    (doc_id, i, _pack(section["text"]), json.dumps(section["metadata"], ensure_ascii=False))
+                    for i, section in enumerate(sections)
+                ]
+            )
+
+    # --- indexer ---
+
+    def document_hashes(self):
+        """doc_id -> content hash, without reading any text"""
+        return dict(self._conn().execute("SELECT doc_id, content_hash FROM documents"))
+
+    def iter_documents(self, doc_ids=None):
+        """Stream {"text", "metadata"} documents (all, or only `doc_ids`)"""
+        if doc_ids is None:
+            rows = self._conn().execute("SELECT doc_id, url, text FROM documents ORDER BY doc_id")
+        else:
+            rows = self._select_in("SELECT doc_id, url, text FROM documents WHERE doc_id IN ({})", doc_ids)
+        for doc_id, url, text in rows:
+            yield {"metadata": {"url": url, "doc_id": doc_id}, "text": _unpack(text)}
+
+    def iter_sections(self):
+        """Stream the crawled heading sections, grouped per document in order"""
+        rows = self._conn().execute("SELECT text, metadata FROM sections ORDER BY doc_id, position")
+        for text, metadata in rows:
+            yield {"text": _unpack(text), "metadata": json.loads(metadata)}
+
+    def chunk_ids(self):
+        return {row[0] for row in self._conn().execute("SELECT chunk_id FROM chunks")}
+
+    def put_chunks(self, chunks):
+        """Upsert indexed chunks ({chunk_id: {"text", "metadata"}})"""
+        with self._write_lock, self._conn() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                [
+                    (chunk_id, item["metadata"]["doc_id"], _pack(item["text"]),
+                     json.dumps(item["metadata"], ensure_ascii=False))
+                    for chunk_id, item in chunks.items()
+                ]
+            )
+
+    def delete_chunks(self, chunk_ids):
+        with self._write_lock, self._conn() as conn:
+            conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+
+    def iter_chunks(self):
+        """Stream indexed chunks as {"id", "text", "metadata"} items"""
+        for chunk_id, text, metadata in self._conn().execute("SELECT chunk_id, text, metadata FROM chunks"):
+            yield {"id": chunk_id, "text": _unpack(text), "metadata": json.loads(metadata)}
+
+    # --- retriever ---
+
+    def get_chunk_texts(self, chunk_ids):
+        """chunk_id -> text for the given IDs (missing IDs are left out)"""
+        return {
+            chunk_id: _unpack(text)
+            for chunk_id, text in self._select_in("SELECT chunk_id, text FROM chunks WHERE chunk_id IN ({})", chunk_ids)
+        }
+
+    # --- maintenance ---
+
+    def import_json(self, contents_path, chunks_path):
+        """Load the legacy full_contents.json / detailed_chunks.json into the store"""
+        with open(contents_path, "r", encoding="utf-8") as f:
+            documents = json.load(f)
+        with open(chunks_path, "r", encoding="utf-8") as f:
+            sections_by_doc = {}
+            for section in json.load(f):
+                sections_by_doc.setdefault(section["metadata"]["doc_id"], []).append(section)
+        for doc in documents:
+            if doc:
+                self.put_document(doc, sections_by_doc.get(doc["metadata"]["doc_id"], []))
+        return len(documents)
+
+    def export_json(self, output_dir="."):
+        """Write full_contents.json / detailed_chunks.json from the store (for tools that read JSON)"""
+        with open(os.path.join(output_dir, "full_contents.json"), "w", encoding="utf-8") as f:
+            json.dump(list(self.iter_documents()), f, ensure_ascii=False, indent=2)
+        with open(os.path.join(output_dir, "detailed_chunks.json"), "w", encoding="utf-8") as f:
+            json.dump(list(self.iter_sections()), f, ensure_ascii=False, indent=2)
+
+    def stats(self):
+        conn = self._conn()
+        counts = {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("documents", "sections", "chunks")
+        }
+        counts["bytes"] = sum(
+            os.path.getsize(self.path + suffix) for suffix in ("", "-wal") if os.path.exists(self.path + suffix)
+        )
+        return counts
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+if __name__ == "__main__":
+    # python corpus_store.py import data/full_contents.json data/detailed_chunks.json
+    # python corpus_store.py export data/
+    # python corpus_store.py stats
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    store = CorpusStore()
+    if command == "import":
+        print(f"Imported {store.import_json(sys.argv[2], sys.argv[3])} documents into {store.path}")
+    elif command == "export":
+        store.export_json(sys.argv[2] if len(sys.argv) > 2 else ".")
+        print("Exported full_contents.json / detailed_chunks.json")
+    print(store.stats())
@@ -0,0 +1,233 @@
+import os
+import re
+import sys
+import json
+import zlib
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from context_packing import estimate_tokens
+
+# Cửa sổ token mục tiêu cho mỗi chunk (ước lượng như ngân sách ngữ cảnh), phần gối đầu giữa hai chunk liên tiếp
+CHUNK_TARGET_TOKENS = int(os.getenv("CHUNK_TARGET_TOKENS", "350"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+# Mục ngắn hơn được gộp với mục kề bên cùng section_h2
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "100"))
+# Jaccard (5-gram từ) từ ngưỡng này trở lên được xem là trùng lặp
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+
+HEADING_KEYS = ("section_h1", "section_h2", "section_h3", "section_h4")
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+
+def split_heading(chunk):
+    """(heading prefix, body) of a crawled chunk, whose text starts with '<deepest heading>: '"""
+    metadata = chunk["metadata"]
+    for key in ("section_h4", "section_h3", "section_h2"):
+        heading = metadata.get(key)
+        if heading:
+            prefix = heading + ": "
+            if chunk["text"].startswith(prefix):
+                return prefix, chunk["text"][len(prefix):]
+            break
+    return "", chunk["text"]
+
+def _units(body, max_tokens):
+    """Paragraphs / list items, split further into sentences then words when longer than `max_tokens`"""
+    units = []
+    for paragraph in body.split("\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            if estimate_tokens(sentence) <= max_tokens:
+                units.append(sentence)
+                continue
+            words, current = sentence.split(), []
+            for word in words:
+                if current and estimate_tokens(" ".join(current + [word])) > max_tokens:
+                    units.append(" ".join(current))
+                    current = []
+                current.append(word)
+            if current:
+                units.append(" ".join(current))
+    return units
+
+def _overlap(units, overlap_tokens):
+    """Trailing units of a window totalling at most `overlap_tokens` (else the tail words of the last one)"""
+    tail, used = [], 0
+    for unit in reversed(units):
+        used += estimate_tokens(unit)
+        if used > overlap_tokens:
+            break
+        tail.insert(0, unit)
+    if not tail and units and overlap_tokens > 0:
+        words = units[-1].split()
+        n = max(1, overlap_tokens * len(words) // max(estimate_tokens(units[-1]), 1))
+        tail = [" ".join(words[-n:])]
+    return tail
+
+def split_chunk(chunk, target_tokens, overlap_tokens):
+    """Split one section into windows of at most `target_tokens`, each repeating the heading prefix"""
+    if estimate_tokens(chunk["text"]) <= target_tokens:
+        return [chunk]
+    prefix, body = split_heading(chunk)
+    budget = max(target_tokens - estimate_tokens(prefix), 1)
+    units = _units(body, budget)
+
+    pieces, window, used = [], [], 0
+    for unit in units:
+        tokens = estimate_tokens(unit)
+        if window and used + tokens > budget:
+            pieces.append(window)
+            window = _overlap(window, min(overlap_tokens, budget - tokens))
+            used = sum(estimate_tokens(u) for u in window)
+        window.append(unit)
+        used += tokens
+    if window:
+        pieces.append(window)
+    return [{"text": prefix + "\n".join(piece), "metadata": dict(chunk["metadata"])} for piece in pieces]
+
+def _common_breadcrumb(a, b):
+    """Metadata of a merged chunk: shared heading path only, other fields from `a`"""
+    metadata = {key: value for key, value in a.items() if key not in HEADING_KEYS}
+    for key in HEADING_KEYS:
+        if key not in a or a.get(key) != b.get(key):
+            break
+        metadata[key] = a[key]
+    return metadata
+
+def merge_small(chunks, target_tokens, min_tokens):
+    """Merge consecutive short sections of the same document and section_h2 while they fit in `target_tokens`"""
+    merged = []
+    for chunk in chunks:
+        if merged:
+            last = merged[-1]
+            same_section = all(
+                last["metadata"].get(key) == chunk["metadata"].get(key) for key in ("doc_id", "section_h1", "section_h2")
+            )
+            last_tokens, tokens = estimate_tokens(last["text"]), estimate_tokens(chunk["text"])
+            if same_section and (last_tokens < min_tokens or tokens < min_tokens) \
+                    and last_tokens + tokens <= target_tokens:
+                merged[-1] = {
+                    "text": last["text"] + "\n" + chunk["text"],
+                    "metadata": _common_breadcrumb(last["metadata"], chunk["metadata"])
+                }
+                continue
+        merged.append({"text": chunk["text"], "metadata": dict(chunk["metadata"])})
+    return merged
+
+def rechunk(chunks, target_tokens=CHUNK_TARGET_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS,
+            min_tokens=CHUNK_MIN_TOKENS):
+    """
+    Token-bounded chunks from the per-heading sections of crawling.py: short
+    sections are merged with their neighbours under the same section_h2, long
+    ones are split into overlapping windows. Order and section_h* metadata are kept.
+    """
+    chunks = merge_small(chunks, target_tokens, min_tokens)
+    return [piece for chunk in chunks for piece in split_chunk(chunk, target_tokens, overlap_tokens)]
+
+# --- near-duplicate elimination ---
+
+_MERSENNE = np.uint64((1 << 31) - 1)
+
+def shingles(text, size=5):
+    """Hashed word `size`-grams of the lowercased text"""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + size]).encode("utf-8")) for i in range(len(words) - size + 1)}
+
+def minhash_signatures(shingle_sets, num_perm=128, seed=1):
+    """MinHash signature matrix (one row per set) with universal hashes (a*x + b) mod 2^31-1"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(_MERSENNE), num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(_MERSENNE), num_perm, dtype=np.uint64)
+    signatures = np.full((len(shingle_sets), num_perm), _MERSENNE, dtype=np.uint64)
+    for i, hashes in enumerate(shingle_sets):
+        if hashes:
+            x = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+            signatures[i] = ((np.outer(x, a) + b) % _MERSENNE).min(axis=0)
+    return signatures
+
+def lsh_candidates(signatures, bands=16):
+    """Pairs (i, j), i < j, sharing at least one band of their signatures"""
+    rows = signatures.shape[1] // bands
+    pairs = set()
+    for band in range(bands):
+        buckets = {}
+        for i, row in enumerate(signatures[:, band * rows:(band + 1) * rows]):
+            buckets.setdefault(row.tobytes(), []).append(i)
+        for members in buckets.values():
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    pairs.add((members[x], members[y]))
+    return pairs
+
+def deduplicate(chunks, threshold=DEDUP_THRESHOLD, num_perm=128, bands=16):
+    """
+    Drop near-duplicate chunks across the corpus (MinHash/LSH candidates,
+    confirmed with the exact shingle Jaccard >= `threshold`). The first chunk
+    of each duplicate group in corpus order is kept as the canonical copy;
+    its metadata gets `source_urls` (newline-separated, every article the text
+    appears in, for citations), `source_doc_ids` (list of those articles'
+    doc_ids, so a search restricted to any of them still finds the chunk;
+    list-valued metadata needs chromadb>=1.5) and
+    `duplicates` (number of copies removed).
+
+    Returns:
+        tuple: (kept chunks, number of chunks removed)
+    """
+    shingle_sets = [shingles(chunk["text"]) for chunk in chunks]
+    signatures = minhash_signatures(shingle_sets, num_perm)
+
+    parent = list(range(len(chunks)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in lsh_candidates(signatures, bands):
+        a, b = shingle_sets[i], shingle_sets[j]
+        if a and b and len(a & b) / len(a | b) >= threshold:
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                # Gốc là chunk xuất hiện sớm nhất
+                parent[max(ri, rj)] = min(ri, rj)
+
+    groups = {}
+    for i in range(len(chunks)):
+        groups.setdefault(find(i), []).append(i)
+
+    kept = []
+    for i, chunk in enumerate(chunks):
+        members = groups.get(i)
+        if members is None:
+            continue
+        chunk = {"text": chunk["text"], "metadata": dict(chunk["metadata"])}
+        if len(members) > 1:
+            urls = list(dict.fromkeys(chunks[m]["metadata"].get("url", "") for m in members))
+            chunk["metadata"]["source_urls"] = "\n".join(url for url in urls if url)
+            # Lọc theo tài liệu (Chroma "$contains", dải hàng của NumPy index) khớp mọi bài chứa đoạn này
+            chunk["metadata"]["source_doc_ids"] = list(dict.fromkeys(chunks[m]["metadata"]["doc_id"] for m in members))
+            chunk["metadata"]["duplicates"] = len(members) - 1
+        kept.append(chunk)
+    return kept, len(chunks) - len(kept)
+
+def prepare_chunks(chunks):
+    """Re-chunk to the token window, then remove near-duplicates; prints a short report"""
+    rechunked = rechunk(chunks)
+    kept, removed = deduplicate(rechunked)
+    tokens = [estimate_tokens(chunk["text"]) for chunk in kept]
+    print(f"Chunking: {len(chunks)} sections -> {len(rechunked)} chunks, {removed} near-duplicates removed, "
+          f"{len(kept)} kept (tokens p50 {int(np.median(tokens)) if tokens else 0}, max {max(tokens, default=0)})")
+    return kept
+
+if __name__ == "__main__":
+    # Xem trước kết quả chunking trên detailed_chunks.json mà không index
+    with open("detailed_chunks.json", "r", encoding="utf-8") as f:
+        prepare_chunks(json.load(f))
@@ -1,12 +1,21 @@
 from bs4 import BeautifulSoup, Tag
 import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urldefrag, urlparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import argparse
 import hashlib
-import pprint
 import json
+import sys
+import os
 
-# Global containers
-full_contents = []
-detailed_chunks = []
+from summarization import RateLimiter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from corpus_store import CorpusStore, CORPUS_DB_PATH
+
+HEADERS = {"User-Agent": "Mozilla/5.0"}
 
 def get_doc_id(url):
     return hashlib.md5(url.encode("utf-8")).hexdigest()
@@ -28,29 +37,32 @@ def extract_text_between_tags(start_tag: Tag, end_tag: Tag = None):
             content.append(sibling.get_text(separator=' ', strip=True))
     return "\n".join(content)
 
-def process_html_to_documents(url):
+def extract_links(main_article: Tag, prefix="https://vnvc.vn"):
+    """Returns the unique article links (without fragment) found in the main article."""
+    links = []
+    for a in main_article.find_all("a", href=lambda x: x and x.startswith(prefix)):
+        link = urldefrag(a["href"])[0]
+        if link not in links:
+            links.append(link)
+    return links
+
+def parse_html_to_documents(url, html):
     """
-    Processes a single article, correctly handling nested headings and
+    Parses an article page into the full document, its heading chunks and the
+    article links it contains, correctly handling nested headings and
     headings that act only as containers.
     """
-    headers = {"User-Agent": "Mozilla/5.0"}
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-    except requests.RequestException as e:
-        print(f"Error fetching {url}: {e}")
-        return None, []
-
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = BeautifulSoup(html, "html.parser")
     main_article = soup.find(id="ftwp-postcontent")
     if not main_article:
-        return None, []
+        return None, [], []
 
     full_text = main_article.get_text(separator="\n", strip=True)
     full_doc = {
         "metadata": {"url": url, "doc_id": get_doc_id(url)},
         "text": full_text
     }
+    links = extract_links(main_article)
 
     clean_article = clean_html(main_article)
     headings = clean_article.find_all(['h2', 'h3', 'h4'])
@@ -85,44 +97,174 @@ def process_html_to_documents(url):
                 "metadata": metadata
             })
 
-    return full_doc, chunks
+    return full_doc, chunks, links
+
+def create_session(pool_size):
+    """requests.Session with a connection pool large enough for every worker"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+def load_crawl_state(path):
+    """url -> last state record (etag, last_modified, links) from the append-only state log"""
+    state = {}
+    if not os.path.exists(path):
+        return state
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Dòng cuối có thể bị cắt nếu lần chạy trước bị dừng giữa chừng
+                continue
+            state[record["url"]] = record
+    return state
+
+def crawl(seed_urls, output_dir=".", max_depth=1, workers=8, requests_per_second_per_host=2.0,
+          refresh=False, max_pages=None, corpus_path=CORPUS_DB_PATH):
+    """
+    Concurrent, polite and resumable crawl starting from `seed_urls`.
+
+    Pages are fetched with a pooled session by `workers` threads, at most
+    `requests_per_second_per_host` per host. Each parsed article and its
+    heading chunks are written to the corpus store at `corpus_path` as they
+    arrive and every finished URL is logged to crawl_state.jsonl, so an
+    interrupted crawl resumes where it stopped. A page that fails to fetch,
+    parse or store is counted as failed and retried on the next run. With
+    refresh=True already crawled pages are re-fetched with conditional
+    requests (ETag / Last-Modified) and only changed pages are written again.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    state_path = os.path.join(output_dir, "crawl_state.jsonl")
+
+    state = load_crawl_state(state_path)
+    store = CorpusStore(corpus_path)
+    session = create_session(workers)
+    limiters = {}
+    lock = threading.Lock()
+    stats = {"fetched": 0, "not_modified": 0, "resumed": 0, "failed": 0}
+
+    def host_limiter(url):
+        host = urlparse(url).netloc
+        with lock:
+            if host not in limiters:
+                limiters[host] = RateLimiter(requests_per_second_per_host * 60)
+            return limiters[host]
+
+    def count(name):
+        with lock:
+            stats[name] += 1
+
+    def append_jsonl(path, records):
+        with lock:
+            with open(path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def fetch(url):
+        """Returns the links found on `url` (from the state log when not re-fetched)"""
+        previous = state.get(url)
+        if previous and not refresh:
+            count("resumed")
+            return previous.get("links", [])
+
+        headers = {}
+        if previous and previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous and previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+        host_limiter(url).wait()
+        try:
+            response = session.get(url, headers=headers, timeout=30)
+            if response.status_code == 304:
+                count("not_modified")
+                return previous.get("links", [])
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Error fetching {url}: {e}")
+            count("failed")
+            return []
+
+        try:
+            full_doc, chunks, links = parse_html_to_documents(url, response.text)
+            if full_doc:
+                store.put_document(full_doc, chunks)
+        except Exception as e:
+            # Lỗi của một trang không dừng cả lần crawl; không ghi state nên lần chạy sau thử lại
+            print(f"Error processing {url}: {e}")
+            count("failed")
+            return []
+        # Ghi state sau cùng: URL chỉ được coi là xong khi dữ liệu đã nằm trong corpus store
+        append_jsonl(state_path, [{
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "links": links
+        }])
+        count("fetched")
+        print(f"Crawled {url} ({len(chunks)} chunks)")
+        return links
+
+    seen = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+
+        def submit(url, depth):
+            url = urldefrag(url)[0]
+            if url in seen or (max_pages is not None and len(seen) >= max_pages):
+                return
+            seen.add(url)
+            futures[pool.submit(fetch, url)] = depth
+
+        for url in seed_urls:
+            submit(url, 0)
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                depth = futures.pop(future)
+                links = future.result()
+                if depth < max_depth:
+                    for link in links:
+                        submit(link, depth + 1)
+
+    session.close()
+    store.close()
+    print(f"Crawl finished: {stats}")
+    return stats
+
+def export_json(output_dir=".", corpus_path=CORPUS_DB_PATH):
+    """Write full_contents.json / detailed_chunks.json from the corpus store, for tools that still read JSON"""
+    CorpusStore(corpus_path).export_json(output_dir)
+    print("Saved to full_contents.json / detailed_chunks.json")
 
 # main URL
 source_url = "https://vnvc.vn/benh-thuong-gap-o-tre-em-duoi-5-tuoi/"
 
-# Run
-full_doc, chunks = process_html_to_documents(source_url)
-
-if full_doc:
-    full_contents.append(full_doc)
-detailed_chunks.extend(chunks)
-
-# Get all VNVC links from the main page
-url = "https://vnvc.vn/benh-thuong-gap-o-tre-em-duoi-5-tuoi/"
-headers = {"User-Agent": "Mozilla/5.0"}
-
-response = requests.get(url, headers=headers)
-soup = BeautifulSoup(response.text, "html.parser")
-main_article = soup.find(id="ftwp-postcontent")
-
-vnvc_links = main_article.find_all(
-    "a",
-    href=lambda x: x and x.startswith("https://vnvc.vn")
-) if main_article else []
-
-# Process all found links
-for link in vnvc_links:
-    full_doc, chunks = process_html_to_documents(link["href"])
-
-    if full_doc:
-        full_contents.append(full_doc)
-    detailed_chunks.extend(chunks)
-    
-# Save data to JSON files
-with open("detailed_chunks.json", "w", encoding="utf-8") as f:
-    json.dump(detailed_chunks, f, ensure_ascii=False, indent=2)
-print("Saved to detailed_chunks.json")
-
-with open("full_contents.json", "w", encoding="utf-8") as f:
-    json.dump(full_contents, f, ensure_ascii=False, indent=2)
-print("Saved to full_contents.json")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl VNVC health articles")
+    parser.add_argument("--seed", action="append", help="Seed URL (repeatable)")
+    parser.add_argument("--depth", type=int, default=1, help="Link depth to follow from the seeds")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=2.0, help="Requests per second per host")
+    parser.add_argument("--max-pages", type=int, default=None)
+    parser.add_argument("--refresh", action="store_true",
+                        help="Re-check crawled pages with conditional requests")
+    parser.add_argument("--export-json", action="store_true",
+                        help="Also write full_contents.json / detailed_chunks.json from the corpus store")
+    args = parser.parse_args()
+
+    crawl(
+        args.seed or [source_url],
+        max_depth=args.depth,
+        workers=args.workers,
+        requests_per_second_per_host=args.rate,
+        refresh=args.refresh,
+        max_pages=args.max_pages
+    )
+    if args.export_json:
+        export_json()
@@ -1,25 +1,113 @@
 import os
+import sys
 import json
 from langchain_google_genai import ChatGoogleGenerativeAI
 import dotenv
-from langchain.chains.summarize import load_summarize_chain
 from langchain.prompts import PromptTemplate
-from langchain.docstore.document import Document
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.output_parsers import StrOutputParser
 from langchain_chroma import Chroma
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vector_index import NumpyVectorIndex
+from lexical_index import LexicalIndex
+from embedding_cache import EmbeddingCache, ParallelEncoder
+from embedding_backends import load_embedding_model, embedding_model_id
+from summarization import summarize_documents, FakeSummarizer
+from chunking import prepare_chunks
+from llm_client import ResilientLLM, fake_chat_model_from_env
+from corpus_store import CorpusStore, CORPUS_DB_PATH, content_hash
+
 # Load environment variables
 dotenv.load_dotenv()
-os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
 
-llm = ChatGoogleGenerativeAI(model="models/gemini-2.0-flash")
+# SUMMARIZER=fake dùng LLM giả lập để chạy thử pipeline không cần API key
+USE_FAKE_SUMMARIZER = os.getenv("SUMMARIZER", "gemini") == "fake"
+# Deadline cho mỗi lần tóm tắt; retry do summarize_documents đảm nhiệm
+SUMMARY_TIMEOUT = float(os.getenv("SUMMARY_TIMEOUT", "60"))
+if not USE_FAKE_SUMMARIZER:
+    if os.getenv("LLM_PROVIDER", "gemini") == "fake":
+        chat_model = fake_chat_model_from_env()
+    else:
+        os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
+        chat_model = ChatGoogleGenerativeAI(model="models/gemini-2.0-flash", timeout=SUMMARY_TIMEOUT, max_retries=0)
+    # Không hedge: tóm tắt là job throughput, request trùng chỉ tốn quota.
+    # Không circuit breaker: một đợt 429 chỉ cần backoff (summarize_documents), breaker mở sẽ làm retry thất bại ngay
+    llm = ResilientLLM(chat_model, timeout=SUMMARY_TIMEOUT, max_retries=0, hedge=False)
+
+# Summarization stage settings
+SUMMARY_CHECKPOINT_PATH = "summaries_checkpoint.jsonl"
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_RPM = float(os.getenv("SUMMARY_RPM", "60"))
+SUMMARY_MAX_RETRIES = int(os.getenv("SUMMARY_MAX_RETRIES", "5"))
+
+# Manifest lưu hash nội dung đã được index, dùng để chỉ xử lý phần thay đổi
+MANIFEST_PATH = "index_manifest.json"
+
+# `python indexing.py --full` xóa collection và index lại toàn bộ
+FULL_REBUILD = "--full" in sys.argv or not os.path.exists(MANIFEST_PATH)
+
+# Đọc dữ liệu từ corpus store do crawling.py ghi; lần đầu nhập từ full_contents.json / detailed_chunks.json cũ
+store = CorpusStore(CORPUS_DB_PATH)
+if not store.document_hashes() and os.path.exists('full_contents.json'):
+    print(f"Importing {store.import_json('full_contents.json', 'detailed_chunks.json')} documents into {CORPUS_DB_PATH}")
+
+# Chunk theo heading của toàn bộ corpus (chunking + khử trùng lặp cần nhìn cả corpus); text bài viết chỉ đọc khi cần tóm tắt
+detailed_chunks = list(store.iter_sections())
+
+# Chia lại theo cửa sổ token + loại chunk trùng lặp giữa các bài (RECHUNK=false: mỗi heading một chunk như khi crawl)
+if os.getenv("RECHUNK", "true").lower() == "true":
+    detailed_chunks = prepare_chunks(detailed_chunks)
+
+def chunk_ids(chunks):
+    """
+    Stable chunk IDs: doc_id plus a hash of the chunk text, so inserting or
+    removing a section does not shift the IDs (and vectors) of the others.
+    """
+    seen = {}
+    ids = []
+    for item in chunks:
+        chunk_id = f"{item['metadata']['doc_id']}-{content_hash(item['text'])[:16]}"
+        # Cùng nội dung lặp lại trong một bài: thêm số thứ tự lần xuất hiện
+        n = seen.get(chunk_id, 0)
+        seen[chunk_id] = n + 1
+        ids.append(chunk_id if n == 0 else f"{chunk_id}-{n}")
+    return ids
+
+def load_manifest():
+    if FULL_REBUILD:
+        return {"documents": {}, "chunks": {}}
+    with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
-# Load data
-with open('full_contents.json', 'r', encoding='utf-8') as f:
-    full_contents = json.load(f)
+def save_manifest(manifest):
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
 
-with open('detailed_chunks.json', 'r', encoding='utf-8') as f:
-    detailed_chunks = json.load(f)
+manifest = load_manifest()
+
+# Xác định tài liệu cần tóm tắt lại (mới hoặc nội dung đã đổi) từ hash trong store, chỉ đọc text của các tài liệu đó
+doc_hashes = store.document_hashes()
+changed_docs = list(store.iter_documents(
+    [doc_id for doc_id, h in doc_hashes.items() if manifest["documents"].get(doc_id) != h]
+))
+removed_docs = [doc_id for doc_id in manifest["documents"] if doc_id not in doc_hashes]
+
+# Xác định chunk cần embed lại; hash gồm cả metadata vì metadata được lưu cùng vector
+current_chunks = dict(zip(chunk_ids(detailed_chunks), detailed_chunks))
+chunk_hashes = {
+    chunk_id: content_hash(item["text"] + json.dumps(item["metadata"], sort_keys=True, ensure_ascii=False))
+    for chunk_id, item in current_chunks.items()
+}
+changed_chunks = {
+    chunk_id: current_chunks[chunk_id] for chunk_id, h in chunk_hashes.items()
+    if manifest["chunks"].get(chunk_id) != h
+}
+removed_chunks = [chunk_id for chunk_id in manifest["chunks"] if chunk_id not in current_chunks]
+
+print(f"Documents: {len(changed_docs)} changed, {len(removed_docs)} removed, "
+      f"{len(doc_hashes) - len(changed_docs)} unchanged")
+print(f"Chunks: {len(changed_chunks)} changed, {len(removed_chunks)} removed, "
+      f"{len(current_chunks) - len(changed_chunks)} unchanged")
 
 # Define custom summarization prompt
 custom_prompt = PromptTemplate(
@@ -33,25 +121,28 @@ custom_prompt = PromptTemplate(
 )
 
 # Load summarization chain using the custom prompt
-summarizer = load_summarize_chain(llm, chain_type="stuff", prompt=custom_prompt)
+if USE_FAKE_SUMMARIZER:
+    summarize_text = FakeSummarizer()
+else:
+    # Tương đương chain "stuff" với một tài liệu
+    summarizer = custom_prompt | llm | StrOutputParser()
+
+    def summarize_text(text):
+        return summarizer.invoke({"text": text})
 
-# Run summarization
-summaries = []
-for doc in full_contents:
-    if not doc: continue
-    doc_obj = Document(page_content=doc["text"])
-    summary = summarizer.run([doc_obj])
-    summaries.append({
-        "metadata": doc["metadata"],
-        "summary": summary
-    })
+# Run summarization (chỉ cho tài liệu đã thay đổi), có checkpoint để chạy tiếp khi bị lỗi
+summaries = summarize_documents(
+    changed_docs,
+    summarize_text,
+    checkpoint_path=SUMMARY_CHECKPOINT_PATH,
+    max_concurrency=SUMMARY_CONCURRENCY,
+    requests_per_minute=SUMMARY_RPM,
+    max_retries=SUMMARY_MAX_RETRIES
+)
 
 
 # Khởi tạo mô hình embedding
-embedding_model = HuggingFaceEmbeddings(
-    model_name="intfloat/multilingual-e5-base",
-    encode_kwargs={"normalize_embeddings": True}
-)
+embedding_model = load_embedding_model()
 
 # Khởi tạo ChromaDB cho tóm tắt
 chroma_summary = Chroma(
@@ -59,16 +150,6 @@ chroma_summary = Chroma(
     embedding_function=embedding_model,
     persist_directory="chroma_storage/summaries"
 )
-chroma_summary.delete_collection()
-
-# Lưu các summary vào ChromaDB
-for item in summaries:
-    chroma_summary.add_documents([
-        Document(
-            page_content=item["summary"],
-            metadata=item["metadata"]
-        )
-    ])
 
 # Khởi tạo ChromaDB cho cách chunks
 chroma_detail = Chroma(
@@ -76,13 +157,98 @@ chroma_detail = Chroma(
     embedding_function=embedding_model,
     persist_directory="chroma_storage/details"
 )
-chroma_detail.delete_collection()
-
-# Lưu các detail vào ChromaDB
-for item in detailed_chunks:
-    chroma_detail.add_documents([
-        Document(
-            page_content=item["text"],
-            metadata=item["metadata"]
+
+if FULL_REBUILD:
+    chroma_summary.reset_collection()
+    chroma_detail.reset_collection()
+
+# Embedding theo batch lớn (tùy chọn nhiều tiến trình), vector được cache theo hash văn bản + tên model
+EMBED_PROCESSES = int(os.getenv("EMBED_PROCESSES", "1"))  # 0 = số lõi CPU
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+CHROMA_BATCH_SIZE = 1000
+
+embedding_cache = EmbeddingCache("embedding_cache", model_name=embedding_model_id())
+encoder = ParallelEncoder(
+    processes=EMBED_PROCESSES,
+    batch_size=EMBED_BATCH_SIZE,
+    embedding_model=embedding_model if EMBED_PROCESSES == 1 else None
+)
+
+def upsert(collection, ids, texts, metadatas, store_text=True):
+    """Upsert precomputed vectors so Chroma does not run the model again (with empty texts if store_text=False)"""
+    vectors = embedding_cache.embed(texts, encoder)
+    for start in range(0, len(ids), CHROMA_BATCH_SIZE):
+        end = start + CHROMA_BATCH_SIZE
+        collection._collection.upsert(
+            ids=ids[start:end],
+            embeddings=vectors[start:end].tolist(),
+            documents=texts[start:end] if store_text else [""] * len(ids[start:end]),
+            metadatas=metadatas[start:end]
         )
-    ])
+
+# Upsert summary theo doc_id, xóa summary của tài liệu đã bị gỡ
+if summaries:
+    upsert(
+        chroma_summary,
+        [item["metadata"]["doc_id"] for item in summaries],
+        [item["summary"] for item in summaries],
+        [item["metadata"] for item in summaries]
+    )
+if removed_docs:
+    chroma_summary.delete(ids=removed_docs)
+
+# Text của chunk chỉ nằm trong corpus store (rag.py lấy theo ID sau khi tìm vector); ghi trước khi Chroma
+# trỏ tới ID mới. Chunk chưa có trong store (index cũ, text nằm trong Chroma) cũng được bổ sung.
+stored_ids = store.chunk_ids()
+store.put_chunks({
+    chunk_id: item for chunk_id, item in current_chunks.items()
+    if chunk_id in changed_chunks or chunk_id not in stored_ids
+})
+
+# Upsert chunk theo ID ổn định (chỉ vector + metadata), xóa vector của chunk đã bị gỡ
+if changed_chunks:
+    upsert(
+        chroma_detail,
+        list(changed_chunks.keys()),
+        [item["text"] for item in changed_chunks.values()],
+        [item["metadata"] for item in changed_chunks.values()],
+        store_text=False
+    )
+if removed_chunks:
+    chroma_detail.delete(ids=removed_chunks)
+store.delete_chunks(stored_ids - current_chunks.keys())
+encoder.close()
+
+# Chỉ ghi manifest sau khi Chroma đã được cập nhật
+manifest["documents"] = doc_hashes
+manifest["chunks"] = chunk_hashes
+save_manifest(manifest)
+print(f"Saved manifest to {MANIFEST_PATH}")
+
+
+# Xuất vector sang NumPy index (VECTOR_BACKEND=numpy), có thể memory-map từ nhiều worker
+def export_collection(collection, with_text=True):
+    data = collection.get(include=["embeddings", "metadatas"] + (["documents"] if with_text else []))
+    texts = data["documents"] if with_text else [""] * len(data["ids"])
+    items = [
+        {"id": id_, "text": text, "metadata": metadata}
+        for id_, text, metadata in zip(data["ids"], texts, data["metadatas"])
+    ]
+    return data["embeddings"], items
+
+summary_embeddings, summary_items = export_collection(chroma_summary)
+# Chunk trong NumPy index cũng không giữ text (lấy từ corpus store)
+detail_embeddings, detail_items = export_collection(chroma_detail, with_text=False)
+
+numpy_index = NumpyVectorIndex.build(
+    summary_embeddings, summary_items,
+    detail_embeddings, detail_items,
+    dtype=os.getenv("NUMPY_INDEX_DTYPE", "float32")
+)
+numpy_index.save("numpy_index")
+print("Saved NumPy index to numpy_index/")
+
+# Dựng lại BM25 index cho hybrid retrieval (rag.py đọc lexical_index.json)
+lexical_index = LexicalIndex.from_chunks_and_summaries(store.iter_chunks(), summary_items)
+lexical_index.save("lexical_index.json")
+print("Saved BM25 index to lexical_index.json")
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+class RateLimiter:
+    """Thread-safe limiter spacing call starts to at most `rate_per_minute`"""
+
+    def __init__(self, rate_per_minute):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute and rate_per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def call_with_backoff(fn, *args, max_retries=5, base_delay=1.0, max_delay=60.0, rate_limiter=None):
+    """Call `fn(*args)`, retrying failures with exponential backoff and full jitter"""
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        try:
+            return fn(*args)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print(f"Retry {attempt + 1}/{max_retries} in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+def load_checkpoint(path):
+    """Read finished summaries from a JSONL checkpoint: doc_id -> record"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Dòng cuối có thể bị cắt nếu lần chạy trước bị dừng giữa chừng
+                continue
+            done[record["metadata"]["doc_id"]] = record
+    return done
+
+def summarize_documents(docs, summarize_fn, checkpoint_path, max_concurrency=4,
+                        requests_per_minute=60, max_retries=5):
+    """
+    Summarize documents with bounded concurrency, rate limiting and retries.
+
+    Every finished summary is appended to `checkpoint_path` immediately, so a
+    rerun skips documents whose doc_id and text hash are already in the checkpoint.
+
+    Args:
+        docs (list[dict]): {"text", "metadata"} items, metadata must contain doc_id
+        summarize_fn (callable): text -> summary
+        checkpoint_path (str): append-only JSONL file
+
+    Returns:
+        list[dict]: {"metadata", "summary"} for every doc, in input order
+    """
+    done = load_checkpoint(checkpoint_path)
+    text_hashes = [hashlib.sha256(doc["text"].encode("utf-8")).hexdigest() for doc in docs]
+    pending = [
+        (i, doc) for i, doc in enumerate(docs)
+        if done.get(doc["metadata"]["doc_id"], {}).get("hash") != text_hashes[i]
+    ]
+    print(f"Summaries: {len(docs) - len(pending)} from checkpoint, {len(pending)} to generate")
+
+    rate_limiter = RateLimiter(requests_per_minute)
+    write_lock = threading.Lock()
+
+    def work(i, doc):
+        summary = call_with_backoff(
+            summarize_fn, doc["text"],
+            max_retries=max_retries, rate_limiter=rate_limiter
+        )
+        record = {"metadata": doc["metadata"], "hash": text_hashes[i], "summary": summary}
+        with write_lock:
+            with open(checkpoint_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return record
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        futures = [pool.submit(work, i, doc) for i, doc in pending]
+        for n, future in enumerate(as_completed(futures), 1):
+            # Lỗi sau khi hết lượt retry dừng cả lần chạy; các summary đã xong vẫn nằm trong checkpoint
+            record = future.result()
+            done[record["metadata"]["doc_id"]] = record
+            print(f"[{n}/{len(pending)}] Summarized {record['metadata']['url']}")
+
+    return [
+        {"metadata": doc["metadata"], "summary": done[doc["metadata"]["doc_id"]]["summary"]}
+        for doc in docs
+    ]
+
+class FakeSummarizer:
+    """Offline stand-in for the LLM: returns the first sentences after a delay, optionally failing"""
+
+    def __init__(self, latency=0.1, failure_rate=0.0, max_chars=500):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.max_chars = max_chars
+
+    def __call__(self, text):
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise RuntimeError("Fake LLM error (429 Resource exhausted)")
+        return text[:self.max_chars]
@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from embedding_cache import EMBEDDING_MODEL_NAME
+
+# "torch" (HuggingFaceEmbeddings) | "onnx" (exported model, int8 dynamic quantization)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv(
+    "ONNX_MODEL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "onnx", "multilingual-e5-base")
+)
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "true").lower() == "true"
+# 0 = để onnxruntime tự chọn số luồng
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+
+class OnnxEmbeddings(Embeddings):
+    """
+    multilingual-e5 encoder running on onnxruntime (CPU).
+
+    Same output as HuggingFaceEmbeddings(normalize_embeddings=True): mean pooling
+    over the last hidden state followed by L2 normalization.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED, threads=ONNX_THREADS,
+                 batch_size=32, max_length=512):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_file = "model.int8.onnx" if quantized else "model.onnx"
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def _encode_batch(self, texts):
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+        )
+        mask = encoded["attention_mask"].astype(np.int64)
+        hidden = self.session.run(
+            ["last_hidden_state"],
+            {"input_ids": encoded["input_ids"].astype(np.int64), "attention_mask": mask}
+        )[0]
+        mask = mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = [None] * len(texts)
+        # Gom các câu có độ dài gần nhau vào cùng batch để giảm padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            for i, vector in zip(indices, self._encode_batch([texts[i] for i in indices])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def embedding_model_id(backend=EMBEDDING_BACKEND, quantized=ONNX_QUANTIZED):
+    """Model identity used to key cached vectors, so backends never mix in a cache"""
+    if backend == "onnx":
+        return f"{EMBEDDING_MODEL_NAME}#onnx{'-int8' if quantized else ''}"
+    return EMBEDDING_MODEL_NAME
+
+def load_embedding_model(backend=EMBEDDING_BACKEND, threads=None):
+    """Create the embedding model for the configured backend"""
+    if backend == "onnx":
+        return OnnxEmbeddings(threads=ONNX_THREADS if threads is None else threads)
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        encode_kwargs={"normalize_embeddings": True}
+    )
+
+def export_onnx_model(output_dir=ONNX_MODEL_DIR, model_name=EMBEDDING_MODEL_NAME):
+    """Export the PyTorch encoder to ONNX and add an int8 dynamically quantized copy"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.config.return_dict = False
+    model.eval()
+
+    sample = tokenizer(["query: cách điều trị cảm lạnh"], return_tensors="pt")
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state", "pooler_output"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=14
+        )
+    quantize_dynamic(fp32_path, os.path.join(output_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(output_dir)
+    print(f"Exported ONNX model to {output_dir}")
+
+def parity_check(texts, queries, min_cosine=0.98, min_overlap=0.9, k=10, quantized=ONNX_QUANTIZED):
+    """
+    Compare ONNX vectors with the PyTorch reference.
+
+    Checks the per-vector cosine similarity of every text and the overlap of
+    the top-k chunks retrieved for each query with either backend.
+
+    Returns:
+        dict: metrics and "passed"
+    """
+    reference = load_embedding_model("torch")
+    candidate = OnnxEmbeddings(quantized=quantized)
+
+    ref_docs = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    onnx_docs = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    cosines = (ref_docs * onnx_docs).sum(axis=1)
+
+    ref_queries = np.asarray(reference.embed_documents(queries), dtype=np.float32)
+    onnx_queries = np.asarray(candidate.embed_documents(queries), dtype=np.float32)
+    overlaps = []
+    for ref_q, onnx_q in zip(ref_queries, onnx_queries):
+        ref_top = set(np.argsort(-(ref_docs @ ref_q))[:k])
+        onnx_top = set(np.argsort(-(onnx_docs @ onnx_q))[:k])
+        overlaps.append(len(ref_top & onnx_top) / k)
+
+    report = {
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        f"mean_top{k}_overlap": float(np.mean(overlaps)),
+        f"min_top{k}_overlap": float(np.min(overlaps)),
+    }
+    report["passed"] = report["min_cosine"] >= min_cosine and report[f"mean_top{k}_overlap"] >= min_overlap
+    return report
+
+if __name__ == "__main__":
+    # python embedding_backends.py export | parity
+    command = sys.argv[1] if len(sys.argv) > 1 else "parity"
+    if command == "export":
+        export_onnx_model()
+    else:
+        with open("data/detailed_chunks.json", "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        texts = [item["text"] for item in chunks]
+        # Tiêu đề mục được dùng như các câu hỏi mẫu
+        queries = sorted({item["metadata"].get("section_h2", "") for item in chunks} - {""})[:50]
+        report = parity_check(texts, queries)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["passed"] else 1)
@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+EMBEDDING_MODEL_NAME = "intfloat/multilingual-e5-base"
+
+def embedding_key(text, model_name=EMBEDDING_MODEL_NAME):
+    """Cache key: hash of the model name and the exact text"""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache shared by indexing, retrieval and evaluation.
+
+    Vectors are stored in `vectors.npy` (float32, memory-mapped on load) and a
+    side index `index.json` maps embedding_key(text, model) -> row.
+    """
+
+    def __init__(self, path, model_name=EMBEDDING_MODEL_NAME):
+        self.path = path
+        self.model_name = model_name
+        self.vectors_path = os.path.join(path, "vectors.npy")
+        self.index_path = os.path.join(path, "index.json")
+        self.index = {}
+        self.vectors = None
+        if os.path.exists(self.index_path) and os.path.exists(self.vectors_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+            self.vectors = np.load(self.vectors_path, mmap_mode="r")
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_many(self, texts):
+        """Return (vectors, missing) where vectors[i] is None for every i in missing"""
+        vectors = []
+        missing = []
+        for i, text in enumerate(texts):
+            row = self.index.get(embedding_key(text, self.model_name))
+            if row is None:
+                vectors.append(None)
+                missing.append(i)
+            else:
+                vectors.append(np.asarray(self.vectors[row]))
+        return vectors, missing
+
+    def add(self, texts, vectors):
+        """Append new vectors and rewrite the files atomically"""
+        new_rows = {}
+        new_vectors = []
+        for text, vector in zip(texts, vectors):
+            key = embedding_key(text, self.model_name)
+            if key in self.index or key in new_rows:
+                continue
+            new_rows[key] = len(self.index) + len(new_rows)
+            new_vectors.append(np.asarray(vector, dtype=np.float32))
+        if not new_vectors:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        stacked = np.vstack(new_vectors)
+        matrix = np.vstack([self.vectors, stacked]) if self.vectors is not None else stacked
+
+        # Ghi ra file tạm rồi đổi tên, để tiến trình khác không đọc phải file ghi dở
+        tmp_vectors = self.vectors_path + ".tmp.npy"
+        np.save(tmp_vectors, matrix)
+        self.index.update(new_rows)
+        tmp_index = self.index_path + ".tmp"
+        with open(tmp_index, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        self.vectors = None
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_index, self.index_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode="r")
+
+    def embed(self, texts, encode_fn):
+        """
+        Embed `texts`, calling `encode_fn` (list[str] -> vectors) once with
+        only the texts that are not cached yet.
+
+        Returns:
+            np.ndarray: one float32 row per input text
+        """
+        vectors, missing = self.get_many(texts)
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            computed = list(encode_fn(missing_texts))
+            self.add(missing_texts, computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+        print(f"Embeddings: {len(texts) - len(missing)} cached, {len(missing)} computed")
+        if not vectors:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(vectors)
+
+# Mô hình riêng của từng tiến trình con trong process pool
+_worker_model = None
+
+def _init_worker(threads):
+    global _worker_model
+    # Import tại chỗ: embedding_backends import lại module này
+    from embedding_backends import load_embedding_model
+    _worker_model = load_embedding_model(threads=threads)
+
+def _encode_batch(texts):
+    return _worker_model.embed_documents(texts)
+
+class ParallelEncoder:
+    """
+    Encode large batches across a process pool (one model copy per process,
+    CPU threads split between processes). With processes=1 it encodes in-process.
+    Workers load the model of the configured EMBEDDING_BACKEND.
+    """
+
+    def __init__(self, processes=None, batch_size=64, embedding_model=None):
+        self.batch_size = batch_size
+        self.processes = processes or os.cpu_count() or 1
+        self.embedding_model = embedding_model
+        self._pool = None
+
+    def __call__(self, texts):
+        texts = list(texts)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if self.processes <= 1:
+            if self.embedding_model is None:
+                _init_worker(None)
+                self.embedding_model = _worker_model
+            vectors = []
+            for batch in batches:
+                vectors.extend(self.embedding_model.embed_documents(batch))
+            return vectors
+
+        if self._pool is None:
+            threads = max(1, (os.cpu_count() or 1) // self.processes)
+            # fork tránh việc tiến trình con import lại script gọi (data/indexing.py chạy ở top level)
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork") if "fork" in methods else None
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(threads,)
+            )
+        vectors = []
+        for batch_vectors in self._pool.map(_encode_batch, batches):
+            vectors.extend(batch_vectors)
+        return vectors
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,173 @@
+import os
+import json
+import base64
+import socket
+import asyncio
+import argparse
+import itertools
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Unix socket của embedding sidecar; khi được đặt, rag.py dùng sidecar thay cho mô hình trong process
+EMBEDDING_SERVICE_SOCKET = os.getenv("EMBEDDING_SERVICE_SOCKET", "")
+
+def encode_vectors(vectors):
+    array = np.asarray(vectors, dtype=np.float32)
+    return {"shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+def decode_vectors(payload):
+    array = np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32)
+    return array.reshape(payload["shape"])
+
+class MicroBatcher:
+    """
+    Collect concurrent encode requests into one forward pass.
+
+    A batch is closed when it holds `max_batch_size` texts or `max_wait`
+    seconds after its first request arrived, whichever comes first.
+    """
+
+    def __init__(self, embedding_model, max_batch_size=64, max_wait=0.005):
+        self.embedding_model = embedding_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.stats = {"requests": 0, "texts": 0, "batches": 0}
+
+    async def encode(self, texts):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            try:
+                # Một forward pass cho cả batch, chạy ngoài event loop
+                vectors = await asyncio.to_thread(self.embedding_model.embed_documents, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.stats["requests"] += len(batch)
+            self.stats["texts"] += len(texts)
+            self.stats["batches"] += 1
+            offset = 0
+            for item_texts, future in batch:
+                if not future.done():
+                    future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+async def handle_connection(batcher, reader, writer):
+    """Newline-delimited JSON: {"id", "texts"} -> {"id", "vectors"} or {"id", "error"}"""
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            request = json.loads(line)
+            if request.get("stats"):
+                response = {"id": request.get("id"), "stats": batcher.stats}
+            else:
+                try:
+                    vectors = await batcher.encode(request["texts"])
+                    response = {"id": request.get("id"), "vectors": encode_vectors(vectors)}
+                except Exception as e:
+                    response = {"id": request.get("id"), "error": str(e)}
+            writer.write((json.dumps(response) + "\n").encode("utf-8"))
+            await writer.drain()
+    finally:
+        writer.close()
+
+async def serve(socket_path, max_batch_size=64, max_wait_ms=5.0):
+    from embedding_backends import load_embedding_model
+
+    embedding_model = load_embedding_model()
+    # Warm-up để request đầu tiên không phải chờ khởi tạo
+    embedding_model.embed_documents(["query: warm up"])
+    batcher = MicroBatcher(embedding_model, max_batch_size, max_wait_ms / 1000)
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = await asyncio.start_unix_server(
+        lambda r, w: handle_connection(batcher, r, w), path=socket_path, limit=2 ** 24
+    )
+    print(f"Embedding service listening on {socket_path} "
+          f"(max_batch_size={max_batch_size}, max_wait_ms={max_wait_ms})")
+    async with server:
+        await asyncio.gather(server.serve_forever(), batcher.run())
+
+class RemoteEmbeddings(Embeddings):
+    """Client of the embedding sidecar; one persistent connection per thread"""
+
+    def __init__(self, socket_path=EMBEDDING_SERVICE_SOCKET, timeout=30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+        return conn
+
+    def _request(self, payload):
+        payload["id"] = next(self._ids)
+        sock, stream = self._connection()
+        try:
+            sock.sendall((json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8"))
+            line = stream.readline()
+            if not line:
+                raise ConnectionError("Embedding service closed the connection")
+        except (OSError, ConnectionError):
+            # Kết nối hỏng: bỏ để lần sau kết nối lại
+            self._local.conn = None
+            sock.close()
+            raise
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"Embedding service error: {response['error']}")
+        return response
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        return decode_vectors(self._request({"texts": texts})["vectors"]).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def stats(self):
+        return self._request({"stats": True})["stats"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-batching embedding sidecar")
+    parser.add_argument("--socket", default=EMBEDDING_SERVICE_SOCKET or "/tmp/health_chatbot_embeddings.sock")
+    parser.add_argument("--max-batch-size", type=int, default=int(os.getenv("EMBED_MAX_BATCH_SIZE", "64")))
+    parser.add_argument("--max-wait-ms", type=float, default=float(os.getenv("EMBED_MAX_WAIT_MS", "5")))
+    args = parser.parse_args()
+    asyncio.run(serve(args.socket, args.max_batch_size, args.max_wait_ms))
@@ -0,0 +1,127 @@
+import re
+from lexical_index import syllables, strip_diacritics, has_diacritics
+
+# Intent của câu hỏi, quyết định đường trả lời trong pipeline single-shot
+GREETING = "greeting"
+MEDICAL = "medical"
+OUT_OF_SCOPE = "out_of_scope"
+
+# Từ khóa y tế (so khớp theo ranh giới âm tiết; bỏ dấu nếu câu hỏi gõ không dấu)
+MEDICAL_KEYWORDS = [
+    "bệnh", "triệu chứng", "dấu hiệu", "thuốc", "điều trị", "chữa", "chẩn đoán", "sốt", "đau",
+    "ho", "viêm", "nhiễm", "virus", "vi khuẩn", "vắc xin", "vaccine", "vacxin", "tiêm", "chủng ngừa",
+    "khám", "bác sĩ", "bệnh viện", "sức khỏe", "sức khoẻ", "dinh dưỡng", "mang thai", "mang bầu",
+    "thai", "sơ sinh", "cảm lạnh", "cảm cúm", "cúm", "huyết áp", "tiểu đường", "ung thư", "dị ứng",
+    "tiêu chảy", "nôn", "buồn nôn", "chóng mặt", "mệt mỏi", "ngứa", "phát ban", "xét nghiệm", "phòng ngừa",
+    "biến chứng", "lây", "tim mạch", "gan", "thận", "phổi", "da", "mắt", "răng", "xương",
+    "khớp", "máu", "tiêu hóa", "dạ dày", "mất ngủ", "trầm cảm", "liều", "uống", "kháng sinh",
+]
+
+GREETING_PHRASES = [
+    "xin chào", "chào", "hello", "hi", "hey", "alo", "cảm ơn", "cám ơn", "thank", "thanks",
+    "tạm biệt", "bye", "bạn là ai", "bạn tên gì", "bạn khỏe không", "bạn có khỏe không",
+    "ok", "oke", "được rồi",
+]
+THANKS_PHRASES = ["cảm ơn", "cám ơn", "thank", "thanks"]
+GOODBYE_PHRASES = ["tạm biệt", "bye"]
+
+# Câu chào thường ngắn; câu dài hơn được xem như câu hỏi
+GREETING_MAX_SYLLABLES = 8
+
+# Câu hỏi nối tiếp trong một cuộc hội thoại: ngắn và tham chiếu tới điều vừa nói
+FOLLOW_UP_PHRASES = [
+    "thì sao", "thế còn", "vậy còn", "còn ở", "còn với", "còn đối với", "bệnh này", "bệnh đó", "thuốc này", "thuốc đó",
+    "loại này", "loại đó", "cái này", "cái đó", "trường hợp này", "như vậy", "như thế", "vậy thì",
+    "nêu trên", "vừa nói", "ở trên",
+]
+FOLLOW_UP_MAX_SYLLABLES = 10
+# Đại từ thay cho chủ đề vừa nói ("nó có nguy hiểm không?") và từ mở đầu câu ("còn trẻ em?"). Chỉ xét câu
+# có dấu: bỏ dấu thì "no", "con" (con tôi...) là từ thông thường; "còn" giữa câu ("vẫn còn sốt") không tính
+FOLLOW_UP_PRONOUNS = ["nó", "chúng nó"]
+FOLLOW_UP_LEADING = ["còn"]
+
+GREETING_RESPONSE = (
+    "Xin chào! Tôi là trợ lý sức khỏe. Bạn có thể hỏi tôi về triệu chứng, cách điều trị, "
+    "phòng ngừa bệnh hay tiêm chủng, tôi sẽ trả lời dựa trên tài liệu y khoa kèm nguồn tham khảo."
+)
+THANKS_RESPONSE = "Rất vui vì đã giúp được bạn! Nếu còn thắc mắc gì về sức khỏe, bạn cứ hỏi nhé."
+GOODBYE_RESPONSE = "Tạm biệt bạn! Chúc bạn luôn khỏe mạnh."
+OUT_OF_SCOPE_RESPONSE = (
+    "Xin lỗi, tôi chỉ có thể hỗ trợ các câu hỏi liên quan đến sức khỏe và y tế. "
+    "Bạn có thể hỏi tôi về triệu chứng, cách điều trị hoặc phòng ngừa bệnh."
+)
+
+def _normalize(text, plain):
+    sylls = syllables(text)
+    if plain:
+        sylls = [strip_diacritics(s) for s in sylls]
+    return " ".join(sylls)
+
+class _PhraseMatcher:
+    """Whole-syllable phrase search, accented or accent-stripped depending on the message"""
+
+    def __init__(self, phrases):
+        self.accented = self._compile({_normalize(p, False) for p in phrases})
+        self.plain = self._compile({_normalize(p, True) for p in phrases})
+
+    @staticmethod
+    def _compile(phrases):
+        phrases = sorted(phrases, key=len, reverse=True)
+        return re.compile(r"(?:^| )(?:" + "|".join(re.escape(p) for p in phrases) + r")(?= |$)")
+
+    def search(self, message):
+        plain = not has_diacritics(message)
+        pattern = self.plain if plain else self.accented
+        return pattern.search(_normalize(message, plain)) is not None
+
+_MEDICAL = _PhraseMatcher(MEDICAL_KEYWORDS)
+_GREETING = _PhraseMatcher(GREETING_PHRASES)
+_THANKS = _PhraseMatcher(THANKS_PHRASES)
+_GOODBYE = _PhraseMatcher(GOODBYE_PHRASES)
+_FOLLOW_UP = _PhraseMatcher(FOLLOW_UP_PHRASES)
+_FOLLOW_UP_PRONOUN = re.compile(r"(?:^| )(?:" + "|".join(FOLLOW_UP_PRONOUNS) + r")(?= |$)")
+_FOLLOW_UP_LEADING = re.compile(r"^(?:" + "|".join(FOLLOW_UP_LEADING) + r")(?= |$)")
+
+def classify_intent(message: str, lexical_index=None, lexical_threshold=0.5):
+    """
+    Rule-based intent: GREETING, MEDICAL or OUT_OF_SCOPE, without any LLM call.
+
+    Medical keywords win over greetings ("chào bạn, tôi bị sốt"). Messages with
+    neither are checked against the corpus vocabulary through `lexical_index`
+    (share of query terms in the best BM25 hit); without an index they are
+    treated as medical so retrieval decides.
+    """
+    n_syllables = len(syllables(message))
+    if not n_syllables:
+        return GREETING
+    if _MEDICAL.search(message):
+        return MEDICAL
+    if _GREETING.search(message) and n_syllables <= GREETING_MAX_SYLLABLES:
+        return GREETING
+    if lexical_index is None:
+        return MEDICAL
+    hits = lexical_index.search(message, k=1)
+    if lexical_index.confidence(message, hits) >= lexical_threshold:
+        return MEDICAL
+    return OUT_OF_SCOPE
+
+def is_follow_up(message: str) -> bool:
+    """Short message referring back to the conversation ("còn trẻ em thì sao?", "nó có lây không?")"""
+    if len(syllables(message)) > FOLLOW_UP_MAX_SYLLABLES:
+        return False
+    if _FOLLOW_UP.search(message):
+        return True
+    if not has_diacritics(message):
+        return False
+    text = _normalize(message, False)
+    return bool(_FOLLOW_UP_PRONOUN.search(text) or _FOLLOW_UP_LEADING.search(text))
+
+def direct_response(message: str, intent: str):
+    """Canned answer for intents that need no retrieval or generation"""
+    if intent == OUT_OF_SCOPE:
+        return OUT_OF_SCOPE_RESPONSE
+    if _THANKS.search(message):
+        return THANKS_RESPONSE
+    if _GOODBYE.search(message):
+        return GOODBYE_RESPONSE
+    return GREETING_RESPONSE
@@ -0,0 +1,181 @@
+import re
+import json
+import math
+import unicodedata
+from collections import Counter, defaultdict
+from langchain_core.documents import Document
+
+# Hư từ phổ biến, bỏ qua ở mức âm tiết đơn (vẫn giữ trong bigram)
+STOPWORDS = {
+    "là", "của", "và", "có", "các", "những", "cho", "được", "trong", "khi", "thì", "bị",
+    "với", "để", "nào", "gì", "như", "thế", "không", "này", "đó", "một", "ở", "ra",
+    "về", "cũng", "nên", "hay", "hoặc", "bạn", "tôi", "làm", "sao", "ạ", "à", "nhé",
+}
+_PLAIN_STOPWORDS = None
+
+def strip_diacritics(text: str) -> str:
+    """Remove Vietnamese tone marks and diacritics ("điều trị" -> "dieu tri")"""
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return text.replace("đ", "d").replace("Đ", "D")
+
+def has_diacritics(text: str) -> bool:
+    return strip_diacritics(text) != text
+
+def syllables(text: str):
+    """Lowercased syllables; Vietnamese words are space-separated syllables"""
+    return re.findall(r"\w+", unicodedata.normalize("NFC", text).lower())
+
+def tokenize(text: str, plain: bool = False):
+    """
+    Unigram (non-stopword) + bigram syllable terms, so multi-syllable words
+    ("cảm lạnh", "sốt xuất huyết") match as units. With plain=True the
+    terms are accent-stripped, for queries typed without diacritics.
+    """
+    global _PLAIN_STOPWORDS
+    sylls = syllables(text)
+    stopwords = STOPWORDS
+    if plain:
+        sylls = [strip_diacritics(s) for s in sylls]
+        if _PLAIN_STOPWORDS is None:
+            _PLAIN_STOPWORDS = {strip_diacritics(w) for w in STOPWORDS}
+        stopwords = _PLAIN_STOPWORDS
+    terms = [s for s in sylls if s not in stopwords]
+    terms.extend(f"{a}_{b}" for a, b in zip(sylls, sylls[1:]))
+    return terms
+
+class BM25Field:
+    """Okapi BM25 inverted index over one tokenization of the corpus"""
+
+    def __init__(self, postings, doc_lengths, k1=1.5, b=0.75):
+        self.postings = postings  # term -> [[doc index, term frequency], ...]
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(doc_lengths)
+        self.avg_length = sum(doc_lengths) / self.n_docs if self.n_docs else 0.0
+
+    @classmethod
+    def build(cls, token_lists, k1=1.5, b=0.75):
+        postings = defaultdict(list)
+        for i, tokens in enumerate(token_lists):
+            for term, tf in Counter(tokens).items():
+                postings[term].append([i, tf])
+        return cls(dict(postings), [len(tokens) for tokens in token_lists], k1, b)
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    def score(self, query_terms):
+        scores = defaultdict(float)
+        for term in set(query_terms):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for i, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / self.avg_length)
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+class LexicalIndex:
+    """
+    In-memory BM25 index over detail chunks and summaries.
+
+    Two fields are kept: accented terms and accent-stripped terms. Queries
+    typed with diacritics use the accented field, others the plain one.
+    """
+
+    def __init__(self, items, accented, plain):
+        self.items = items  # {"id", "text", "metadata"}
+        self.accented = accented
+        self.plain = plain
+
+    @classmethod
+    def build(cls, items):
+        accented = BM25Field.build([tokenize(item["text"]) for item in items])
+        plain = BM25Field.build([tokenize(item["text"], plain=True) for item in items])
+        return cls(items, accented, plain)
+
+    @classmethod
+    def from_chunks_and_summaries(cls, chunk_items, summary_items):
+        """
+        Build over detail chunks and article summaries ({"id", "text", "metadata"}).
+        Summaries are tagged type="summary" and get the article title (section_h1)
+        of their chunks so they can be cited like a chunk.
+        """
+        items = list(chunk_items)
+        titles = {item["metadata"]["doc_id"]: item["metadata"].get("section_h1") for item in items}
+        for item in summary_items:
+            metadata = dict(item["metadata"], type="summary")
+            if titles.get(metadata["doc_id"]):
+                metadata["section_h1"] = titles[metadata["doc_id"]]
+            items.append({"id": item.get("id"), "text": item["text"], "metadata": metadata})
+        return cls.build(items)
+
+    def save(self, path):
+        data = {
+            "items": self.items,
+            "accented": {"postings": self.accented.postings, "doc_lengths": self.accented.doc_lengths},
+            "plain": {"postings": self.plain.postings, "doc_lengths": self.plain.doc_lengths},
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            data["items"],
+            BM25Field(data["accented"]["postings"], data["accented"]["doc_lengths"]),
+            BM25Field(data["plain"]["postings"], data["plain"]["doc_lengths"])
+        )
+
+    def _field(self, query):
+        plain = not has_diacritics(query)
+        return (self.plain if plain else self.accented), tokenize(query, plain=plain)
+
+    def search(self, query, k=10):
+        """Return [(item index, BM25 score)] best first"""
+        field, terms = self._field(query)
+        scores = field.score(terms)
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+
+    def to_document(self, i):
+        item = self.items[i]
+        return Document(id=item.get("id"), page_content=item["text"], metadata=item["metadata"])
+
+    def search_documents(self, query, k=10):
+        """Ranked Documents for `query`, in the same shape as the dense retriever"""
+        return [self.to_document(i) for i, _ in self.search(query, k)]
+
+    def confidence(self, query, results):
+        """
+        Share of the query's terms (syllables and syllable bigrams) found in
+        the best hit; 1.0 means the top chunk contains the whole query.
+        """
+        if not results:
+            return 0.0
+        plain = not has_diacritics(query)
+        query_terms = set(tokenize(query, plain=plain))
+        if not query_terms:
+            return 0.0
+        top_terms = set(tokenize(self.items[results[0][0]]["text"], plain=plain))
+        return len(query_terms & top_terms) / len(query_terms)
+
+    def margin(self, results):
+        """
+        Relative BM25 score gap between the best hit and the best hit from
+        another article (1 - runner-up / top); 1.0 when no other article matches.
+        A generic query ("sốt", "thuốc") scores many articles alike and gets ~0.
+        """
+        if not results:
+            return 0.0
+        top, top_score = results[0]
+        doc_id = self.items[top]["metadata"].get("doc_id")
+        for i, score in results[1:]:
+            if self.items[i]["metadata"].get("doc_id") != doc_id:
+                return 1.0 - score / top_score if top_score > 0 else 0.0
+        return 1.0
@@ -0,0 +1,521 @@
+import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Optional
+from pydantic import PrivateAttr
+from langchain_core.runnables import Runnable
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# Deadline mỗi lần gọi (stream: thời gian tới token đầu tiên) và giữa hai token liên tiếp
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+LLM_STREAM_IDLE_TIMEOUT = float(os.getenv("LLM_STREAM_IDLE_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Hedging: gửi request thứ hai khi request đầu chậm hơn p95 quan sát được
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+# Độ trễ hedge khi chưa đủ mẫu để ước lượng p95
+LLM_HEDGE_INITIAL_DELAY = float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "2"))
+# Circuit breaker: mở sau N lỗi liên tiếp, thử lại sau RESET giây
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+class LLMTimeout(TimeoutError):
+    """An LLM call missed its deadline"""
+
+class CircuitOpenError(RuntimeError):
+    """The circuit breaker is open: the LLM is not called at all"""
+
+# Lỗi từ dịch vụ LLM hoặc mạng (quá hạn, 429, 5xx); các lỗi khác là lỗi của code, không tính cho breaker
+_UPSTREAM_ERROR = re.compile(
+    r"\b(429|5\d\d)\b|resource.?exhausted|rate.?limit|quota|unavailable|overloaded|deadline|timeout|timed out|connect",
+    re.IGNORECASE
+)
+
+def is_upstream_error(error):
+    """Whether `error` comes from the LLM service or the network (timeout, 429, 5xx) rather than from our code"""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int) and status >= 400:
+        return status == 429 or status >= 500
+    return bool(_UPSTREAM_ERROR.search(f"{type(error).__name__} {error}"))
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker (closed -> open -> half-open).
+
+    After `failure_threshold` failures in a row calls are refused for
+    `reset_timeout` seconds, then a single trial call is let through; its
+    outcome closes or re-opens the circuit. Thread-safe.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def is_open(self):
+        """True while calls would be refused (does not consume the half-open trial)"""
+        with self._lock:
+            state = self._state()
+            return state == "open" or (state == "half_open" and self._trial_running)
+
+    def allow(self):
+        """Whether a call may start now; in half-open state only one trial runs at a time"""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_ignored(self):
+        """A call ended with an error that says nothing about the LLM: free the half-open trial"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_running:
+                    self.opened += 1
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._state(),
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+class LatencyTracker:
+    """Sliding window of recent latencies for quantile estimates"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def quantile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+# Shared by every client of the same upstream (Gemini)
+llm_breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET)
+
+# Luồng cho các lời gọi đồng bộ có hedging
+_call_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_CALL_WORKERS", "16")))
+
+class ResilientLLM(Runnable):
+    """
+    Chat model wrapper adding deadlines, hedged requests, retries with jitter
+    and a circuit breaker. Composes in LCEL chains like the wrapped model.
+
+    - every attempt has a deadline (`timeout`; for streams: time to first token,
+      then `stream_idle_timeout` between tokens)
+    - if an attempt is slower than the recent p95 latency, a duplicate request
+      is sent and the first answer wins
+    - failed attempts are retried with exponential backoff and full jitter;
+      a stream is only retried before its first token
+    - while `breaker` is open calls fail immediately with CircuitOpenError
+    - only upstream errors (timeouts, 429, 5xx) are retried and count as
+      breaker failures; other errors are raised at once
+    """
+
+    def __init__(self, model, timeout=LLM_TIMEOUT, stream_idle_timeout=LLM_STREAM_IDLE_TIMEOUT,
+                 max_retries=LLM_MAX_RETRIES, hedge=LLM_HEDGE_ENABLED, hedge_quantile=LLM_HEDGE_QUANTILE,
+                 hedge_min_delay=LLM_HEDGE_MIN_DELAY, hedge_initial_delay=LLM_HEDGE_INITIAL_DELAY,
+                 breaker=None, base_delay=0.5, max_delay=8.0):
+        self.model = model
+        self.timeout = timeout
+        self.stream_idle_timeout = stream_idle_timeout
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_initial_delay = hedge_initial_delay
+        self.breaker = breaker
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency = LatencyTracker()
+        self.counters = {"calls": 0, "retries": 0, "timeouts": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+
+    # --- policy helpers ---
+
+    def _hedge_delay(self):
+        if not self.hedge:
+            return None
+        if len(self.latency) < 20:
+            return self.hedge_initial_delay
+        return max(self.hedge_min_delay, self.latency.quantile(self.hedge_quantile))
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _check_breaker(self):
+        if self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+
+    def _record(self, ok, error=None):
+        """Report the outcome of an attempt; returns whether a failed one may be retried"""
+        if not ok:
+            self.counters["failures"] += 1
+        upstream = ok or is_upstream_error(error)
+        if self.breaker is not None:
+            if ok:
+                self.breaker.record_success()
+            elif upstream:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_ignored()
+        return upstream
+
+    def _attempts(self):
+        self.counters["calls"] += 1
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.counters["retries"] += 1
+            self._check_breaker()
+            yield attempt, attempt == self.max_retries
+
+    # --- sync ---
+
+    def _invoke_once(self, input, config, kwargs):
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        futures = [_call_pool.submit(self.model.invoke, input, config, **kwargs)]
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None and hedge_delay < self.timeout:
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                self.counters["hedges"] += 1
+                futures.append(_call_pool.submit(self.model.invoke, input, config, **kwargs))
+
+        pending = set(futures)
+        error = None
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        self.counters["hedge_wins"] += 1
+                    self.latency.observe(time.perf_counter() - start)
+                    # Request còn lại (nếu có) chạy nốt trong nền, kết quả bị bỏ qua
+                    return future.result()
+                error = future.exception()
+        if pending:
+            self.counters["timeouts"] += 1
+            raise LLMTimeout(f"LLM call exceeded {self.timeout}s")
+        raise error
+
+    def invoke(self, input, config=None, **kwargs):
+        for attempt, last in self._attempts():
+            try:
+                result = self._invoke_once(input, config, kwargs)
+            except Exception as e:
+                if not self._record(False, e) or last:
+                    raise
+                print(f"LLM call failed ({e}), retry {attempt + 1}/{self.max_retries}")
+                time.sleep(self._backoff(attempt))
+                continue
+            self._record(True)
+            return result
+
+    # --- async ---
+
+    async def _ainvoke_once(self, input, config, kwargs):
+        start = time.perf_counter()
+        tasks = [asyncio.ensure_future(self.model.ainvoke(input, config, **kwargs))]
+        try:
+            hedge_delay = self._hedge_delay()
+            if hedge_delay is not None and hedge_delay < self.timeout:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    self.counters["hedges"] += 1
+                    tasks.append(asyncio.ensure_future(self.model.ainvoke(input, config, **kwargs)))
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                remaining = start + self.timeout - time.perf_counter()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.counters["hedge_wins"] += 1
+                        self.latency.observe(time.perf_counter() - start)
+                        return task.result()
+                    error = task.exception()
+            if pending:
+                self.counters["timeouts"] += 1
+                raise LLMTimeout(f"LLM call exceeded {self.timeout}s")
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        for attempt, last in self._attempts():
+            try:
+                result = await self._ainvoke_once(input, config, kwargs)
+            except Exception as e:
+                if not self._record(False, e) or last:
+                    raise
+                print(f"LLM call failed ({e}), retry {attempt + 1}/{self.max_retries}")
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            self._record(True)
+            return result
+
+    async def _first_chunk(self, input, config, kwargs):
+        """Open the stream (hedged) and return (iterator, first chunk) of the fastest one"""
+        start = time.perf_counter()
+        streams = [self.model.astream(input, config, **kwargs).__aiter__()]
+        tasks = {asyncio.ensure_future(streams[0].__anext__()): streams[0]}
+        winner = None
+        try:
+            hedge_delay = self._hedge_delay()
+            if hedge_delay is not None and hedge_delay < self.timeout:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    self.counters["hedges"] += 1
+                    streams.append(self.model.astream(input, config, **kwargs).__aiter__())
+                    tasks[asyncio.ensure_future(streams[1].__anext__())] = streams[1]
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                remaining = start + self.timeout - time.perf_counter()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = tasks[task]
+                        if winner is not streams[0]:
+                            self.counters["hedge_wins"] += 1
+                        self.latency.observe(time.perf_counter() - start)
+                        return winner, task.result()
+                    error = task.exception()
+            if pending:
+                self.counters["timeouts"] += 1
+                raise LLMTimeout(f"No LLM token within {self.timeout}s")
+            raise error
+        finally:
+            for task, stream in tasks.items():
+                if stream is not winner:
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    try:
+                        await stream.aclose()
+                    except Exception:
+                        pass
+
+    async def astream(self, input, config=None, **kwargs):
+        for attempt, last in self._attempts():
+            try:
+                stream, chunk = await self._first_chunk(input, config, kwargs)
+            except StopAsyncIteration:
+                self._record(True)
+                return
+            except Exception as e:
+                if not self._record(False, e) or last:
+                    raise
+                print(f"LLM stream failed ({e}), retry {attempt + 1}/{self.max_retries}")
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            break
+
+        # Đã gửi token cho client: không retry nữa, chỉ giới hạn thời gian chờ giữa các token
+        try:
+            yield chunk
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), self.stream_idle_timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    self.counters["timeouts"] += 1
+                    raise LLMTimeout(f"LLM stream stalled for {self.stream_idle_timeout}s")
+                yield chunk
+        except Exception as e:
+            self._record(False, e)
+            raise
+        finally:
+            await stream.aclose()
+        self._record(True)
+
+    def stats(self):
+        p50 = self.latency.quantile(0.5)
+        p95 = self.latency.quantile(0.95)
+        return dict(
+            self.counters,
+            p50=round(p50, 3) if p50 is not None else None,
+            p95=round(p95, 3) if p95 is not None else None,
+            hedge_delay=self._hedge_delay(),
+        )
+
+def _fake_response(prompt):
+    """Canned output shaped like the real prompts' answers (query expansion or grounded answer)"""
+    # Số câu viết lại được yêu cầu trong prompt query expansion
+    count = re.search(r"thành (\d+) phiên bản", prompt)
+    count = int(count.group(1)) if count else 3
+    if "Các câu hỏi gốc:" in prompt:
+        numbered = re.findall(r"^\[(\d+)\] (.+)$", prompt.rsplit("Các câu hỏi gốc:", 1)[1], re.MULTILINE)
+        return "\n".join(f"[{i}] {question} (cách diễn đạt {j})" for i, question in numbered for j in range(1, count + 1))
+    if "Câu hỏi gốc:" in prompt:
+        question = prompt.rsplit("Câu hỏi gốc:", 1)[1].strip()
+        return "\n".join([question] + [f"{question} (cách diễn đạt {i})" for i in range(1, count + 1)])
+    sources = [line for line in prompt.splitlines() if line.startswith("Nguồn:")]
+    answer = "Đây là câu trả lời giả lập dựa trên các tài liệu tham khảo được cung cấp."
+    return f"{answer}\n{sources[0]}" if sources else answer
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline stand-in for Gemini with a configurable latency distribution.
+
+    Each call takes `latency` seconds, plus `tail_latency` with probability
+    `tail_rate` (a slow tail to exercise timeouts and hedging), and fails with
+    probability `failure_rate`. Streams emit one word every `token_delay` seconds.
+    With a `seed` the sequence of latencies and failures is reproducible.
+    With tools bound (agent mode) it first calls the first tool with the user's
+    question, then answers from the tool result.
+    """
+
+    latency: float = 0.2
+    tail_rate: float = 0.0
+    tail_latency: float = 5.0
+    failure_rate: float = 0.0
+    token_delay: float = 0.01
+    seed: Optional[int] = None
+    _rng: Any = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _sample_latency(self):
+        if self._rng.random() < self.failure_rate:
+            raise RuntimeError("Fake LLM error (503 Service unavailable)")
+        return self.latency + (self.tail_latency if self._rng.random() < self.tail_rate else 0.0)
+
+    def bind_tools(self, tools, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    @staticmethod
+    def _prompt(messages):
+        return "\n".join(str(message.content) for message in messages)
+
+    @staticmethod
+    def _tool_call(messages, tools):
+        """Call of the first bound tool while the question has no tool result yet, else None"""
+        if not tools or not messages or messages[-1].type != "human":
+            return None
+        function = tools[0]["function"]
+        arg = next(iter(function.get("parameters", {}).get("properties", {})), "input")
+        return {"name": function["name"], "args": {arg: str(messages[-1].content)}, "id": f"call_{uuid.uuid4().hex[:12]}"}
+
+    def _message(self, messages, tools):
+        call = self._tool_call(messages, tools)
+        if call:
+            return AIMessage(content="", tool_calls=[call])
+        return AIMessage(content=_fake_response(self._prompt(messages)))
+
+    def _chunks(self, messages, tools):
+        call = self._tool_call(messages, tools)
+        if call:
+            args = json.dumps(call["args"], ensure_ascii=False)
+            return [AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": args, "id": call["id"], "index": 0}
+            ])]
+        return [AIMessageChunk(content=word + " ") for word in _fake_response(self._prompt(messages)).split(" ")]
+
+    def _generate(self, messages, stop=None, run_manager=None, tools=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._sample_latency())
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, tools))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._sample_latency())
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, tools))])
+
+    def _stream(self, messages, stop=None, run_manager=None, tools=None, **kwargs: Any):
+        time.sleep(self._sample_latency())
+        for chunk in self._chunks(messages, tools):
+            yield ChatGenerationChunk(message=chunk)
+            time.sleep(self.token_delay)
+
+    async def _astream(self, messages, stop=None, run_manager=None, tools=None, **kwargs: Any):
+        await asyncio.sleep(self._sample_latency())
+        for chunk in self._chunks(messages, tools):
+            yield ChatGenerationChunk(message=chunk)
+            await asyncio.sleep(self.token_delay)
+
+def fake_chat_model_from_env():
+    """FakeChatModel configured by FAKE_LLM_* variables"""
+    return FakeChatModel(
+        latency=float(os.getenv("FAKE_LLM_LATENCY", "0.2")),
+        tail_rate=float(os.getenv("FAKE_LLM_TAIL_RATE", "0.0")),
+        tail_latency=float(os.getenv("FAKE_LLM_TAIL_LATENCY", "5")),
+        failure_rate=float(os.getenv("FAKE_LLM_FAILURE_RATE", "0.0")),
+        token_delay=float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0.01")),
+        seed=int(os.environ["FAKE_LLM_SEED"]) if os.getenv("FAKE_LLM_SEED") else None,
+    )
@@ -1,46 +1,65 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 import uvicorn
 import os
+import re
 import json
+import uuid
 import time
+import asyncio
 from typing import Optional
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Google Gemini AI imports
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, SystemMessage
+# Import health chatbot agent (models are loaded lazily by the component registry)
+from components import registry, GOOGLE_API_KEY, LLM_ENABLED
+from model import astream_chat, response_cache, warm_up, CHAT_MODE, CHAT_MODES, llm_governor, single_flight, ChatFailed
+from concurrency import Overloaded
+from llm_client import llm_breaker
+from rag import retrieval_cache
+from conversation import session_stats
+from batch_qa import answer_batch, BATCH_MAX_QUESTIONS
+import metrics
 
-# Import health chatbot agent
-from model import health_chatbot, stream_chat_with_agent
+if not LLM_ENABLED:
+    print("Warning: GOOGLE_API_KEY not found. Gemini AI features will be disabled.")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm-up chạy nền: worker nhận kết nối ngay, /health/ready báo sẵn sàng khi xong
+    warmup_task = None
+    if LLM_ENABLED:
+        warmup_task = asyncio.create_task(asyncio.to_thread(warm_up))
+    else:
+        # Chế độ cơ bản (fallback) không cần nạp mô hình
+        registry.ready = True
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
 
-app = FastAPI(title="Health Chatbot API", version="1.0.0")
+app = FastAPI(title="Health Chatbot API", version="1.0.0", lifespan=lifespan)
 
 # Mount static files and templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-# Google Gemini AI configuration
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if GOOGLE_API_KEY:
-    os.environ["GOOGLE_API_KEY"] = GOOGLE_API_KEY
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash-exp",
-        temperature=0.7,
-        max_tokens=1000
-    )
-else:
-    llm = None
-    print("Warning: GOOGLE_API_KEY not found. Gemini AI features will be disabled.")
-
 class HealthQuery(BaseModel):
     question: str
+    # "pipeline" | "agent", mặc định theo CHAT_MODE
+    mode: Optional[str] = None
+    # Thêm bảng thời gian từng bước vào frame 'end' (mặc định theo STREAM_TIMINGS)
+    timings: Optional[bool] = None
+    # ID cuộc hội thoại do client giữ; không có (hoặc không hợp lệ) thì server tạo mới và gửi lại trong metadata
+    session_id: Optional[str] = None
+
+class BatchQuery(BaseModel):
+    questions: list[str]
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -48,43 +67,226 @@ async def read_root(request: Request):
 
 @app.get("/health")
 async def health_check():
-    # Kiểm tra trạng thái Gemini AI và RAG system
-    gemini_status = "available" if llm and GOOGLE_API_KEY else "not_configured"
+    # Liveness: process đang chạy; readiness: các component đã được nạp và warm-up xong
+    gemini_status = "available" if GOOGLE_API_KEY else "not_configured"
     
-    try:
-        # Test health chatbot agent
-        agent_status = "available" if health_chatbot else "not_available"
-    except:
+    if registry.warmup_error:
         agent_status = "error"
+    elif registry.is_loaded("health_chatbot"):
+        agent_status = "available"
+    else:
+        agent_status = "loading" if LLM_ENABLED else "not_available"
     
     return {
         "status": "healthy", 
         "message": "Service is up and running",
         "gemini_ai_status": gemini_status,
-        "rag_agent_status": agent_status
+        "rag_agent_status": agent_status,
+        "readiness": registry.status(),
+        "cache": {
+            "response": response_cache.stats(),
+            "retrieval": retrieval_cache.stats()
+        },
+        "concurrency": {
+            "llm": llm_governor.stats(),
+            "coalescing": single_flight.stats()
+        },
+        "llm": {
+            "breaker": llm_breaker.stats(),
+            "generation": registry.get("llm").stats() if registry.is_loaded("llm") else None,
+            "expansion": registry.get("expansion_llm").stats() if registry.is_loaded("expansion_llm") else None
+        },
+        "sessions": session_stats()
     }
 
+@app.get("/health/live")
+async def liveness_check():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    status = registry.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+def collect_service_metrics():
+    """Scrape-time gauges and counters from the caches, the LLM governor and the circuit breaker"""
+    caches = {"response": response_cache.stats(), "retrieval": retrieval_cache.stats()}
+    governor = llm_governor.stats()
+    coalescing = single_flight.stats()
+    breaker_states = {"closed": 0, "half_open": 1, "open": 2}
+    return [
+        ("chatbot_cache_lookups_total", "counter", "Semantic cache lookups by result", [
+            ({"cache": name, "result": result}, stats[result])
+            for name, stats in caches.items()
+            for result in ("hits_exact", "hits_semantic", "misses")
+        ]),
+        ("chatbot_cache_size", "gauge", "Entries in each semantic cache", [
+            ({"cache": name}, stats["size"]) for name, stats in caches.items()
+        ]),
+        ("chatbot_llm_in_flight", "gauge", "LLM generations holding a slot", [({}, governor["in_flight"])]),
+        ("chatbot_llm_queue_depth", "gauge", "Requests waiting for an LLM slot", [({}, governor["queue_depth"])]),
+        ("chatbot_llm_rejected_total", "counter", "Requests rejected by admission control", [
+            ({"reason": reason}, count) for reason, count in governor["rejected"].items()
+        ]),
+        ("chatbot_coalesced_requests_total", "counter", "Requests served by another request's generation", [
+            ({}, coalescing["coalesced"])
+        ]),
+        ("chatbot_llm_breaker_state", "gauge", "LLM circuit breaker state (0 closed, 1 half-open, 2 open)", [
+            ({}, breaker_states[llm_breaker.state])
+        ]),
+    ]
+
+metrics.register_collector(collect_service_metrics)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.expose(), media_type="text/plain; version=0.0.4")
+
+def sse_event(payload: dict) -> str:
+    """Format a payload as a text/event-stream frame"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+# Gom các token đến trong cùng một cửa sổ thời gian thành một frame (0 = gửi từng token)
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", "30"))
+# Mặc định có gửi bảng thời gian từng bước trong frame 'end' hay không
+STREAM_TIMINGS = os.getenv("STREAM_TIMINGS", "false").lower() == "true"
+
+_STREAM_END = object()
+
+async def coalesce_tokens(tokens, window: float):
+    """
+    Merge tokens of an async stream that arrive within `window` seconds of
+    the first buffered token, so a burst of tokens becomes a single frame.
+    """
+    if window <= 0:
+        async for token in tokens:
+            yield token
+        return
+
+    queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for token in tokens:
+                await queue.put(token)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            await queue.put(_STREAM_END)
+
+    pump_task = asyncio.create_task(pump())
+    loop = asyncio.get_running_loop()
+    try:
+        finished = False
+        while not finished:
+            item = await queue.get()
+            if item is _STREAM_END:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            buffer = [item]
+            deadline = loop.time() + window
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STREAM_END:
+                    finished = True
+                    break
+                if isinstance(item, Exception):
+                    yield "".join(buffer)
+                    raise item
+                buffer.append(item)
+            yield "".join(buffer)
+    finally:
+        pump_task.cancel()
+
+async def stream_fallback(text: str, status: str):
+    """Stream a canned answer word by word (non-AI mode)"""
+    yield sse_event({'type': 'metadata', 'ai_powered': False, 'rag_enabled': False})
+    for i, word in enumerate(text.split()):
+        yield sse_event({'type': 'word', 'content': word, 'index': i})
+    yield sse_event({'type': 'end', 'status': status})
+
+OVERLOADED_TEXT = "Hệ thống đang quá tải, vui lòng thử lại sau ít giây."
+
+def client_id_of(request: Request) -> str:
+    """Caller identity for the per-client LLM cap: X-Client-ID header, else the client address"""
+    header = request.headers.get("x-client-id")
+    if header:
+        return header
+    return request.client.host if request.client else "unknown"
+
+SESSION_ID_PATTERN = re.compile(r"^[\w\-]{8,128}$")
+
+def session_id_of(query: HealthQuery) -> str:
+    """Client-supplied session ID if well formed, else a new one"""
+    if query.session_id and SESSION_ID_PATTERN.match(query.session_id):
+        return query.session_id
+    return uuid.uuid4().hex
+
 @app.post("/chat/stream")
-async def chat_stream(query: HealthQuery):
-    def generate_response():
+async def chat_stream(query: HealthQuery, request: Request):
+    client_id = client_id_of(request)
+    session_id = session_id_of(query)
+    include_timings = STREAM_TIMINGS if query.timings is None else query.timings
+
+    async def generate_response():
         try:
             # Sử dụng RAG agent trước
-            if health_chatbot and GOOGLE_API_KEY:
+            if LLM_ENABLED:
                 try:
+                    start = time.perf_counter()
+                    timings = metrics.start_request_timings() if include_timings else None
+                    mode = query.mode if query.mode in CHAT_MODES else CHAT_MODE
                     # Gửi metadata trước
-                    yield f"data: {json.dumps({'type': 'metadata', 'ai_powered': True, 'rag_enabled': True})}\n\n"
+                    yield sse_event({
+                        'type': 'metadata', 'ai_powered': True, 'rag_enabled': True,
+                        'mode': mode, 'session_id': session_id
+                    })
                     
-                    # Stream từ RAG agent
-                    config = {"configurable": {"thread_id": f"health_chat_{int(time.time())}"}}
+                    # Stream token từ pipeline RAG hoặc RAG agent
+                    config = {"configurable": {"thread_id": f"health_chat_{session_id}"}}
+                    tokens = astream_chat(query.question, config, mode, client_id, session_id)
                     
-                    for chunk in stream_chat_with_agent(query.question, config):
-                        if chunk and chunk.strip():
-                            # Gửi từng chunk từ agent
-                            yield f"data: {json.dumps({'type': 'chunk', 'content': chunk})}\n\n"
-                            time.sleep(0.05)  # Delay nhỏ để mượt hơn
+                    first_chunk = True
+                    try:
+                        async for chunk in coalesce_tokens(tokens, STREAM_COALESCE_MS / 1000):
+                            if chunk:
+                                if first_chunk:
+                                    metrics.observe_stage("request_ttft", time.perf_counter() - start)
+                                    first_chunk = False
+                                yield sse_event({'type': 'chunk', 'content': chunk})
+                    except Overloaded as overloaded:
+                        # Từ chối nhanh thay vì để Gemini trả 429 / người dùng chờ quá SLA
+                        print(f"LLM request rejected ({overloaded.reason}) for client {client_id}")
+                        metrics.count_request(mode, "overloaded")
+                        yield sse_event({'type': 'chunk', 'content': OVERLOADED_TEXT})
+                        yield sse_event({
+                            'type': 'end',
+                            'status': 'overloaded',
+                            'reason': overloaded.reason,
+                            'retry_after': overloaded.retry_after
+                        })
+                        return
+                    except ChatFailed as failed:
+                        # Thông báo lỗi đã được gửi như nội dung: frame 'end' cho client biết đây không phải câu trả lời
+                        metrics.count_request(mode, "error")
+                        yield sse_event({'type': 'end', 'status': 'error', 'error': str(failed)})
+                        return
                     
+                    metrics.observe_stage("request_total", time.perf_counter() - start)
+                    metrics.count_request(mode, "success")
                     # Gửi signal kết thúc
-                    yield f"data: {json.dumps({'type': 'end', 'status': 'success'})}\n\n"
+                    end_frame = {'type': 'end', 'status': 'success'}
+                    if timings is not None:
+                        end_frame['timings'] = timings
+                    yield sse_event(end_frame)
                     return
                     
                 except Exception as agent_error:
@@ -94,43 +296,46 @@ async def chat_stream(query: HealthQuery):
             
             # Fallback response nếu không có AI hoặc có lỗi
             fallback_text = f"Cảm ơn bạn đã hỏi về '{query.question}'. Tôi là chatbot sức khỏe và khuyến khích bạn tham khảo ý kiến bác sĩ để được tư vấn chính xác nhất về vấn đề sức khỏe."
-            
-            # Gửi metadata
-            yield f"data: {json.dumps({'type': 'metadata', 'ai_powered': False, 'rag_enabled': False})}\n\n"
-            
-            # Stream từng từ
-            words = fallback_text.split()
-            for i, word in enumerate(words):
-                yield f"data: {json.dumps({'type': 'word', 'content': word, 'index': i})}\n\n"
-                time.sleep(0.08)
-            
-            yield f"data: {json.dumps({'type': 'end', 'status': 'success'})}\n\n"
+            async for frame in stream_fallback(fallback_text, 'success'):
+                yield frame
             
         except Exception as e:
             print(f"Stream chat error: {e}")
             error_text = f"Xin chào! Cảm ơn bạn đã hỏi về '{query.question}'. Hiện tại tôi đang gặp một chút khó khăn kỹ thuật nhưng vẫn có thể trò chuyện với bạn. Để được tư vấn chính xác về sức khỏe, bạn nên tham khảo ý kiến bác sĩ chuyên khoa nhé!"
-            
-            yield f"data: {json.dumps({'type': 'metadata', 'ai_powered': False, 'rag_enabled': False})}\n\n"
-            
-            words = error_text.split()
-            for i, word in enumerate(words):
-                yield f"data: {json.dumps({'type': 'word', 'content': word, 'index': i})}\n\n"
-                time.sleep(0.08)
-            
-            yield f"data: {json.dumps({'type': 'end', 'status': 'limited'})}\n\n"
+            async for frame in stream_fallback(error_text, 'limited'):
+                yield frame
     
     return StreamingResponse(
         generate_response(),
-        media_type="text/plain",
+        media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-            "Content-Type": "text/event-stream",
+            "X-Accel-Buffering": "no",
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Headers": "*",
         }
     )
 
+@app.post("/chat/batch")
+async def chat_batch(query: BatchQuery):
+    """Answer many questions, streamed back as NDJSON in completion order (see batch_qa.py)"""
+    if not LLM_ENABLED:
+        return JSONResponse({"error": "LLM is not configured"}, status_code=503)
+    if len(query.questions) > BATCH_MAX_QUESTIONS:
+        return JSONResponse(
+            {"error": f"At most {BATCH_MAX_QUESTIONS} questions per batch"}, status_code=413
+        )
+
+    async def generate_results():
+        async for result in answer_batch(query.questions):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        generate_results(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
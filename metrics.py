@@ -0,0 +1,163 @@
+import os
+import time
+import threading
+import contextvars
+from collections import defaultdict
+
+# METRICS_ENABLED=false: các stage() trở thành no-op (trừ khi request yêu cầu breakdown)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] += amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels_text(key)} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with labels (Prometheus semantics)"""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_labels_text(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels_text(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{_labels_text(key)} {total}")
+                lines.append(f"{self.name}_count{_labels_text(key)} {count}")
+        return lines
+
+STAGE_SECONDS = Histogram("chatbot_stage_seconds", "Latency of each hot-path stage")
+DOCUMENTS_RETRIEVED = Counter("chatbot_documents_retrieved_total", "Documents returned by retrieval stages")
+TOKENS_STREAMED = Counter("chatbot_tokens_streamed_total", "Answer chunks streamed to clients")
+REQUESTS = Counter("chatbot_requests_total", "Chat requests by mode and final status")
+
+_metrics = [STAGE_SECONDS, DOCUMENTS_RETRIEVED, TOKENS_STREAMED, REQUESTS]
+_collectors = []
+
+def register_collector(collect):
+    """
+    Add a scrape-time collector: `collect()` returns
+    [(name, type, help, [(labels dict, value), ...]), ...] for gauges such as cache stats.
+    """
+    _collectors.append(collect)
+
+def expose():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.expose())
+    for collect in _collectors:
+        for name, metric_type, help_text, samples in collect():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels_text(tuple(sorted(labels.items())))} {value}")
+    return "\n".join(lines) + "\n"
+
+# Per-request timing breakdown (stage -> seconds), None when not requested
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def start_request_timings():
+    """Collect a timing breakdown for the current request (and tasks/threads it starts)"""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+def observe_stage(name, seconds):
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = round(timings.get(name, 0.0) + seconds, 4)
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _NoopStage()
+
+def stage(name):
+    """`with stage("embedding"): ...` times the block into the histogram and the request breakdown"""
+    if not METRICS_ENABLED and _request_timings.get() is None:
+        return _NOOP
+    return _Stage(name)
+
+def count_documents(stage_name, n):
+    if METRICS_ENABLED:
+        DOCUMENTS_RETRIEVED.inc(n, stage=stage_name)
+
+def count_tokens(mode, n=1):
+    if METRICS_ENABLED:
+        TOKENS_STREAMED.inc(n, mode=mode)
+
+def count_request(mode, status):
+    if METRICS_ENABLED:
+        REQUESTS.inc(mode=mode, status=status)
+
+def with_context(fn):
+    """Wrap `fn` to run in a copy of the caller's context (for thread pools, which do not propagate it)"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
@@ -1,9 +1,20 @@
 import os
+import time
+import asyncio
+import numpy as np
+from collections import namedtuple
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.prebuilt import create_react_agent
 from langchain_core.messages import HumanMessage, SystemMessage
-from rag import retrieval_tool
+from components import registry
+from rag import retrieval_tool, retrieve_context, embed_question, new_response_cache, CACHE_ENABLED, warm_up as rag_warm_up
+from cache import replay_chunks, normalize_text
+from concurrency import AdmissionController, SingleFlight, Overloaded
+from llm_client import llm_breaker, is_upstream_error
+from metrics import stage, observe_stage, count_tokens
+from context_packing import NO_CONTEXT
+from intent_router import classify_intent, direct_response, is_follow_up, MEDICAL, OUT_OF_SCOPE
+from conversation import load_session, record_turn, has_history, history_messages, system_message
 
 # Load environment variables
 load_dotenv()
@@ -24,25 +35,92 @@ system_prompt = (
 "- Luôn trích nguồn link của câu trả lời"
 )
 
-# Initialize LLM
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if GOOGLE_API_KEY:
-    os.environ["GOOGLE_API_KEY"] = GOOGLE_API_KEY
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash-exp"
-    )
-else:
-    raise ValueError("GOOGLE_API_KEY not found. Please set it in your .env file.")
+# Prompt cho pipeline single-shot: tài liệu đã được truy xuất sẵn, một lần gọi LLM
+answer_prompt = (
+"Bạn là một trợ lý thông minh trong lĩnh vực y tế, hỗ trợ người dùng bằng tiếng Việt một cách dễ hiểu, chi tiết và đáng tin cậy.\n\n"
+"Bạn sẽ nhận được các tài liệu tham khảo đã được truy xuất và câu hỏi của người dùng.\n"
+"Yêu cầu bắt buộc:\n"
+"- Chỉ trả lời dựa trên các tài liệu tham khảo được cung cấp, không tự suy diễn hoặc phỏng đoán.\n"
+"- Nếu tài liệu không đủ thông tin để trả lời, hãy thông báo rõ ràng rằng chưa có dữ liệu phù hợp.\n"
+"- Trả lời hoàn toàn bằng tiếng Việt, có cấu trúc rõ ràng.\n"
+"- Không được trả lời các câu hỏi ngoài phạm vi y tế chuyên môn.\n"
+"- Luôn ưu tiên sự an toàn, độ chính xác và tính minh bạch của thông tin y khoa.\n"
+"- Luôn trích nguồn link của câu trả lời (dòng 'Nguồn:' của tài liệu)."
+)
+
+DEGRADED_PREFIX = (
+    "Hệ thống AI đang tạm thời gián đoạn. Dưới đây là các thông tin liên quan nhất "
+    "từ tài liệu y khoa để bạn tham khảo:\n\n"
+)
+
+NO_DATA_RESPONSE = (
+    "Xin lỗi, hiện tôi chưa có dữ liệu phù hợp để trả lời câu hỏi này. "
+    "Bạn nên tham khảo ý kiến bác sĩ để được tư vấn chính xác."
+)
+
+# "pipeline": intent router + truy xuất + một lần sinh câu trả lời; "agent": ReAct agent với retrieval_tool
+CHAT_MODES = ("pipeline", "agent")
+CHAT_MODE = os.getenv("CHAT_MODE", "pipeline")
 
 # Define tools for the agent
 tools = [retrieval_tool]
 
-# Create the health chatbot agent
-health_chatbot = create_react_agent(llm, tools)
+# Create the health chatbot agent (lazily, on the shared LLM)
+@registry.register("health_chatbot")
+def create_health_chatbot():
+    # Agent cần chat model gốc (bind_tools); timeout nằm trong client, breaker được ghi nhận ở astream_chat_with_agent
+    return create_react_agent(registry.get("chat_model"), tools)
+
+# Cache câu trả lời hoàn chỉnh của agent theo câu hỏi
+response_cache = new_response_cache()
+
+# Giới hạn số lượt gọi Gemini đồng thời (toàn cục / mỗi client) và hàng đợi có SLA
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_PER_CLIENT = int(os.getenv("LLM_MAX_PER_CLIENT", "2"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "5"))
+# Gộp các câu hỏi giống nhau đang xử lý đồng thời vào một lần sinh
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+
+llm_governor = AdmissionController(
+    max_in_flight=LLM_MAX_CONCURRENCY,
+    max_per_client=LLM_MAX_PER_CLIENT,
+    max_queue=LLM_MAX_QUEUE,
+    queue_timeout=LLM_QUEUE_TIMEOUT
+)
+single_flight = SingleFlight()
+
+# Phần tử cuối của stream khi lượt hỏi đáp cần được lưu vào phiên. astream_chat ghi lượt cho từng
+# người gọi (cả follower của một lần sinh chung) vào phiên của chính họ, không gửi tới client
+FinishedTurn = namedtuple("FinishedTurn", ["answer", "retrieval"])
+# Phần tử cuối khi câu trả lời là thông báo lỗi: astream_chat báo lỗi (ChatFailed) sau khi đã gửi thông báo
+FailedTurn = namedtuple("FailedTurn", ["error"])
+
+class ChatFailed(Exception):
+    """The answer stream ended with an error message instead of an answer"""
+
+# Câu hỏi gần giống (cosine) câu đã truy xuất trước đó trong phiên, và cùng bài viết đứng đầu BM25, dùng lại
+# tài liệu đó. Cosine của e5 giữa các câu hỏi ngắn tiếng Việt dồn vào khoảng 0.8-0.95: ngưỡng phải cao
+SESSION_REUSE_SIMILARITY = float(os.getenv("SESSION_REUSE_SIMILARITY", "0.95"))
 
 def get_health_chatbot():
     """Return the configured health chatbot agent"""
-    return health_chatbot
+    return registry.get("health_chatbot")
+
+# Warm-up khi khởi động: WARMUP_ENABLED=false để chỉ nạp mô hình ở request đầu tiên
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_QUERY = os.getenv("WARMUP_QUERY", "Cách điều trị cảm lạnh")
+
+def warm_up():
+    """Build every component and run a dummy encode + search, then mark the process ready"""
+    try:
+        if WARMUP_ENABLED:
+            rag_warm_up(WARMUP_QUERY)
+            get_health_chatbot()
+        registry.ready = True
+    except Exception as e:
+        registry.warmup_error = str(e)
+        print(f"Warm-up error: {e}")
 
 def stream_chat_with_agent(message: str, config=None):
     """
@@ -56,6 +134,12 @@ def stream_chat_with_agent(message: str, config=None):
         str: Chunks of agent's response
     """
     try:
+        # Trả lời lại từ cache nếu đã có câu hỏi giống/tương tự
+        cached = response_cache.get(message) if CACHE_ENABLED else None
+        if cached is not None:
+            yield from replay_chunks(cached)
+            return
+        
         if config is None:
             config = {"configurable": {"thread_id": "health_chat"}}
         
@@ -66,7 +150,9 @@ def stream_chat_with_agent(message: str, config=None):
         ]
         
         # Stream the agent's response
-        for chunk in health_chatbot.stream(
+        parts = []
+        start = time.perf_counter()
+        for chunk in get_health_chatbot().stream(
             {"messages": messages},
             config=config
         ):
@@ -75,14 +161,268 @@ def stream_chat_with_agent(message: str, config=None):
                 if "messages" in chunk["agent"]:
                     for msg in chunk["agent"]["messages"]:
                         if hasattr(msg, 'content') and msg.content:
+                            if not parts:
+                                observe_stage("agent_ttft", time.perf_counter() - start)
+                            parts.append(msg.content)
+                            count_tokens("agent")
                             yield msg.content
             elif "tools" in chunk:
                 # Handle tool calls if needed
                 continue
+        observe_stage("agent_total", time.perf_counter() - start)
+        
+        if CACHE_ENABLED and parts:
+            response_cache.set(message, "".join(parts))
                 
     except Exception as e:
         yield f"Có lỗi xảy ra: {str(e)}"
 
+def chunk_text(content):
+    """Text of a streamed message chunk (Gemini may send a list of parts)"""
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") if isinstance(part, dict) else str(part)
+            for part in content
+        )
+    return content
+
+async def astream_chat_with_agent(message: str, config=None, client_id=None, state=None):
+    """
+    Async token-level stream from the health agent
+    
+    Args:
+        message (str): User's message/question
+        config (dict, optional): Configuration for the agent
+        client_id (str, optional): Caller identity for the per-client LLM cap
+        state (dict, optional): Already loaded state of the conversation
+    
+    Yields:
+        str: LLM tokens of the agent's answer as soon as they arrive, then a
+        FinishedTurn to record in the conversation
+    """
+    try:
+        history = history_messages(state)
+        # Câu trả lời phụ thuộc lịch sử hội thoại thì không dùng/ghi cache chung
+        use_cache = CACHE_ENABLED and not has_history(state)
+        # Lookup embeds the question, keep it off the event loop
+        with stage("response_cache"):
+            cached = await asyncio.to_thread(response_cache.get, message) if use_cache else None
+        if cached is not None:
+            for piece in replay_chunks(cached):
+                yield piece
+            yield FinishedTurn(cached, None)
+            return
+        
+        if config is None:
+            config = {"configurable": {"thread_id": "health_chat"}}
+        
+        messages = [
+            system_message(system_prompt, state),
+            *history,
+            HumanMessage(content=message)
+        ]
+        
+        # Only the agent node's chat model tokens carry answer text (the query-expansion
+        # LLM inside retrieval_tool also streams); tool-call chunks have empty content
+        parts = []
+        queued = time.perf_counter()
+        async with llm_governor.slot(client_id):
+            start = time.perf_counter()
+            observe_stage("llm_queue_wait", start - queued)
+            # Component đầu tiên có thể phải nạp mô hình: không chặn event loop
+            health_chatbot = await asyncio.to_thread(get_health_chatbot)
+            async for event in health_chatbot.astream_events(
+                {"messages": messages},
+                config=config,
+                version="v2"
+            ):
+                if event["event"] != "on_chat_model_stream":
+                    continue
+                if event.get("metadata", {}).get("langgraph_node") != "agent":
+                    continue
+                content = chunk_text(event["data"]["chunk"].content)
+                if content:
+                    if not parts:
+                        observe_stage("agent_ttft", time.perf_counter() - start)
+                    parts.append(content)
+                    count_tokens("agent")
+                    yield content
+            observe_stage("agent_total", time.perf_counter() - start)
+        llm_breaker.record_success()
+        
+        if use_cache and parts:
+            await asyncio.to_thread(response_cache.set, message, "".join(parts))
+        if parts:
+            yield FinishedTurn("".join(parts), None)
+    
+    except Overloaded:
+        raise
+    except Exception as e:
+        # Chỉ lỗi của LLM / mạng mới làm mở breaker dùng chung với pipeline
+        if is_upstream_error(e):
+            llm_breaker.record_failure()
+        yield f"Có lỗi xảy ra: {str(e)}"
+        yield FailedTurn(str(e))
+
+def similar_questions(a: str, b: str) -> bool:
+    """Cosine similarity of the two questions' embeddings >= SESSION_REUSE_SIMILARITY"""
+    ea = np.asarray(embed_question(a), dtype=np.float32)
+    eb = np.asarray(embed_question(b), dtype=np.float32)
+    norm = float(np.linalg.norm(ea) * np.linalg.norm(eb))
+    return norm > 0 and float(ea @ eb) / norm >= SESSION_REUSE_SIMILARITY
+
+def same_top_document(a: str, b: str) -> bool:
+    """Whether the best BM25 hits of the two questions come from the same article (True without a BM25 index)"""
+    lexical_index = registry.get("lexical_index")
+    if lexical_index is None:
+        return True
+    tops = []
+    for question in (a, b):
+        hits = lexical_index.search(question, k=1)
+        if not hits:
+            return False
+        tops.append(lexical_index.items[hits[0][0]]["metadata"].get("doc_id"))
+    return tops[0] == tops[1]
+
+def session_retrieval(state, message: str, follow_up: bool):
+    """
+    Context for a question inside a conversation. A follow-up is searched
+    together with the previous question so it has a subject. The session's
+    last documents are reused only when that search question is close to the
+    one they were retrieved for and points to the same article in the BM25
+    index (a question about another disease can still be close in embedding
+    space); otherwise retrieval runs.
+    
+    Returns:
+        tuple: (context, {"question", "context"} to remember in the session, or None when reused)
+    """
+    question = f"{state['turns'][-1]['question']} {message}" if follow_up else message
+    last = state.get("retrieval") if state else None
+    if last and same_top_document(question, last["question"]) and similar_questions(question, last["question"]):
+        with stage("session_context_reuse"):
+            return last["context"], None
+    context = retrieve_context(question)
+    return context, {"question": question, "context": context}
+
+async def astream_chat_with_pipeline(message: str, config=None, client_id=None, state=None):
+    """
+    Async token-level stream from the single-shot RAG pipeline
+    
+    Greetings and out-of-scope questions are answered directly. Medical
+    questions are retrieved (in parallel with query expansion) and answered
+    with one grounded LLM call, instead of the agent's two LLM round trips.
+    Inside a conversation the recent turns and the running summary are part
+    of the prompt, and follow-ups reuse the documents already retrieved.
+    
+    Args:
+        message (str): User's message/question
+        config (dict, optional): Runnable config passed to the LLM
+        client_id (str, optional): Caller identity for the per-client LLM cap
+        state (dict, optional): Already loaded state of the conversation
+    
+    Yields:
+        str: Tokens of the answer as soon as they arrive, then a FinishedTurn
+        to record in the conversation (not for direct or no-data answers)
+    """
+    try:
+        with stage("intent_routing"):
+            lexical_index = await asyncio.to_thread(registry.get, "lexical_index")
+            intent = classify_intent(message, lexical_index)
+        # Trong một cuộc hội thoại: câu tham chiếu điều vừa nói là câu hỏi nối tiếp, kể cả khi không có từ
+        # khóa y tế ("thế còn người lớn?"); lời cảm ơn, chuyện phiếm vẫn nhận câu trả lời trực tiếp
+        follow_up = bool(state and state["turns"]) and intent in (MEDICAL, OUT_OF_SCOPE) and is_follow_up(message)
+        if intent != MEDICAL and not follow_up:
+            for piece in replay_chunks(direct_response(message, intent)):
+                yield piece
+            return
+        
+        with stage("response_cache"):
+            cached = await asyncio.to_thread(response_cache.get, message) if CACHE_ENABLED and not follow_up else None
+        if cached is not None:
+            for piece in replay_chunks(cached):
+                yield piece
+            yield FinishedTurn(cached, None)
+            return
+        
+        parts = []
+        queued = time.perf_counter()
+        # Query expansion và sinh câu trả lời đều gọi Gemini: giữ một slot cho cả hai
+        async with llm_governor.slot(client_id):
+            observe_stage("llm_queue_wait", time.perf_counter() - queued)
+            context, retrieval = await asyncio.to_thread(session_retrieval, state, message, follow_up)
+            if context == NO_CONTEXT:
+                for piece in replay_chunks(NO_DATA_RESPONSE):
+                    yield piece
+                return
+            
+            messages = [
+                system_message(answer_prompt, state),
+                *history_messages(state),
+                HumanMessage(content=f"Tài liệu tham khảo:\n{context}\n\nCâu hỏi: {message}")
+            ]
+            llm = await asyncio.to_thread(registry.get, "llm")
+            start = time.perf_counter()
+            try:
+                async for chunk in llm.astream(messages, config=config):
+                    content = chunk_text(chunk.content)
+                    if content:
+                        if not parts:
+                            observe_stage("llm_ttft", time.perf_counter() - start)
+                        parts.append(content)
+                        count_tokens("pipeline")
+                        yield content
+                observe_stage("llm_generation", time.perf_counter() - start)
+            except Exception as e:
+                if parts:
+                    raise
+                # LLM không khả dụng (timeout, breaker mở...): trả về trực tiếp tài liệu đã truy xuất
+                print(f"LLM generation unavailable ({e}), answering with retrieved documents")
+                for piece in replay_chunks(DEGRADED_PREFIX + context):
+                    yield piece
+                return
+        
+        # Không cache câu trả lời có dùng lịch sử hội thoại (có thể chứa thông tin riêng của người dùng)
+        if CACHE_ENABLED and parts and not follow_up and not has_history(state):
+            await asyncio.to_thread(response_cache.set, message, "".join(parts))
+        if parts:
+            yield FinishedTurn("".join(parts), retrieval)
+    
+    except Overloaded:
+        raise
+    except Exception as e:
+        yield f"Có lỗi xảy ra: {str(e)}"
+        yield FailedTurn(str(e))
+
+async def astream_chat(message: str, config=None, mode=None, client_id=None, session_id=None):
+    """
+    Token stream of the selected answer mode (CHAT_MODE unless `mode` is given),
+    within conversation `session_id` if given.
+    Identical questions in flight at the same time share one generation; the
+    finished turn is recorded in each caller's own session.
+    Raises Overloaded when the LLM governor rejects the request, and ChatFailed
+    after the error message when answering failed.
+    """
+    mode = mode if mode in CHAT_MODES else CHAT_MODE
+    state = await asyncio.to_thread(load_session, session_id)
+    # Breaker mở: agent không thể chạy, pipeline vẫn trả lời được ở chế độ suy giảm
+    if mode == "agent" and not llm_breaker.is_open():
+        factory = lambda: astream_chat_with_agent(message, config, client_id, state)
+    else:
+        factory = lambda: astream_chat_with_pipeline(message, config, client_id, state)
+    if not COALESCE_ENABLED:
+        stream = factory()
+    else:
+        # Câu trả lời phụ thuộc lịch sử hội thoại: chỉ gộp trong cùng phiên
+        scope = f"{session_id}:" if has_history(state) else ""
+        stream = single_flight.stream(f"{mode}:{scope}{normalize_text(message)}", factory)
+    async for piece in stream:
+        if isinstance(piece, FinishedTurn):
+            await asyncio.to_thread(record_turn, session_id, message, piece.answer, piece.retrieval)
+            continue
+        if isinstance(piece, FailedTurn):
+            raise ChatFailed(piece.error)
+        yield piece
+
 if __name__ == "__main__":
     # Test the health chatbot
     test_message = "Cách điều trị cảm lạnh?"
@@ -1,120 +1,478 @@
 import os
-from dotenv import load_dotenv
-from langchain_chroma import Chroma
-from langchain_google_genai import ChatGoogleGenerativeAI
+import re
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnableLambda
-from langchain.load import dumps, loads
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from langchain.tools import StructuredTool
 from pydantic import BaseModel
 from operator import itemgetter
-from langchain_huggingface import HuggingFaceEmbeddings
+from components import registry
+from vector_index import NumpyVectorIndex
+from corpus_store import CorpusStore, CORPUS_DB_PATH
+from cache import SemanticCache
+from context_packing import document_key, pack_context, NO_CONTEXT
+from lexical_index import LexicalIndex
+from llm_client import ResilientLLM, llm_breaker
+from metrics import stage, count_documents, with_context
 
-# Load environment variables
-load_dotenv()
+# LLM, embedding model and Chroma collections are lazy singletons from components.registry
 
-# Initialize LLM and embedding model
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if GOOGLE_API_KEY:
-    os.environ["GOOGLE_API_KEY"] = GOOGLE_API_KEY
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash-exp"
-    )
-    embedding_model = HuggingFaceEmbeddings(
-        model_name="intfloat/multilingual-e5-base",
-        encode_kwargs={"normalize_embeddings": True}
+# Optional in-process NumPy backend ("chroma" | "numpy"), built by data/indexing.py
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+NUMPY_INDEX_PATH = os.getenv("NUMPY_INDEX_PATH", "data/numpy_index")
+
+@registry.register("vector_index")
+def load_vector_index():
+    return NumpyVectorIndex.load(NUMPY_INDEX_PATH, mmap=True) if VECTOR_BACKEND == "numpy" else None
+
+@registry.register("corpus_store")
+def open_corpus_store():
+    # data/indexing.py giữ text của chunk trong corpus store, Chroma / NumPy index chỉ có vector + metadata
+    return CorpusStore(CORPUS_DB_PATH, readonly=True) if os.path.exists(CORPUS_DB_PATH) else None
+
+def hydrate(docs):
+    """Fill in, by chunk ID from the corpus store, the text of retrieved chunks whose vector entry has none"""
+    missing = [doc for doc in docs if not doc.page_content and doc.id]
+    if not missing:
+        return docs
+    store = registry.get("corpus_store")
+    if store is None:
+        return docs
+    with stage("chunk_fetch"):
+        texts = store.get_chunk_texts({doc.id for doc in missing})
+    for doc in missing:
+        doc.page_content = texts.get(doc.id, "")
+    return docs
+
+# Lexical BM25 index (chunks + summaries), fused with dense results in reciprocal_rank_fusion
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "data/lexical_index.json")
+# Trả lời chỉ bằng BM25 khi chunk đứng đầu chứa cả câu hỏi và điểm BM25 bỏ xa bài viết đứng thứ hai
+# ít nhất tỉ lệ này (1 - điểm bài thứ hai / điểm đứng đầu). Mặc định > 1: tắt
+LEXICAL_ONLY_MARGIN = float(os.getenv("LEXICAL_ONLY_MARGIN", "1.1"))
+
+def build_lexical_index():
+    """Build the BM25 index from the Chroma collections (chunk texts from the corpus store), keeping their IDs so fusion merges hits"""
+    def items(collection):
+        data = collection.get(include=["documents", "metadatas"])
+        return [
+            {"id": id_, "text": text, "metadata": metadata}
+            for id_, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        ]
+    store = registry.get("corpus_store")
+    return LexicalIndex.from_chunks_and_summaries(
+        store.iter_chunks() if store is not None else items(registry.get("chroma_detail")),
+        items(registry.get("chroma_summary"))
     )
-else:
-    raise ValueError("GOOGLE_API_KEY not found. Please set it in your .env file.")
-
-# Initialize Chroma collections
-chroma_summary = Chroma(
-    collection_name="summaries",
-    embedding_function=embedding_model,
-    persist_directory="data/chroma_storage/summaries"    
-)
 
-chroma_detail = Chroma(
-    collection_name="detail_chunks",
-    embedding_function=embedding_model,
-    persist_directory="data/chroma_storage/details"
-)
+@registry.register("lexical_index")
+def load_lexical_index():
+    """Load the serialized BM25 index, building and saving it on first start"""
+    if not HYBRID_RETRIEVAL:
+        return None
+    if os.path.exists(LEXICAL_INDEX_PATH):
+        return LexicalIndex.load(LEXICAL_INDEX_PATH)
+    index = build_lexical_index()
+    index.save(LEXICAL_INDEX_PATH)
+    return index
 
-# RAG Fusion template for query expansion
+# Tham số truy xuất, đọc lúc gọi (benchmarks/eval_retrieval.py đo recall và độ trễ của từng lựa chọn)
+SUMMARY_K = int(os.getenv("RETRIEVAL_SUMMARY_K", "3"))
+DETAIL_K = int(os.getenv("RETRIEVAL_DETAIL_K", "10"))
+# false: tìm thẳng trên toàn bộ chunk, bỏ qua bước chọn tài liệu qua summary
+HIERARCHICAL_SEARCH = os.getenv("HIERARCHICAL_SEARCH", "true").lower() == "true"
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Số câu viết lại của query expansion (0: không gọi LLM, chỉ dùng câu hỏi gốc)
+QUERY_EXPANSION_COUNT = int(os.getenv("QUERY_EXPANSION_COUNT", "3"))
+
+# RAG Fusion template for query expansion ({count}/{total} filled from QUERY_EXPANSION_COUNT when the prompt is formatted)
 template = """Bạn là một trợ lý ngôn ngữ AI giúp cải thiện kết quả tìm kiếm trong hệ thống truy xuất thông tin dựa trên vector.
 
-Nhiệm vụ của bạn là viết lại câu hỏi gốc của người dùng thành 3 phiên bản khác nhau, có ý nghĩa tương đồng nhưng được diễn đạt theo nhiều cách khác nhau.  
+Nhiệm vụ của bạn là viết lại câu hỏi gốc của người dùng thành {count} phiên bản khác nhau, có ý nghĩa tương đồng nhưng được diễn đạt theo nhiều cách khác nhau.  
 Các câu hỏi viết lại này cần phản ánh sự đa dạng về cách diễn đạt, mức độ chi tiết hoặc các ý định tiềm ẩn khác nhau của người dùng, nhằm tăng khả năng tìm được tài liệu phù hợp khi sử dụng tìm kiếm theo độ tương đồng embedding.
 
-Hãy trả về tổng cộng 4 câu hỏi: câu gốc và 3 câu viết lại, mỗi câu nằm trên một dòng riêng biệt, bắt đầu bằng câu hỏi gốc.
+Hãy trả về tổng cộng {total} câu hỏi: câu gốc và {count} câu viết lại, mỗi câu nằm trên một dòng riêng biệt, bắt đầu bằng câu hỏi gốc.
 
 Câu hỏi gốc: {question}"""
 
-prompt_rag_fusion = ChatPromptTemplate.from_template(template)
+def _expansion_count():
+    return str(max(QUERY_EXPANSION_COUNT, 1))
 
-# Query generation chain
-generate_queries = (
-    prompt_rag_fusion 
-    | llm
-    | StrOutputParser()
-    | (lambda x: x.split("\n"))
+prompt_rag_fusion = ChatPromptTemplate.from_template(template).partial(
+    count=_expansion_count, total=lambda: str(max(QUERY_EXPANSION_COUNT, 1) + 1)
 )
 
-def health_retriever(query):
-    """Retrieve health information using summary and detail documents"""
+# Query expansion cho nhiều câu hỏi trong một lần gọi LLM (xử lý theo lô, xem batch_qa.py)
+batch_template = """Bạn là một trợ lý ngôn ngữ AI giúp cải thiện kết quả tìm kiếm trong hệ thống truy xuất thông tin dựa trên vector.
+
+Với mỗi câu hỏi gốc được đánh số dưới đây, hãy viết lại thành {count} phiên bản khác nhau, có ý nghĩa tương đồng nhưng được diễn đạt theo nhiều cách khác nhau, nhằm tăng khả năng tìm được tài liệu phù hợp khi sử dụng tìm kiếm theo độ tương đồng embedding.
+
+Mỗi câu viết lại nằm trên một dòng riêng, bắt đầu bằng số thứ tự của câu hỏi gốc trong ngoặc vuông, ví dụ: [1] câu viết lại. Không viết thêm gì khác.
+
+Các câu hỏi gốc:
+{questions}"""
+
+prompt_batch_expansion = ChatPromptTemplate.from_template(batch_template).partial(count=_expansion_count)
+
+_NUMBERED_LINE = re.compile(r"^\s*\[(\d+)\]\s*(.+?)\s*$")
+
+# Query expansion chỉ để tăng recall: deadline ngắn, không retry (lỗi -> chỉ dùng câu hỏi gốc)
+LLM_EXPANSION_TIMEOUT = float(os.getenv("LLM_EXPANSION_TIMEOUT", "5"))
+
+@registry.register("expansion_llm")
+def create_expansion_llm():
+    return ResilientLLM(
+        registry.get("chat_model"),
+        timeout=LLM_EXPANSION_TIMEOUT,
+        max_retries=0,
+        breaker=llm_breaker
+    )
+
+# Nhiều câu hỏi mỗi lần gọi: đầu ra dài hơn, deadline dài hơn
+LLM_BATCH_EXPANSION_TIMEOUT = float(os.getenv("LLM_BATCH_EXPANSION_TIMEOUT", "30"))
+
+@registry.register("batch_expansion_llm")
+def create_batch_expansion_llm():
+    return ResilientLLM(
+        registry.get("chat_model"),
+        timeout=LLM_BATCH_EXPANSION_TIMEOUT,
+        max_retries=1,
+        hedge=False,
+        breaker=llm_breaker
+    )
+
+# Query generation chain
+@registry.register("generate_queries")
+def create_generate_queries():
+    return (
+        prompt_rag_fusion 
+        | registry.get("expansion_llm")
+        | StrOutputParser()
+        | (lambda x: x.split("\n"))
+    )
+
+# Số truy vấn tìm kiếm chạy song song trên Chroma
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+_search_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS)
+# Query expansion (LLM) chạy trên pool riêng, song song với truy xuất câu hỏi gốc
+_expansion_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS)
+
+def search_by_vector(query_embedding):
+    """Hierarchical summary -> detail search (flat detail search if HIERARCHICAL_SEARCH is off) for an already embedded query"""
+    vector_index = registry.get("vector_index")
+    if vector_index is not None:
+        with stage("vector_index_search"):
+            detail_docs = vector_index.search(
+                query_embedding, k_summary=SUMMARY_K if HIERARCHICAL_SEARCH else None, k_detail=DETAIL_K
+            )
+        count_documents("detail_search", len(detail_docs))
+        return hydrate(detail_docs)
+
+    if not HIERARCHICAL_SEARCH:
+        with stage("detail_search"):
+            detail_docs = registry.get("chroma_detail").similarity_search_by_vector(query_embedding, k=DETAIL_K)
+        count_documents("detail_search", len(detail_docs))
+        return hydrate(detail_docs)
+    
     # First, search summaries to get relevant document IDs
-    summary_docs = chroma_summary.similarity_search(query, k=3)
+    with stage("summary_search"):
+        summary_docs = registry.get("chroma_summary").similarity_search_by_vector(query_embedding, k=SUMMARY_K)
+    count_documents("summary_search", len(summary_docs))
     
     # Extract unique document IDs
     doc_ids = list({doc.metadata["doc_id"] for doc in summary_docs})
+    if not doc_ids:
+        # Chroma từ chối "$or" chỉ có một điều kiện
+        return []
     
-    # Then search details within those documents
-    detail_docs = chroma_detail.similarity_search(
-        query=query,
-        k=10,
-        filter={"doc_id": {"$in": doc_ids}}
-    )
-    return detail_docs
+    # Then search details within those documents (including chunks deduplicated into another article)
+    with stage("detail_search"):
+        detail_docs = registry.get("chroma_detail").similarity_search_by_vector(
+            query_embedding,
+            k=DETAIL_K,
+            filter={"$or": [{"doc_id": {"$in": doc_ids}}] + [
+                {"source_doc_ids": {"$contains": doc_id}} for doc_id in doc_ids
+            ]}
+        )
+    count_documents("detail_search", len(detail_docs))
+    return hydrate(detail_docs)
+
+def health_retriever(query):
+    """Retrieve health information using summary and detail documents"""
+    with stage("embedding"):
+        query_embedding = registry.get("embedding_model").embed_query(query)
+    return search_by_vector(query_embedding)
+
+def fused_retriever(queries: list[str], embeddings: list = None):
+    """
+    Retrieve for all expanded queries at once: embed every query in a single
+    batched forward pass, then run the per-query searches concurrently.
+    `embeddings` (aligned with `queries`, None entries allowed) are vectors
+    already computed by the caller; only the other queries are encoded.
+    Returns one ranked list per query, in the same order as `queries`.
+    """
+    pairs = [
+        (q.strip(), e) for q, e in zip(queries, embeddings or [None] * len(queries)) if q and q.strip()
+    ]
+    if not pairs:
+        return []
+    queries = [q for q, _ in pairs]
+    query_embeddings = [e for _, e in pairs]
+    missing = [i for i, e in enumerate(query_embeddings) if e is None]
+    
+    # HuggingFaceEmbeddings encodes queries and documents the same way
+    if missing:
+        with stage("embedding"):
+            encoded = registry.get("embedding_model").embed_documents([queries[i] for i in missing])
+        for i, embedding in zip(missing, encoded):
+            query_embeddings[i] = embedding
+    vector_index = registry.get("vector_index")
+    if vector_index is not None:
+        # Một phép nhân ma trận cho tất cả truy vấn
+        with stage("vector_index_search"):
+            results = vector_index.search_many(
+                query_embeddings, k_summary=SUMMARY_K if HIERARCHICAL_SEARCH else None, k_detail=DETAIL_K
+            )
+        count_documents("detail_search", sum(len(docs) for docs in results))
+        # Một truy vấn corpus store cho mọi danh sách
+        hydrate([doc for docs in results for doc in docs])
+        return results
+    return list(_search_pool.map(with_context(search_by_vector), query_embeddings))
+
+def hybrid_retriever(queries: list[str], embeddings: list = None):
+    """Dense ranked lists from fused_retriever plus one BM25 ranked list per query"""
+    results = fused_retriever(queries, embeddings)
+    lexical_index = registry.get("lexical_index")
+    if lexical_index is not None:
+        with stage("lexical_search"):
+            lexical_results = [
+                lexical_index.search_documents(q.strip(), k=DETAIL_K) for q in queries if q and q.strip()
+            ]
+        count_documents("lexical_search", sum(len(docs) for docs in lexical_results))
+        results.extend(lexical_results)
+    return results
 
 retriever = RunnableLambda(health_retriever)
 
-def reciprocal_rank_fusion(results: list[list], k=60):
+def reciprocal_rank_fusion(results: list[list], k=None):
     """Reciprocal_rank_fusion that takes multiple lists of ranked documents 
-       and an optional parameter k used in the RRF formula"""
+       and an optional parameter k used in the RRF formula (default RRF_K)"""
     
-    # Initialize a dictionary to hold fused scores for each unique document
-    fused_scores = defaultdict(float)
-
-    # Iterate through each list of ranked documents
-    for docs in results:
-        for rank, doc in enumerate(docs):
-            doc_str = dumps(doc)
-            # Update the score of the document using the RRF formula: 1 / (rank + k)
-            fused_scores[doc_str] += 1 / (rank + k)
-
-    reranked_results = [
-        (loads(doc), score)
-        for doc, score in sorted(fused_scores.items(), key=lambda x: x[1], reverse=True)
-    ]
+    k = RRF_K if k is None else k
+    with stage("fusion"):
+        # Initialize dictionaries to hold fused scores and the document for each unique ID
+        fused_scores = defaultdict(float)
+        documents = {}
+
+        # Iterate through each list of ranked documents
+        for docs in results:
+            for rank, doc in enumerate(docs):
+                key = document_key(doc)
+                documents.setdefault(key, doc)
+                # Update the score of the document using the RRF formula: 1 / (rank + k)
+                fused_scores[key] += 1 / (rank + k)
 
+        reranked_results = [
+            (documents[key], score)
+            for key, score in sorted(fused_scores.items(), key=lambda x: x[1], reverse=True)
+        ]
+
+    count_documents("fusion", len(reranked_results))
     return reranked_results
 
 # RAG Fusion retrieval chain
-retrieval_chain_rag_fusion = generate_queries | retriever.map() | reciprocal_rank_fusion
+@registry.register("retrieval_chain_rag_fusion")
+def create_retrieval_chain_rag_fusion():
+    return registry.get("generate_queries") | RunnableLambda(hybrid_retriever) | reciprocal_rank_fusion
+
+def expand_queries(question: str):
+    """Original question + LLM rewrites from the RAG Fusion prompt"""
+    with stage("query_expansion"):
+        return registry.get("generate_queries").invoke({"question": question})
+
+def retrieve_fused(question: str):
+    """
+    Same results as the RAG Fusion chain, without waiting for the expansion
+    to start searching: the original question is retrieved while the LLM
+    writes its rewrites, then only the rewrites are retrieved and everything
+    is fused. If the expansion fails, times out or the LLM circuit breaker is
+    open, the original question's results are used alone. At most
+    QUERY_EXPANSION_COUNT rewrites are used (0 disables the expansion).
+    
+    Returns:
+        tuple: (fused results, whether the expanded queries were used)
+    """
+    if QUERY_EXPANSION_COUNT <= 0:
+        return reciprocal_rank_fusion(hybrid_retriever([question])), True
+    if llm_breaker.is_open():
+        return reciprocal_rank_fusion(hybrid_retriever([question])), False
+    expansion = _expansion_pool.submit(with_context(expand_queries), question)
+    results = hybrid_retriever([question])
+    try:
+        original = question.strip()
+        rewrites = [q for q in expansion.result() if q.strip() and q.strip() != original][:QUERY_EXPANSION_COUNT]
+    except Exception as e:
+        print(f"Query expansion error: {e}")
+        return reciprocal_rank_fusion(results), False
+    results.extend(hybrid_retriever(rewrites))
+    return reciprocal_rank_fusion(results), True
+
+def batch_expansion_input(questions: list[str]):
+    """Prompt input expanding all `questions` in one LLM call"""
+    return {"questions": "\n".join(f"[{i}] {q.strip()}" for i, q in enumerate(questions, 1))}
+
+def parse_batch_expansion(text: str, questions: list[str]):
+    """
+    Rewrites per question from the numbered lines of a batch expansion answer,
+    at most QUERY_EXPANSION_COUNT each. Questions the LLM skipped get no rewrites.
+    """
+    rewrites = [[] for _ in questions]
+    for line in text.splitlines():
+        match = _NUMBERED_LINE.match(line)
+        if not match:
+            continue
+        i = int(match.group(1)) - 1
+        query = match.group(2)
+        if 0 <= i < len(questions) and query != questions[i].strip() and len(rewrites[i]) < QUERY_EXPANSION_COUNT:
+            rewrites[i].append(query)
+    return rewrites
+
+def retrieve_contexts(questions: list[str], rewrites: list[list[str]] = None, embeddings: list = None):
+    """
+    Packed contexts for many questions at once: every question and its rewrites
+    are embedded in a single batched pass and searched together (one matrix
+    product with the NumPy index), then the ranked lists are fused per question.
+    With `embeddings` (one per question, already computed by the caller) only
+    the rewrites are encoded.
+    
+    Returns:
+        list[str]: one packed context per question
+    """
+    rewrites = rewrites or [[] for _ in questions]
+    embeddings = embeddings or [None for _ in questions]
+    queries, owners, query_embeddings = [], [], []
+    for i, (question, extra) in enumerate(zip(questions, rewrites)):
+        for j, query in enumerate([question] + extra):
+            if query.strip():
+                queries.append(query.strip())
+                owners.append(i)
+                query_embeddings.append(embeddings[i] if j == 0 else None)
+    if not queries:
+        return [NO_CONTEXT for _ in questions]
+    
+    with stage("batch_retrieval"):
+        # Dense lists theo thứ tự queries, tiếp theo (nếu có BM25) lexical lists cùng thứ tự
+        ranked_lists = hybrid_retriever(queries, query_embeddings)
+    per_question = [[] for _ in questions]
+    for j, docs in enumerate(ranked_lists):
+        per_question[owners[j % len(queries)]].append(docs)
+    
+    contexts = []
+    for lists in per_question:
+        fused = reciprocal_rank_fusion(lists)
+        with stage("context_packing"):
+            contexts.append(pack_context(fused, token_budget=CONTEXT_TOKEN_BUDGET))
+    return contexts
+
+# Semantic cache cho kết quả truy xuất (exact match + nearest neighbour trên embedding câu hỏi)
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "512"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "3600"))
+CACHE_SIMILARITY_THRESHOLD = float(os.getenv("CACHE_SIMILARITY_THRESHOLD", "0.95"))
+
+@lru_cache(maxsize=1024)
+def embed_question(question: str):
+    """Embedding of a user question, memoized so both cache levels share one encode"""
+    return tuple(registry.get("embedding_model").embed_query(question))
+
+def new_semantic_cache():
+    """Create a SemanticCache configured from the CACHE_* settings"""
+    return SemanticCache(
+        embed_fn=embed_question,
+        max_size=CACHE_MAX_SIZE,
+        ttl=CACHE_TTL,
+        threshold=CACHE_SIMILARITY_THRESHOLD
+    )
+
+retrieval_cache = new_semantic_cache()
+
+# Cache câu trả lời: mặc định chỉ khớp chính xác câu hỏi đã chuẩn hoá, vì hai câu
+# gần nhau về embedding ("sốt 38 độ" / "sốt 40 độ") có thể cần câu trả lời khác nhau
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() == "true"
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.98"))
+
+def new_response_cache():
+    """Create the answer cache: exact-match only unless RESPONSE_CACHE_SEMANTIC=true"""
+    return SemanticCache(
+        embed_fn=embed_question if RESPONSE_CACHE_SEMANTIC else None,
+        max_size=CACHE_MAX_SIZE,
+        ttl=CACHE_TTL,
+        threshold=RESPONSE_CACHE_SIMILARITY
+    )
+
+# Ngân sách token cho ngữ cảnh trả về agent
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
 
 # Tool definition
 class RagInput(BaseModel):
     question: str
 
+def lexical_only_results(question: str):
+    """
+    Fused-format BM25 results when the top lexical hit covers the whole question
+    and clearly beats every other article (LEXICAL_ONLY_MARGIN), skipping query
+    expansion and embedding; else None.
+    """
+    if LEXICAL_ONLY_MARGIN > 1:
+        return None
+    lexical_index = registry.get("lexical_index")
+    if lexical_index is None:
+        return None
+    hits = lexical_index.search(question, k=DETAIL_K)
+    if lexical_index.confidence(question, hits) < 1.0 or lexical_index.margin(hits) < LEXICAL_ONLY_MARGIN:
+        return None
+    return [(lexical_index.to_document(i), score) for i, score in hits]
+
+def retrieve_context(question: str):
+    """Retrieve for `question` and return the relevant documents as a packed context"""
+    if CACHE_ENABLED:
+        with stage("retrieval_cache"):
+            cached = retrieval_cache.get(question)
+        if cached is not None:
+            return cached
+    with stage("retrieval"):
+        results = lexical_only_results(question)
+        complete = True
+        if results is None:
+            results, complete = retrieve_fused(question)
+    with stage("context_packing"):
+        context = pack_context(results, token_budget=CONTEXT_TOKEN_BUDGET)
+    # Kết quả thiếu query expansion (chế độ suy giảm) không được cache
+    if CACHE_ENABLED and complete:
+        retrieval_cache.set(question, context)
+    return context
+
 def run_retrieval_only(question: str):
-    """Run only the retrieval part to get relevant documents"""
+    """Run only the retrieval part and return the relevant documents as a packed context"""
     try:
-        return retrieval_chain_rag_fusion.invoke({"question": question})
+        return retrieve_context(question)
     except Exception as e:
+        print(f"Retrieval error: {e}")
         return f"Lỗi khi truy xuất tài liệu: {str(e)}"
 
+def warm_up(query="Cách điều trị cảm lạnh"):
+    """Load the retrieval components and run a dummy encode + search so the first real query is fast"""
+    registry.get("llm")
+    registry.get("generate_queries")
+    registry.get("retrieval_chain_rag_fusion")
+    registry.get("lexical_index")
+    registry.get("corpus_store")
+    query_embeddings = registry.get("embedding_model").embed_documents([query])
+    search_by_vector(query_embeddings[0])
+
 # Create structured tool
 retrieval_tool = StructuredTool.from_function(
     name="retrieval_tool", 
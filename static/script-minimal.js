@@ -90,12 +90,15 @@ async function sendMessage() {
     focusInput();
 }
 
+// ID cuộc hội thoại do server cấp, giữ trong tab để câu hỏi tiếp theo có ngữ cảnh
+let sessionId = sessionStorage.getItem('chatSessionId');
+
 // Stream response function
 async function streamResponse(message, analysisMessageId) {
     const response = await fetch('/chat/stream', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ question: message })
+        body: JSON.stringify(sessionId ? { question: message, session_id: sessionId } : { question: message })
     });
     
     if (!response.ok) {
@@ -111,14 +114,17 @@ async function streamResponse(message, analysisMessageId) {
     let streamMessageId = null;
     let aiPowered = false;
     let currentContent = '';
+    let pending = '';
     
     try {
         while (true) {
             const { done, value } = await reader.read();
             if (done) break;
             
-            const chunk = decoder.decode(value);
-            const lines = chunk.split('\n');
+            // Một frame có thể bị cắt giữa hai lần đọc: giữ lại dòng cuối chưa hoàn chỉnh
+            pending += decoder.decode(value, { stream: true });
+            const lines = pending.split('\n');
+            pending = lines.pop();
             
             for (const line of lines) {
                 if (line.startsWith('data: ')) {
@@ -127,6 +133,10 @@ async function streamResponse(message, analysisMessageId) {
                         
                         if (data.type === 'metadata') {
                             aiPowered = data.ai_powered;
+                            if (data.session_id) {
+                                sessionId = data.session_id;
+                                sessionStorage.setItem('chatSessionId', sessionId);
+                            }
                             // Tạo message container trống
                             streamMessageId = addMessage('', 'bot', null, false, aiPowered);
                         } else if (data.type === 'chunk' && streamMessageId) {
@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Module gốc (import phẳng) và pipeline dữ liệu trong data/
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "data"))
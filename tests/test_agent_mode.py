@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import pytest
+from components import registry
+from llm_client import FakeChatModel, CircuitBreaker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+@pytest.fixture
+def client(monkeypatch):
+    """TestClient of main.app with the fake LLM, the hash embedder and an in-memory NumPy index"""
+    from fastapi.testclient import TestClient
+    from common import HashEmbeddings, build_backends
+    from lexical_index import LexicalIndex
+
+    items = [
+        {"id": f"d{i}-0", "text": text, "metadata": {"doc_id": f"d{i}", "url": f"https://vnvc.vn/d{i}", "section_h1": title}}
+        for i, (title, text) in enumerate([
+            ("Cảm lạnh", "Cảm lạnh: nghỉ ngơi, uống nhiều nước và giữ ấm cơ thể."),
+            ("Sốt xuất huyết", "Sốt xuất huyết: theo dõi tiểu cầu và bù dịch."),
+        ])
+    ]
+    embedder = HashEmbeddings()
+    backend = build_backends(embedder, items, items, ["numpy-float32"])["numpy-float32"]
+
+    monkeypatch.chdir(ROOT)
+    import main
+    import model
+    # Mọi component dựng trong test (llm, agent...) nằm trong bản sao, bị bỏ khi test kết thúc
+    monkeypatch.setattr(registry, "_instances", dict(registry._instances))
+    for name, instance in dict(
+        backend, embedding_model=embedder, lexical_index=LexicalIndex.build(items),
+        chat_model=FakeChatModel(latency=0.0, token_delay=0.0, seed=0)
+    ).items():
+        registry.override(name, instance)
+    monkeypatch.setattr(main, "LLM_ENABLED", True)
+    monkeypatch.setattr(model, "CACHE_ENABLED", False)
+    monkeypatch.setattr(model, "llm_breaker", CircuitBreaker())
+    return TestClient(main.app)
+
+def ask(client, question):
+    response = client.post("/chat/stream", json={"question": question, "mode": "agent"})
+    events = [json.loads(line[6:]) for line in response.text.splitlines() if line.startswith("data: ")]
+    answer = "".join(event["content"] for event in events if event["type"] == "chunk")
+    return answer, events[-1]
+
+def test_agent_mode_answers_offline(client):
+    answer, end = ask(client, "Cách điều trị cảm lạnh?")
+    assert end["status"] == "success"
+    assert answer.strip() and not answer.startswith("Có lỗi xảy ra")
+
+def test_agent_error_is_reported_without_tripping_breaker(client, monkeypatch):
+    import model
+
+    def broken():
+        raise TypeError("bug in the agent setup")
+
+    monkeypatch.setattr(model, "get_health_chatbot", broken)
+    answer, end = ask(client, "Cách điều trị cảm lạnh?")
+    assert answer.startswith("Có lỗi xảy ra")
+    assert end["status"] == "error"
+    # Lỗi của code không phải lỗi của LLM: breaker dùng chung không ghi nhận
+    assert model.llm_breaker.stats()["consecutive_failures"] == 0
@@ -0,0 +1,14 @@
+from batch_qa import dedupe_questions
+
+def test_dedupe_questions_maps_every_input_index():
+    unique, positions = dedupe_questions([
+        "Sốt cao phải làm gì?",
+        "  sốt cao PHẢI làm gì?  ",
+        "Ho kéo dài",
+        "Sốt cao phải làm gì?",
+    ])
+    assert unique == ["Sốt cao phải làm gì?", "Ho kéo dài"]
+    assert positions == [[0, 1, 3], [2]]
+
+def test_dedupe_questions_empty():
+    assert dedupe_questions([]) == ([], [])
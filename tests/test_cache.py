@@ -0,0 +1,36 @@
+import rag
+from cache import SemanticCache, normalize_text
+
+def same_vector(question):
+    """Embedding giả: mọi câu hỏi trùng nhau, chỉ phần khớp chính xác phân biệt được"""
+    return [1.0, 0.0]
+
+def test_normalize_text():
+    assert normalize_text("  Sốt 38 ĐỘ?? ") == "sốt 38 độ"
+
+def test_exact_match_ignores_case_and_punctuation():
+    cache = SemanticCache()
+    cache.set("Bé bị sốt 38 độ phải làm gì?", "answer")
+    assert cache.get("bé bị sốt 38 độ phải làm gì") == "answer"
+    assert cache.stats()["hits_exact"] == 1
+
+def test_semantic_level_matches_close_questions():
+    cache = SemanticCache(embed_fn=same_vector, threshold=0.95)
+    cache.set("Bé bị sốt 38 độ phải làm gì?", "answer")
+    assert cache.get("Bé bị sốt 40 độ phải làm gì?") == "answer"
+    assert cache.stats()["hits_semantic"] == 1
+
+def test_response_cache_is_exact_match_by_default(monkeypatch):
+    monkeypatch.setattr(rag, "embed_question", same_vector)
+    cache = rag.new_response_cache()
+    cache.set("Bé bị sốt 38 độ phải làm gì?", "answer for 38", embedding=[1.0, 0.0])
+    # Khác một con số: embedding trùng nhưng không được dùng lại câu trả lời
+    assert cache.get("Bé bị sốt 40 độ phải làm gì?", embedding=[1.0, 0.0]) is None
+    assert cache.get("bé bị sốt 38 độ phải làm gì") == "answer for 38"
+
+def test_response_cache_semantic_is_opt_in(monkeypatch):
+    monkeypatch.setattr(rag, "embed_question", same_vector)
+    monkeypatch.setattr(rag, "RESPONSE_CACHE_SEMANTIC", True)
+    cache = rag.new_response_cache()
+    assert cache.embed_fn is same_vector
+    assert cache.threshold > rag.CACHE_SIMILARITY_THRESHOLD
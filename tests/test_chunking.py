@@ -0,0 +1,55 @@
+from context_packing import estimate_tokens
+from chunking import rechunk, deduplicate, split_heading
+
+def section(doc_id, h2, text, h3=None):
+    metadata = {"section_h1": "Bài", "section_h2": h2, "url": f"https://vnvc.vn/{doc_id}", "doc_id": doc_id}
+    if h3:
+        metadata["section_h3"] = h3
+    return {"text": f"{h3 or h2}: {text}", "metadata": metadata}
+
+def sentences(n, word):
+    return " ".join(f"Câu số {i} nói về {word} và cách phòng ngừa bệnh ở trẻ nhỏ." for i in range(n))
+
+def test_rechunk_splits_long_sections_within_target():
+    chunks = rechunk([section("d1", "Triệu chứng", sentences(60, "sốt"))], target_tokens=120,
+                     overlap_tokens=20, min_tokens=10)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert estimate_tokens(chunk["text"]) <= 120
+        # Mỗi cửa sổ lặp lại tiêu đề và giữ metadata
+        assert split_heading(chunk)[0] == "Triệu chứng: "
+        assert chunk["metadata"]["doc_id"] == "d1"
+
+def test_rechunk_merges_short_sections_of_same_h2():
+    chunks = rechunk([
+        section("d1", "Điều trị", "Nghỉ ngơi.", h3="Tại nhà"),
+        section("d1", "Điều trị", "Đi khám.", h3="Tại viện"),
+        section("d1", "Phòng ngừa", "Tiêm vắc xin."),
+    ], target_tokens=350, overlap_tokens=50, min_tokens=100)
+    assert len(chunks) == 2
+    assert chunks[0]["text"] == "Tại nhà: Nghỉ ngơi.\nTại viện: Đi khám."
+    # Gộp khác section_h3: chỉ giữ phần tiêu đề chung
+    assert chunks[0]["metadata"]["section_h2"] == "Điều trị"
+    assert "section_h3" not in chunks[0]["metadata"]
+
+def test_deduplicate_keeps_first_copy_with_all_sources():
+    shared = sentences(8, "tiêm chủng")
+    chunks = [
+        section("d1", "Lịch tiêm", shared),
+        section("d2", "Tiêu chảy", sentences(8, "tiêu chảy")),
+        section("d3", "Lịch tiêm", shared + " Thêm một câu."),
+    ]
+    kept, removed = deduplicate(chunks, threshold=0.8)
+    assert removed == 1
+    assert [c["metadata"]["doc_id"] for c in kept] == ["d1", "d2"]
+    metadata = kept[0]["metadata"]
+    assert metadata["source_doc_ids"] == ["d1", "d3"]
+    assert metadata["source_urls"].split("\n") == ["https://vnvc.vn/d1", "https://vnvc.vn/d3"]
+    assert metadata["duplicates"] == 1
+    assert "source_doc_ids" not in kept[1]["metadata"]
+
+def test_deduplicate_leaves_distinct_chunks():
+    chunks = [section(f"d{i}", "Mục", sentences(5, word)) for i, word in enumerate(["sốt", "ho", "sởi"])]
+    kept, removed = deduplicate(chunks)
+    assert removed == 0
+    assert kept == chunks
@@ -0,0 +1,69 @@
+from context_packing import CHARS_PER_TOKEN
+from conversation import MemorySessionStore, SqliteSessionStore, split_history, history_messages
+
+def turn(n, chars=40 * CHARS_PER_TOKEN):
+    return {"question": f"q{n}", "answer": "x" * chars}
+
+def test_split_history_keeps_newest_turns_within_budget():
+    turns = [turn(n) for n in range(5)]
+    # Mỗi lượt ~42 token: ngân sách 100 giữ được 2 lượt cuối
+    older, recent = split_history(turns, token_budget=100)
+    assert [t["question"] for t in recent] == ["q3", "q4"]
+    assert older == turns[:3]
+
+def test_split_history_turn_larger_than_budget():
+    older, recent = split_history([turn(0), turn(1, chars=10_000)], token_budget=100)
+    assert recent == []
+    assert len(older) == 2
+
+def test_history_messages_alternate_roles():
+    messages = history_messages({"summary": "", "turns": [turn(0)], "retrieval": None})
+    assert [m.type for m in messages] == ["human", "ai"]
+    assert history_messages(None) == []
+
+def test_memory_store_update_returns_copies():
+    store = MemorySessionStore(max_sessions=10, ttl=None)
+    store.update("s", lambda state: state["turns"].append(turn(0)))
+    state = store.get("s")
+    state["turns"].clear()
+    assert len(store.get("s")["turns"]) == 1
+    assert store.get("missing") is None
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(max_sessions=2, ttl=None)
+    store.update("a", lambda state: None)
+    store.update("b", lambda state: None)
+    store.get("a")
+    store.update("c", lambda state: None)
+    assert store.get("b") is None
+    assert store.get("a") is not None
+    assert store.stats()["sessions"] == 2
+
+def test_memory_store_expires_sessions():
+    store = MemorySessionStore(max_sessions=10, ttl=1e-9)
+    store.update("a", lambda state: state["turns"].append(turn(0)))
+    assert store.get("a") is None
+
+def test_sqlite_store_round_trip(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SqliteSessionStore(path, max_sessions=10, ttl=None)
+    store.update("s", lambda state: state["turns"].append({"question": "Sốt?", "answer": "Uống nước"}))
+    store.update("s", lambda state: state.update(summary="tóm tắt"))
+    # Process khác (kết nối mới) đọc cùng trạng thái
+    state = SqliteSessionStore(path, max_sessions=10, ttl=None).get("s")
+    assert state["summary"] == "tóm tắt"
+    assert state["turns"] == [{"question": "Sốt?", "answer": "Uống nước"}]
+
+def test_sqlite_store_rolls_back_failed_update(tmp_path):
+    store = SqliteSessionStore(str(tmp_path / "sessions.db"), max_sessions=10, ttl=None)
+    store.update("s", lambda state: state.update(summary="v1"))
+
+    def fail(state):
+        state["summary"] = "v2"
+        raise ValueError("boom")
+
+    try:
+        store.update("s", fail)
+    except ValueError:
+        pass
+    assert store.get("s")["summary"] == "v1"
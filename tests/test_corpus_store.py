@@ -0,0 +1,52 @@
+import json
+from corpus_store import CorpusStore, content_hash
+
+def document(doc_id, text):
+    return {"metadata": {"url": f"https://vnvc.vn/{doc_id}", "doc_id": doc_id}, "text": text}
+
+def sections(doc_id, *texts):
+    return [{"text": text, "metadata": {"section_h2": text[:5], "doc_id": doc_id}} for text in texts]
+
+def test_documents_and_sections_round_trip(tmp_path):
+    store = CorpusStore(str(tmp_path / "corpus.db"))
+    store.put_document(document("b", "Bệnh sởi"), sections("b", "Triệu chứng sởi", "Điều trị sởi"))
+    store.put_document(document("a", "Bệnh sốt"), sections("a", "Sốt cao"))
+    # Ghi lại một bài thay thế các mục cũ của nó
+    store.put_document(document("b", "Bệnh sởi (cập nhật)"), sections("b", "Phòng ngừa sởi"))
+
+    assert store.document_hashes() == {"a": content_hash("Bệnh sốt"), "b": content_hash("Bệnh sởi (cập nhật)")}
+    assert [d["text"] for d in store.iter_documents()] == ["Bệnh sốt", "Bệnh sởi (cập nhật)"]
+    assert list(store.iter_documents(["b"])) == [document("b", "Bệnh sởi (cập nhật)")]
+    assert [s["text"] for s in store.iter_sections()] == ["Sốt cao", "Phòng ngừa sởi"]
+    assert store.stats()["sections"] == 2
+
+def test_chunks_by_id(tmp_path):
+    path = str(tmp_path / "corpus.db")
+    store = CorpusStore(path)
+    store.put_chunks({
+        "a-1": {"text": "Sốt cao", "metadata": {"doc_id": "a"}},
+        "a-2": {"text": "Hạ sốt", "metadata": {"doc_id": "a"}},
+    })
+    store.delete_chunks(["a-2"])
+    assert store.chunk_ids() == {"a-1"}
+    assert list(store.iter_chunks()) == [{"id": "a-1", "text": "Sốt cao", "metadata": {"doc_id": "a"}}]
+
+    reader = CorpusStore(path, readonly=True)
+    assert reader.get_chunk_texts(["a-1", "a-2", "missing"]) == {"a-1": "Sốt cao"}
+
+def test_json_import_export(tmp_path):
+    with open(tmp_path / "full_contents.json", "w", encoding="utf-8") as f:
+        json.dump([document("a", "Bệnh sốt"), None], f, ensure_ascii=False)
+    with open(tmp_path / "detailed_chunks.json", "w", encoding="utf-8") as f:
+        json.dump(sections("a", "Sốt cao", "Hạ sốt"), f, ensure_ascii=False)
+
+    store = CorpusStore(str(tmp_path / "corpus.db"))
+    store.import_json(str(tmp_path / "full_contents.json"), str(tmp_path / "detailed_chunks.json"))
+    out = tmp_path / "out"
+    out.mkdir()
+    store.export_json(str(out))
+
+    with open(out / "full_contents.json", encoding="utf-8") as f:
+        assert json.load(f) == [document("a", "Bệnh sốt")]
+    with open(out / "detailed_chunks.json", encoding="utf-8") as f:
+        assert json.load(f) == sections("a", "Sốt cao", "Hạ sốt")
@@ -0,0 +1,28 @@
+import pytest
+from intent_router import classify_intent, is_follow_up, GREETING, MEDICAL
+
+@pytest.mark.parametrize("message", [
+    "Nó có nguy hiểm không?",
+    "Còn trẻ em thì sao?",
+    "Còn người lớn?",
+    "Bệnh này có lây không?",
+    "vay con nguoi lon thi sao",
+])
+def test_follow_up_questions(message):
+    assert is_follow_up(message)
+
+@pytest.mark.parametrize("message", [
+    "Bé vẫn còn sốt sau hai ngày",
+    "Trẻ bị sốt cao phải làm gì?",
+    "Cảm ơn bạn",
+    # Không dấu: "con", "no" là từ thông thường
+    "con toi bi sot",
+    "no co lay khong",
+    "Nó có nguy hiểm không khi trẻ sơ sinh bị sốt cao kéo dài nhiều ngày liền?",
+])
+def test_not_follow_up_questions(message):
+    assert not is_follow_up(message)
+
+def test_classify_intent_without_index():
+    assert classify_intent("Xin chào") == GREETING
+    assert classify_intent("Chào bạn, tôi bị sốt") == MEDICAL
@@ -0,0 +1,41 @@
+import pytest
+import rag
+from components import registry
+from lexical_index import LexicalIndex
+
+def chunk(doc_id, n, text):
+    return {"id": f"{doc_id}-{n}", "text": text, "metadata": {"doc_id": doc_id}}
+
+@pytest.fixture
+def lexical_index(monkeypatch):
+    index = LexicalIndex.build([
+        chunk("soi", 0, "Bệnh sởi gây sốt cao, phát ban và ho."),
+        chunk("soi", 1, "Trẻ bị sởi cần được hạ sốt và bù nước."),
+        chunk("cum", 0, "Cúm mùa gây sốt, đau họng và mệt mỏi."),
+        chunk("tcm", 0, "Bệnh tay chân miệng gây sốt nhẹ và loét miệng."),
+        chunk("rota", 0, "Tiêu chảy do virus Rota, phòng ngừa bằng vắc xin Rotavirus uống."),
+    ])
+    monkeypatch.setitem(registry._instances, "lexical_index", index)
+    return index
+
+def test_generic_query_has_no_margin(lexical_index):
+    hits = lexical_index.search("sốt")
+    # Mọi bài đều chứa "sốt": độ phủ đầy đủ nhưng không phải là độ tin cậy
+    assert lexical_index.confidence("sốt", hits) == 1.0
+    assert lexical_index.margin(hits) < 0.3
+
+def test_distinctive_query_has_margin(lexical_index):
+    hits = lexical_index.search("vắc xin Rotavirus")
+    assert lexical_index.items[hits[0][0]]["metadata"]["doc_id"] == "rota"
+    assert lexical_index.margin(hits) == 1.0
+
+def test_lexical_only_shortcut_is_off_by_default(lexical_index):
+    assert rag.LEXICAL_ONLY_MARGIN > 1
+    assert rag.lexical_only_results("vắc xin Rotavirus") is None
+
+def test_generic_short_query_skips_shortcut(lexical_index, monkeypatch):
+    monkeypatch.setattr(rag, "LEXICAL_ONLY_MARGIN", 0.5)
+    for query in ["sốt", "gây sốt"]:
+        assert rag.lexical_only_results(query) is None
+    results = rag.lexical_only_results("vắc xin Rotavirus")
+    assert results[0][0].metadata["doc_id"] == "rota"
@@ -0,0 +1,104 @@
+import time
+import pytest
+from langchain_core.runnables import Runnable
+from llm_client import (
+    CircuitBreaker, CircuitOpenError, FakeChatModel, LLMTimeout, ResilientLLM, is_upstream_error
+)
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    # Thành công ở giữa đặt lại bộ đếm
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.is_open()
+    assert not breaker.allow()
+    assert breaker.stats()["opened"] == 1
+    assert breaker.stats()["rejected"] == 1
+
+def test_breaker_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert not breaker.is_open()
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert breaker.is_open()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+def test_breaker_failed_trial_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.stats()["opened"] == 2
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+def test_upstream_errors_are_told_apart_from_bugs():
+    assert is_upstream_error(LLMTimeout("LLM call exceeded 20s"))
+    assert is_upstream_error(StatusError(429))
+    assert is_upstream_error(StatusError(503))
+    assert is_upstream_error(RuntimeError("Fake LLM error (503 Service unavailable)"))
+    assert not is_upstream_error(StatusError(400))
+    assert not is_upstream_error(TypeError("unsupported operand"))
+    assert not is_upstream_error(KeyError("question"))
+
+class BrokenModel(Runnable):
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def invoke(self, input, config=None, **kwargs):
+        self.calls += 1
+        raise self.error
+
+def test_resilient_llm_bugs_are_not_retried_or_counted():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    model = BrokenModel(TypeError("bad prompt"))
+    llm = ResilientLLM(model, max_retries=2, hedge=False, breaker=breaker, base_delay=0)
+    with pytest.raises(TypeError):
+        llm.invoke("x")
+    assert model.calls == 1
+    assert breaker.state == "closed"
+
+def test_resilient_llm_upstream_errors_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    model = BrokenModel(StatusError(429))
+    llm = ResilientLLM(model, max_retries=2, hedge=False, breaker=breaker, base_delay=0)
+    with pytest.raises(CircuitOpenError):
+        llm.invoke("x")
+    assert model.calls == 2
+    assert breaker.state == "open"
+
+def test_fake_model_calls_bound_tool_then_answers():
+    from langchain_core.messages import HumanMessage, ToolMessage
+    from langchain_core.tools import tool
+
+    @tool
+    def lookup(question: str) -> str:
+        """Look up documents"""
+        return question
+
+    model = FakeChatModel(latency=0.0, token_delay=0.0).bind_tools([lookup])
+    call = model.invoke([HumanMessage(content="Sốt?")])
+    assert call.tool_calls[0]["name"] == "lookup"
+    assert call.tool_calls[0]["args"] == {"question": "Sốt?"}
+    answer = model.invoke([HumanMessage(content="Sốt?"), call,
+                           ToolMessage(content="Nguồn: https://vnvc.vn/sot", tool_call_id=call.tool_calls[0]["id"])])
+    assert not answer.tool_calls
+    assert "https://vnvc.vn/sot" in answer.content
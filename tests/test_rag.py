@@ -0,0 +1,18 @@
+import rag
+from components import registry
+
+class NoSummaries:
+    def similarity_search_by_vector(self, embedding, k, filter=None):
+        return []
+
+class FailingDetail:
+    def similarity_search_by_vector(self, embedding, k, filter=None):
+        raise AssertionError("detail search must not run without candidate documents")
+
+def test_hierarchical_search_without_summaries_returns_nothing(monkeypatch):
+    monkeypatch.setattr(registry, "_instances", dict(registry._instances))
+    registry.override("vector_index", None)
+    registry.override("chroma_summary", NoSummaries())
+    registry.override("chroma_detail", FailingDetail())
+    monkeypatch.setattr(rag, "HIERARCHICAL_SEARCH", True)
+    assert rag.search_by_vector([1.0, 0.0]) == []
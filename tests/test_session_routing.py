@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+import model
+from components import registry
+from conversation import new_state
+from context_packing import NO_CONTEXT
+from intent_router import THANKS_RESPONSE, OUT_OF_SCOPE_RESPONSE
+from lexical_index import LexicalIndex
+
+@pytest.fixture
+def session(monkeypatch):
+    """Session with one medical turn; retrieval is recorded instead of run"""
+    index = LexicalIndex.build([
+        {"id": "soi-0", "text": "Bệnh sởi: sốt cao, phát ban, ho và chảy nước mũi.", "metadata": {"doc_id": "soi"}},
+        {"id": "cum-0", "text": "Cúm mùa: sốt, đau họng, đau đầu và mệt mỏi.", "metadata": {"doc_id": "cum"}},
+    ])
+    monkeypatch.setitem(registry._instances, "lexical_index", index)
+    monkeypatch.setattr(model, "CACHE_ENABLED", False)
+    calls = []
+
+    def retrieval(state, message, follow_up):
+        calls.append((message, follow_up))
+        return NO_CONTEXT, None
+
+    monkeypatch.setattr(model, "session_retrieval", retrieval)
+    state = new_state()
+    state["turns"].append({"question": "Bệnh sởi có triệu chứng gì?", "answer": "Sốt cao, phát ban."})
+    return state, calls
+
+def answer(message, state):
+    async def collect():
+        return [piece async for piece in model.astream_chat_with_pipeline(message, state=state)]
+    return "".join(piece for piece in asyncio.run(collect()) if isinstance(piece, str))
+
+def test_chit_chat_in_session_gets_direct_answer(session):
+    state, calls = session
+    assert answer("Cảm ơn bạn", state) == THANKS_RESPONSE
+    assert answer("Hôm nay trời đẹp quá", state) == OUT_OF_SCOPE_RESPONSE
+    assert calls == []
+
+def test_pronoun_follow_up_is_retrieved_with_its_subject(session):
+    state, calls = session
+    answer("Nó có nguy hiểm không?", state)
+    assert calls == [("Nó có nguy hiểm không?", True)]
+
+def test_new_question_in_session_is_not_a_follow_up(session):
+    state, calls = session
+    answer("Cúm mùa có triệu chứng gì?", state)
+    assert calls == [("Cúm mùa có triệu chứng gì?", False)]
+
+def test_context_reuse_needs_the_same_top_article(monkeypatch):
+    index = LexicalIndex.build([
+        {"id": "soi-0", "text": "Bệnh sởi: sốt cao, phát ban.", "metadata": {"doc_id": "soi"}},
+        {"id": "cum-0", "text": "Cúm mùa: sốt, đau họng.", "metadata": {"doc_id": "cum"}},
+    ])
+    monkeypatch.setitem(registry._instances, "lexical_index", index)
+    # Embedding coi mọi câu hỏi là gần nhau: chỉ BM25 phân biệt được bệnh
+    monkeypatch.setattr(model, "similar_questions", lambda a, b: True)
+    monkeypatch.setattr(model, "retrieve_context", lambda question: f"context: {question}")
+    state = new_state()
+    state["retrieval"] = {"question": "Bệnh sởi có phát ban không?", "context": "context: sởi"}
+
+    assert model.session_retrieval(state, "Bệnh sởi phát ban mấy ngày?", False) == ("context: sởi", None)
+    context, retrieval = model.session_retrieval(state, "Cúm mùa đau họng mấy ngày?", False)
+    assert context == "context: Cúm mùa đau họng mấy ngày?"
+    assert retrieval["question"] == "Cúm mùa đau họng mấy ngày?"
@@ -0,0 +1,172 @@
+import os
+import json
+import numpy as np
+from langchain_core.documents import Document
+
+# Các kiểu lưu trữ vector được hỗ trợ
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+class NumpyVectorIndex:
+    """
+    In-process hierarchical summary -> detail index.
+
+    Summary and detail vectors live in one contiguous matrix (summaries first),
+    with detail rows sorted by doc_id so every document owns a row range.
+    Deduplicated chunks shared by several articles (metadata source_doc_ids)
+    are stored once and listed as extra rows of the other articles.
+    A search is one matrix product against all query vectors followed by slicing.
+    Vectors are expected to be L2-normalized, so inner product == cosine similarity.
+    """
+
+    def __init__(self, vectors, scales, summaries, details, ranges, dtype="float32", aliases=None):
+        self.vectors = vectors
+        self.scales = scales
+        self.summaries = summaries
+        self.details = details
+        self.ranges = ranges
+        self.aliases = aliases or {}
+        self.dtype = dtype
+        self.n_summaries = len(summaries)
+
+    @classmethod
+    def build(cls, summary_embeddings, summaries, detail_embeddings, details, dtype="float32"):
+        """
+        Build the index from normalized embeddings.
+
+        Args:
+            summary_embeddings: one vector per summary
+            summaries (list[dict]): {"text", "metadata"} (+ optional "id") items, metadata must contain doc_id
+            detail_embeddings: one vector per detail chunk
+            details (list[dict]): {"text", "metadata"} (+ optional "id") items, metadata must contain doc_id
+            dtype (str): storage type, one of SUPPORTED_DTYPES
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+
+        summary_embeddings = np.asarray(summary_embeddings, dtype=np.float32)
+        detail_embeddings = np.asarray(detail_embeddings, dtype=np.float32)
+
+        # Sắp xếp chunk theo doc_id để mỗi tài liệu chiếm một dải hàng liên tục
+        order = sorted(range(len(details)), key=lambda i: details[i]["metadata"]["doc_id"])
+        details = [details[i] for i in order]
+        detail_embeddings = detail_embeddings[order] if order else detail_embeddings
+
+        ranges = {}
+        for row, item in enumerate(details):
+            doc_id = item["metadata"]["doc_id"]
+            start, _ = ranges.get(doc_id, (row, row))
+            ranges[doc_id] = (start, row + 1)
+
+        # Chunk dùng chung (đã khử trùng lặp) nằm ngoài dải hàng của các bài khác
+        aliases = {}
+        for row, item in enumerate(details):
+            for doc_id in item["metadata"].get("source_doc_ids") or []:
+                if doc_id != item["metadata"]["doc_id"]:
+                    aliases.setdefault(doc_id, []).append(row)
+
+        matrix = np.vstack([summary_embeddings, detail_embeddings]) if len(details) else summary_embeddings
+        vectors, scales = cls._quantize(matrix, dtype)
+        return cls(vectors, scales, summaries, details, ranges, dtype, aliases)
+
+    @staticmethod
+    def _quantize(matrix, dtype):
+        if dtype == "int8":
+            # Per-row symmetric quantization, scores are rescaled at query time
+            scales = np.abs(matrix).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            vectors = np.round(matrix / scales[:, None]).astype(np.int8)
+            return vectors, scales.astype(np.float32)
+        return matrix.astype(dtype), None
+
+    def save(self, path):
+        """Save to a directory: vectors.npy (+ scales.npy) and meta.json"""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), np.ascontiguousarray(self.vectors))
+        if self.scales is not None:
+            np.save(os.path.join(path, "scales.npy"), self.scales)
+        meta = {
+            "dtype": self.dtype,
+            "summaries": self.summaries,
+            "details": self.details,
+            "ranges": {doc_id: list(r) for doc_id, r in self.ranges.items()},
+            "aliases": self.aliases,
+        }
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load an index saved by `save`. With mmap=True the vector matrix is
+        memory-mapped read-only, so several worker processes share the same pages.
+        """
+        mmap_mode = "r" if mmap else None
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode=mmap_mode)
+        scales_path = os.path.join(path, "scales.npy")
+        scales = np.load(scales_path) if os.path.exists(scales_path) else None
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        ranges = {doc_id: tuple(r) for doc_id, r in meta["ranges"].items()}
+        return cls(
+            vectors, scales, meta["summaries"], meta["details"], ranges, meta["dtype"], meta.get("aliases")
+        )
+
+    def _scores(self, query_embeddings):
+        # float16/int8 được nâng lên float32 khi nhân ma trận
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        scores = self.vectors @ queries.T
+        if self.scales is not None:
+            scores = scores * self.scales[:, None]
+        return scores
+
+    @staticmethod
+    def _top_k(scores, k):
+        if len(scores) <= k:
+            return np.argsort(-scores)
+        top = np.argpartition(-scores, k)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def search_many(self, query_embeddings, k_summary=3, k_detail=10):
+        """
+        Hierarchical search for a batch of query vectors.
+        With k_summary=None the summaries are skipped and all detail chunks are searched (flat).
+
+        Returns:
+            list[list[Document]]: detail chunks per query, best first
+        """
+        scores = self._scores(query_embeddings)
+        results = []
+        for j in range(scores.shape[1]):
+            column = scores[:, j]
+
+            if k_summary is None:
+                rows = np.arange(len(self.details))
+            else:
+                # Top-k summaries -> doc_ids
+                summary_rows = self._top_k(column[:self.n_summaries], k_summary)
+                doc_ids = {self.summaries[i]["metadata"]["doc_id"] for i in summary_rows}
+
+                # Top-k details restricted to the row ranges (+ shared chunks) of those documents
+                rows = np.concatenate([
+                    np.arange(*self.ranges[doc_id]) for doc_id in doc_ids if doc_id in self.ranges
+                ] + [
+                    np.asarray(self.aliases[doc_id], dtype=np.int64) for doc_id in doc_ids if doc_id in self.aliases
+                ] or [np.empty(0, dtype=np.int64)])
+                if len(doc_ids) > 1:
+                    rows = np.unique(rows)
+            detail_scores = column[self.n_summaries + rows]
+            best = rows[self._top_k(detail_scores, k_detail)]
+
+            results.append([
+                Document(
+                    id=self.details[i].get("id"),
+                    page_content=self.details[i]["text"],
+                    metadata=self.details[i]["metadata"]
+                )
+                for i in best
+            ])
+        return results
+
+    def search(self, query_embedding, k_summary=3, k_detail=10):
+        """Hierarchical (or flat, k_summary=None) search for a single query vector"""
+        return self.search_many([query_embedding], k_summary, k_detail)[0]